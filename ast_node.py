@@ -1,9 +1,11 @@
 class AstNode:
-    # Base class for all AST nodes
-    pass
+    # Base class for all AST nodes; __slots__ keeps large trees free of per-node dicts
+    __slots__ = ()
 
 
 class LambdaExpr(AstNode):
+    __slots__ = ('parameters', 'expr_body')
+
     def __init__(self, parameters, expr_body):
         self.parameters = parameters
         self.expr_body = expr_body
@@ -13,6 +15,8 @@ class LambdaExpr(AstNode):
 
 
 class FuncDef(AstNode):
+    __slots__ = ('func_name', 'parameters', 'func_body')
+
     def __init__(self, func_name, parameters, func_body):
         self.func_name = func_name
         self.parameters = parameters
@@ -23,6 +27,8 @@ class FuncDef(AstNode):
 
 
 class IfStmt(AstNode):
+    __slots__ = ('cond', 'then_branch', 'else_branch')
+
     def __init__(self, cond, then_branch, else_branch=None):
         self.cond = cond
         self.then_branch = then_branch  # do if true
@@ -33,15 +39,21 @@ class IfStmt(AstNode):
 
 
 class FuncApp(AstNode):
+    __slots__ = ('function', 'arguments', 'depth', 'index')
+
     def __init__(self, function, arguments):
         self.function = function
         self.arguments = arguments
+        self.depth = None  # static address of the callee when called by name, set by the resolver
+        self.index = None
 
     def __repr__(self):
         return f"func_app(function={self.function}, arguments={self.arguments})"
 
 
 class BinOp(AstNode):
+    __slots__ = ('left', 'op', 'right')
+
     def __init__(self, left, op, right):
         self.left = left
         self.op = op
@@ -52,6 +64,8 @@ class BinOp(AstNode):
 
 
 class UnaryOp(AstNode):
+    __slots__ = ('op', 'operand')
+
     def __init__(self, op, operand):
         self.op = op
         self.operand = operand
@@ -61,6 +75,8 @@ class UnaryOp(AstNode):
 
 
 class IntLit(AstNode):
+    __slots__ = ('val',)
+
     def __init__(self, val):
         self.val = val
 
@@ -69,16 +85,76 @@ class IntLit(AstNode):
 
 
 class Identifier(AstNode):
+    __slots__ = ('id_name', 'depth', 'index')
+
     def __init__(self, id_name):
         self.id_name = id_name
+        self.depth = None  # static address of the binding, set by the resolver; None means global
+        self.index = None
 
     def __repr__(self):
         return f"identifier(id_name={self.id_name})"
 
 
 class BoolLit(AstNode):
+    __slots__ = ('val',)
+
     def __init__(self, val):
         self.val = val
 
     def __repr__(self):
         return f"bool_lit(val={self.val})"
+
+
+class SharedExpr(AstNode):
+    # An expression that a Defunc body evaluates more than once per call (optimizer.share_subexpressions):
+    # the first evaluation keeps its value in slot `slot` of the call's frame for the others
+    __slots__ = ('expr', 'slot')
+
+    def __init__(self, expr, slot):
+        self.expr = expr
+        self.slot = slot
+
+    def __repr__(self):
+        return repr(self.expr)  # printed function bodies look the same as before the optimization
+
+
+def children(node):
+    # Child nodes in evaluation order; a function called by name has no callee node
+    if isinstance(node, BinOp):
+        return [node.left, node.right]
+    elif isinstance(node, UnaryOp):
+        return [node.operand]
+    elif isinstance(node, IfStmt):
+        return [node.cond, node.then_branch] + ([node.else_branch] if node.else_branch is not None else [])
+    elif isinstance(node, FuncApp):
+        return ([] if isinstance(node.function, str) else [node.function]) + list(node.arguments)
+    elif isinstance(node, LambdaExpr):
+        return [node.expr_body]
+    elif isinstance(node, FuncDef):
+        return [node.func_body]
+    elif isinstance(node, SharedExpr):
+        return [node.expr]
+    return []
+
+
+def replace_children(node, new_children):
+    if isinstance(node, BinOp):
+        node.left, node.right = new_children
+    elif isinstance(node, UnaryOp):
+        node.operand, = new_children
+    elif isinstance(node, IfStmt):
+        node.cond, node.then_branch = new_children[:2]
+        if node.else_branch is not None:
+            node.else_branch = new_children[2]
+    elif isinstance(node, FuncApp):
+        if not isinstance(node.function, str):
+            node.function = new_children[0]
+            new_children = new_children[1:]
+        node.arguments = list(new_children)
+    elif isinstance(node, LambdaExpr):
+        node.expr_body, = new_children
+    elif isinstance(node, FuncDef):
+        node.func_body, = new_children
+    elif isinstance(node, SharedExpr):
+        node.expr, = new_children
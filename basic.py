@@ -1,15 +1,95 @@
+# Kinds of Closure
+DEFUNC, LAMBDA = range(2)
+
+
+class Closure:
+    # A function value with the environment it was created in. A Defunc binds its arity arguments into
+    # one frame; a lambda takes one argument per application, but when it starts a chain of directly
+    # nested lambdas (chain = (names, body) from resolver.flatten_chain) and gets enough arguments, the
+    # whole chain is bound into one frame and runs the chain's body. Bodies are whatever the engine runs.
+    __slots__ = ('kind', 'parameters', 'names', 'arity', 'body', 'env', 'chain')
+
+    def __init__(self, kind, parameters, body, env, chain=None):
+        self.kind = kind
+        self.parameters = parameters  # list of names for a Defunc, one name for a lambda
+        self.names = parameters if kind == DEFUNC else [parameters]  # names of the frame's slots
+        self.arity = len(self.names)
+        self.body = body
+        self.env = env
+        self.chain = chain
+
+    def __repr__(self):
+        return repr((self.parameters, self.body, self.env))
+
+
 class Environment:
+    # Global scope: Defun binds names at run time, so they live in a dict
+    __slots__ = ('parent', 'variables')
+
     def __init__(self, parent=None, variables=None):
         self.parent = parent
         self.variables = variables if variables is not None else {}
 
-    def set(self, name, value):
+    def define(self, name, value):
         self.variables[name] = value
 
+    set = define
+
+    def extend_scope(self, names, values):
+        return Frame(names, values, self)
+
     def get(self, name):
         if name in self.variables:
             return self.variables[name]
         elif self.parent:
             return self.parent.get(name)
         else:
-            raise NameError(f"Undefined identifier: {name}")
+            raise NameError(f"Undefined variable: {name}")
+
+
+class Unset:
+    # Value of a frame slot whose SharedExpr has not been evaluated yet; a class rather than an instance,
+    # so it stays the same object when a frame is pickled for a worker process
+    pass
+
+
+class Frame:
+    # Local scope of one call: argument values sit in slots addressed by the resolver's (depth, index),
+    # followed by the values of the body's SharedExprs once they are computed
+    __slots__ = ('names', 'slots', 'parent')
+
+    def __init__(self, names, slots, parent):
+        self.names = names
+        self.slots = slots
+        self.parent = parent
+
+    def lookup(self, depth, index):
+        frame = self
+        while depth:
+            frame = frame.parent
+            depth -= 1
+        return frame.slots[index]
+
+    def define(self, name, value):
+        self.names = list(self.names) + [name]
+        self.slots.append(value)
+
+    def share(self, slot, value):
+        slots = self.slots
+        if len(slots) <= slot:
+            slots.extend([Unset] * (slot + 1 - len(slots)))
+        slots[slot] = value
+        return value
+
+    set = define
+
+    def extend_scope(self, names, values):
+        return Frame(names, values, self)
+
+    def get(self, name):
+        # Lookup by name for unresolved identifiers; the last binding of a repeated name wins
+        names = self.names
+        for index in range(len(names) - 1, -1, -1):
+            if names[index] == name:
+                return self.slots[index]
+        return self.parent.get(name)
@@ -0,0 +1,204 @@
+from cache import compile_source, load_program
+from compiler import CompiledInterpreter
+from interpreter import Interpreter
+from memo import MemoCache
+from vm import VMInterpreter
+import argparse
+import contextlib
+import glob
+import io
+import json
+import multiprocessing
+import os
+import resource
+import signal
+import sys
+import time
+
+
+ENGINES = {
+    'walker': Interpreter,
+    'compile': CompiledInterpreter,
+    'vm': VMInterpreter,
+}
+
+
+class ProgramTimeout(BaseException):
+    # Not an Exception, so the engines' error handling cannot swallow it
+    pass
+
+
+def collect_programs(inputs):
+    # Each input is a directory (searched recursively), a manifest listing one path per line, or a glob
+    programs = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for directory, _, files in sorted(os.walk(item)):
+                programs.extend(os.path.join(directory, name) for name in sorted(files) if name.endswith(".lambda"))
+        elif os.path.isfile(item) and not item.endswith(".lambda"):
+            base = os.path.dirname(item)
+            with open(item, 'r') as manifest:
+                for line in manifest:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        programs.append(os.path.join(base, line))
+        else:
+            matches = sorted(glob.glob(item, recursive=True))
+            programs.extend(matches if matches else [item])  # a missing file is reported as its own error
+    return programs
+
+
+# Settings of the worker processes, set once per worker by init_worker
+worker_settings = {}
+
+
+def init_worker(settings):
+    worker_settings.update(settings)
+    if settings['memory_mb']:
+        limit = settings['memory_mb'] * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    signal.signal(signal.SIGALRM, on_timeout)
+
+
+def on_timeout(signum, frame):
+    raise ProgramTimeout()
+
+
+def run_program(path):
+    # Runs one program in this worker and describes the outcome as a JSON-serializable dict
+    settings = worker_settings
+    load = load_program if settings['cache'] else run_uncached
+    return run_record({'file': path, 'status': 'ok'}, lambda: load(path, settings['opt_level']), settings['timeout'])
+
+
+def run_source(source, deadline=None):
+    # Runs program text, as the evaluation server (server.py) sends it. deadline is a time.monotonic()
+    # value, a clock all processes of the machine share: the program is stopped when it is reached,
+    # and not started at all when it passed while the program was queued
+    settings = worker_settings
+    timeout = settings['timeout']
+    if deadline is not None:
+        remaining = round(deadline - time.monotonic(), 3)
+        if remaining <= 0:
+            return {'status': 'timeout', 'error': "deadline passed before the program started", 'seconds': 0.0,
+                    'output': ''}
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    return run_record({'status': 'ok'}, lambda: compile_source(source, settings['opt_level']), timeout)
+
+
+def run_record(record, load, timeout):
+    # Runs the statements load() returns, stopping after timeout seconds, and fills in record
+    settings = worker_settings
+    output = io.StringIO()
+    start = time.perf_counter()
+    if timeout:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        with contextlib.redirect_stdout(output):
+            ast = load()
+            memo = MemoCache(settings['memo_size']) if settings['memo'] else None
+            interpreter = ENGINES[settings['engine']](ast, memo)
+            record['result'] = repr(execute(interpreter, ast, record))
+    except ProgramTimeout:
+        record['status'] = 'timeout'
+        record['error'] = f"exceeded {timeout} seconds"
+    except MemoryError:
+        record['status'] = 'memory'
+        record['error'] = f"exceeded {settings['memory_mb']} MB"
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = f"{type(e).__name__}: {e}"
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+    record['seconds'] = round(time.perf_counter() - start, 6)
+    record['output'] = output.getvalue()
+    return record
+
+
+def run_uncached(path, opt_level):
+    with open(path, 'r') as file:
+        return compile_source(file.read(), opt_level)
+
+
+def execute(interpreter, statements, record):
+    # Interpreter.execute, except that failed statements are also listed in the record and running
+    # out of memory ends the program
+    result = None
+    for node in statements:
+        try:
+            result = interpreter.evaluate(node, interpreter.global_env)
+            if result is not None:
+                print(result)
+        except Exception as e:
+            if caused_by(e, MemoryError):
+                raise MemoryError() from e
+            print(f"Error during the interpretation of node {node}: {e}")
+            record['status'] = 'error'
+            record.setdefault('errors', []).append(str(e))
+    return result
+
+
+def caused_by(error, error_type):
+    # The engines re-raise errors with a prefix, so the original one is in the context chain
+    while error is not None:
+        if isinstance(error, error_type):
+            return True
+        error = error.__context__
+    return False
+
+
+def run_batch(programs, jobs=None, timeout=None, memory_mb=None, engine='walker', opt_level=1,
+              memo=False, memo_size=4096, cache=True, chunksize=None):
+    # Yields one record per program, in completion order; workers are reused across programs
+    settings = {'timeout': timeout, 'memory_mb': memory_mb, 'engine': engine, 'opt_level': opt_level,
+                'memo': memo, 'memo_size': memo_size, 'cache': cache}
+    jobs = jobs or os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = max(1, min(16, len(programs) // (jobs * 8)))
+    with multiprocessing.Pool(jobs, initializer=init_worker, initargs=(settings,)) as pool:
+        for record in pool.imap_unordered(run_program, programs, chunksize):
+            yield record
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description="Run many .lambda programs in a pool of worker processes.")
+    arg_parser.add_argument("inputs", nargs="+",
+                            help="directories, glob patterns or manifest files listing one program per line")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=None,
+                            help="number of worker processes (default: number of CPUs)")
+    arg_parser.add_argument("--timeout", type=float, default=None,
+                            help="seconds each program may run before it is stopped")
+    arg_parser.add_argument("--memory-mb", type=int, default=None,
+                            help="address space limit of each worker process, in MB")
+    arg_parser.add_argument("--engine", choices=sorted(ENGINES), default='walker',
+                            help="execution engine (default: walker)")
+    arg_parser.add_argument("-O", dest="opt_level", type=int, choices=[0, 1, 2], default=1,
+                            help="optimization level, as for main.py")
+    arg_parser.add_argument("--memo", action="store_true",
+                            help="cache results of Defunc calls with integer/boolean arguments")
+    arg_parser.add_argument("--memo-size", type=int, default=4096,
+                            help="maximum number of cached results per program")
+    arg_parser.add_argument("--no-cache", action="store_true",
+                            help="always parse the files instead of reusing __lambdacache__ entries")
+    arg_parser.add_argument("-o", "--output", default=None,
+                            help="write the JSON lines to this file instead of stdout")
+    return arg_parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    programs = collect_programs(args.inputs)
+    counts = {}
+    start = time.perf_counter()
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for record in run_batch(programs, args.jobs, args.timeout, args.memory_mb, args.engine, args.opt_level,
+                                args.memo, args.memo_size, not args.no_cache):
+            output.write(json.dumps(record) + "\n")
+            counts[record['status']] = counts.get(record['status'], 0) + 1
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+    print(f"{len(programs)} programs in {time.perf_counter() - start:.2f}s: {summary or 'nothing to run'}",
+          file=sys.stderr)
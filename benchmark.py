@@ -0,0 +1,1015 @@
+from basic import Closure
+import batch
+import cache
+from compiler import CompiledInterpreter
+from fuel import MeteredInterpreter, Task, Scheduler
+from incremental import IncrementalProgram
+from interpreter import Interpreter
+from lazy import LazyInterpreter
+from lexer import Lexer
+import ll_parser
+from ll_parser import LLParser
+from memo import MemoCache
+from node_pool import NodePool
+from optimizer import Optimizer, count_nodes
+from parallel import ParallelInterpreter
+from session import Session
+from vm import VMInterpreter
+from parser import Parser
+from profiler import ProfilingInterpreter, Sampler
+from scanner import Scanner
+import server
+import vectorize
+import argparse
+import asyncio
+import contextlib
+import gc
+import glob
+import json
+import platform
+import io
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+FIB = """
+Defun {name: fib, arguments: (n,)} if (n < 2) {n} else {fib(n - 1) + fib(n - 2)}
+fib(18)
+"""
+
+FACTORIAL = """
+Defun {name: fact, arguments: (n,)} if (n == 0) {1} else {n * fact(n - 1)}
+Defun {name: repeat, arguments: (k,)} if (k == 0) {0} else {fact(100) % 7 + repeat(k - 1)}
+repeat(100)
+"""
+
+CLOSURES = """
+Defun {name: loop, arguments: (n, acc,)} if (n == 0) {acc} else {loop(n - 1, acc + (Lambd a. (Lambd b. (Lambd c. a + b + c + n)))(1, 2, 3))}
+Defun {name: rep, arguments: (k,)} if (k == 0) {0} else {loop(100, 0) + rep(k - 1)}
+rep(30)
+"""
+
+CONSTANTS = """
+Defun {name: scale, arguments: (x,)} x * (60 * 60 * 24)
+Defun {name: step, arguments: (n, acc,)} if (n == 0 || False) {acc} else {step(n - 1, acc + scale(n) % (1000 + 7))}
+step(20000, 0)
+"""
+
+COUNTDOWN = """
+Defun {name: count, arguments: (n,)} if (n == 0) {0} else {count(n - 1)}
+count(100000)
+"""
+
+SUM = """
+Defun {name: sum, arguments: (n,)} if (n == 0) {0} else {n + sum(n - 1)}
+sum(100000)
+"""
+
+# Small programs on which every engine must agree with the tree walker
+CORPUS = [
+    "1 + 2 * 3",
+    "10 / 3 - 10 % 3",
+    "True || (1 / 0)",
+    "False || 7",
+    "0 || False",
+    "False && (1 / 0)",
+    "3 && 4",
+    "!(1 == 2) && (2 <= 2)",
+    "if (1 > 2) {1}",
+    "if (1 > 2) {1} else {(Lambd x. x * 2)(5)}",
+    "(Lambd x. (Lambd y. x - y))(10, 3)",
+    "(Lambd x. x)()",
+    "(Lambd x. (Lambd y. (Lambd z. x * y + z)))(2, 3, 4)",
+    "Defun {name: add, arguments: (a, b,)} a + b\nadd(2, add(3, 4))",
+    "Defun {name: mk, arguments: (n,)} (Lambd x. x + n)\nmk(5)(6)",
+    "Defun {name: even, arguments: (n,)} if (n == 0) {True} else {odd(n - 1)}\n"
+    "Defun {name: odd, arguments: (n,)} if (n == 0) {False} else {even(n - 1)}\neven(1001)",
+    "Defun {name: zero, arguments: ()} 42\nzero()",
+    "Defun {name: f, arguments: (n,)} n\nf(1, 2)",
+    "undefined_name + 1",
+    "1 / 0",
+    "(Lambd x. x)(1, 2)",
+]
+
+
+# Divide and conquer: both halves of each call are heavy and independent
+RANGE_SUM = """
+Defun {name: tsum, arguments: (lo, hi,)} if (lo == hi) {lo * lo % 7} else {tsum(lo, (lo + hi) / 2) + tsum((lo + hi) / 2 + 1, hi)}
+tsum(1, 150000)
+"""
+
+PROGRAMS = {
+    'fib': FIB,
+    'factorial': FACTORIAL,
+    'closures': CLOSURES,
+}
+
+
+def generate_source(path, functions):
+    # A large synthetic program: a chain of small Defuncs and one call at the end
+    with open(path, 'w') as file:
+        for index in range(functions):
+            callee = max(index - 1, 0)
+            file.write(f"Defun {{name: f{index}, arguments: (a, b,)}} "
+                       f"if (a > b) {{a * 2 + f{callee}(b, a)}} else {{b - 1 + {index}}}  # step {index}\n")
+        file.write(f"f{functions - 1}(1, 2)\n")
+
+
+def generate_script(path, functions, expressions):
+    # A long generated script: a few Defuncs followed by many top-level expressions using them
+    generate_source(path, functions)
+    with open(path, 'a') as file:
+        for index in range(expressions):
+            file.write(f"f{index % functions}(3, 2) * {index} + (({index} - 1) % 7)\n")
+
+
+def measure_in_subprocess(code):
+    # Runs code in a fresh interpreter so ru_maxrss reflects that code alone; it prints its measurements
+    root = os.path.dirname(os.path.abspath(__file__))
+    prelude = f"import resource, sys, time\nsys.path.insert(0, {root!r})\n"
+    result = subprocess.run([sys.executable, '-c', prelude + code], capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+STREAM_MODES = {
+    'read+tokenize': """
+from lexer import Lexer
+from parser import Parser
+start = time.perf_counter()
+with open(PATH) as file:
+    statements = Parser(Lexer(file.read()).tokenize()).parse()
+first = time.perf_counter() - start
+""",
+    'stream+parse': """
+from lexer import Lexer
+from parser import Parser
+start = time.perf_counter()
+with open(PATH) as file:
+    statements = Parser(Lexer(file).stream()).parse()
+first = time.perf_counter() - start
+""",
+    'stream statements': """
+from lexer import Lexer
+from parser import Parser
+start = time.perf_counter()
+with open(PATH) as file:
+    statements = Parser(Lexer(file).stream()).statements()
+    next(statements)
+    first = time.perf_counter() - start
+    for statement in statements:
+        pass
+""",
+}
+
+
+PIPELINE_CHILD = """
+from main import run_file
+first = None
+
+class Probe:
+    def write(self, text):
+        global first
+        if first is None and text.strip() and not text.startswith('Starting'):
+            first = time.perf_counter() - start
+        return len(text)
+
+    def flush(self):
+        pass
+
+sys.stdout, real_stdout = Probe(), sys.stdout
+start = time.perf_counter()
+run_file(PATH, stream=STREAM)
+total = time.perf_counter() - start
+sys.stdout = real_stdout
+print(first, total, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def parse(source):
+    return Parser(Lexer(source).tokenize()).parse()
+
+
+def run(interpreter_class, source, opt_level=0, memo=None):
+    ast = Optimizer(opt_level).optimize(parse(source))
+    interpreter = interpreter_class(ast, memo)
+    result = None
+    for node in ast:
+        result = interpreter.evaluate(node, interpreter.global_env)
+    return result
+
+
+def best_of(function, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_compiled():
+    print(f"{'program':<12}{'walker (s)':>12}{'compiled (s)':>14}{'speedup':>10}")
+    for name, source in PROGRAMS.items():
+        expected = run(Interpreter, source)
+        if run(CompiledInterpreter, source) != expected:
+            raise RuntimeError(f"compiled result differs from the tree walker on {name}")
+        walker = best_of(lambda: run(Interpreter, source))
+        compiled = best_of(lambda: run(CompiledInterpreter, source))
+        print(f"{name:<12}{walker:>12.4f}{compiled:>14.4f}{walker / compiled:>9.2f}x")
+
+
+def bench_deep():
+    # Recursion far beyond sys.getrecursionlimit(), tail and non-tail
+    print(f"recursion limit: {sys.getrecursionlimit()}")
+    for name, source in (('countdown', COUNTDOWN), ('sum', SUM)):
+        result = run(Interpreter, source)
+        elapsed = best_of(lambda: run(Interpreter, source), repeat=3)
+        print(f"{name:<12}{elapsed:>10.4f}s  result={result}")
+
+
+def bench_optimizer():
+    # tests/test_optimizer.py checks that the levels agree
+    for level in (0, 1, 2):
+        elapsed = best_of(lambda: run(Interpreter, CONSTANTS, level))
+        print(f"-O{level}{elapsed:>10.4f}s")
+
+
+def bench_memo():
+    source = FIB.replace('fib(18)', 'fib(22)')
+    expected = run(Interpreter, source)
+    plain = best_of(lambda: run(Interpreter, source), repeat=3)
+    print(f"{'no memo':<16}{plain:>10.4f}s")
+    for maxsize in (8, 4096):
+        memo = MemoCache(maxsize)
+        if run(Interpreter, source, memo=memo) != expected:
+            raise RuntimeError("memoized result differs")
+        elapsed = best_of(lambda: run(Interpreter, source, memo=MemoCache(maxsize)), repeat=3)
+        print(f"{'memo ' + str(maxsize):<16}{elapsed:>10.4f}s  {memo.report()}")
+
+
+def bench_session():
+    # Per-line cost of a REPL session should not grow with the number of earlier lines
+    session = Session()
+    rows = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for count in (100, 1000, 5000):
+            while len(session.interpreter.global_env.variables) < count:
+                index = len(session.interpreter.global_env.variables)
+                session.feed(f"Defun {{name: f{index}, arguments: (n,)}} n * {index} + 1")
+            start = time.perf_counter()
+            for _ in range(200):
+                session.feed(f"f{count - 1}(3) + f0(4)")
+            rows.append((count, (time.perf_counter() - start) / 200))
+    for count, elapsed in rows:
+        print(f"{count:>6} definitions{elapsed * 1e6:>10.1f} us/line")
+
+
+def bench_stream():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'large.lambda')
+        generate_source(path, 25000)
+        print(f"source: {os.path.getsize(path) / 1e6:.1f} MB")
+        print(f"{'mode':<20}{'first stmt (s)':>16}{'total (s)':>12}{'peak RSS (MB)':>15}")
+        for mode, code in STREAM_MODES.items():
+            code = f"PATH = {path!r}\n" + code + (
+                "total = time.perf_counter() - start\n"
+                "print(first, total, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)\n")
+            first, total, rss = measure_in_subprocess(code)
+            print(f"{mode:<20}{float(first):>16.3f}{float(total):>12.3f}{int(rss) / 1024:>15.1f}")
+
+
+def bench_pipeline():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'generated.lambda')
+        generate_script(path, 100, 60000)
+        print(f"source: {os.path.getsize(path) / 1e6:.1f} MB")
+        print(f"{'run_file':<20}{'first output (s)':>18}{'total (s)':>12}{'peak RSS (MB)':>15}")
+        for stream in (False, True):
+            first, total, rss = measure_in_subprocess(f"PATH = {path!r}\nSTREAM = {stream}\n" + PIPELINE_CHILD)
+            label = 'stream' if stream else 'whole program'
+            print(f"{label:<20}{float(first):>18.3f}{float(total):>12.3f}{int(rss) / 1024:>15.1f}")
+
+
+def bench_pool():
+    # Retained memory of a large program held as node objects vs. flattened into a NodePool
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'large.lambda')
+        generate_script(path, 20000, 20000)
+        with open(path) as file:
+            source = file.read()
+    builds = {
+        'node objects': lambda: parse(source),
+        'node pool': lambda: NodePool().extend(Parser(Lexer(source).stream()).statements()),
+    }
+    print(f"{'representation':<16}{'nodes':>10}{'retained (MB)':>15}{'peak (MB)':>12}{'gc objects':>12}")
+    for name, build in builds.items():
+        gc.collect()
+        objects = len(gc.get_objects())
+        tracemalloc.start()
+        tree = build()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        objects = len(gc.get_objects()) - objects
+        nodes = len(tree) if isinstance(tree, NodePool) else NodePool().extend(tree).__len__()
+        print(f"{name:<16}{nodes:>10}{retained / 1e6:>15.1f}{peak / 1e6:>12.1f}{objects:>12}")
+        del tree
+    pool = NodePool().extend(parse(source))
+    if [type(node) for node in pool.statements()] != [type(node) for node in parse(source)]:
+        raise RuntimeError("node pool view differs from the parsed program")
+
+
+def outcome(interpreter_class, source):
+    # Function values hold engine-specific bodies, so only their parameters are compared
+    try:
+        result = run(interpreter_class, source)
+        if isinstance(result, Closure):
+            return f"function of {result.parameters}"
+        return repr(result)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+
+
+def bench_vm():
+    sources = CORPUS + [FIB, FACTORIAL, CLOSURES, CONSTANTS, COUNTDOWN, SUM]
+    for source in sources:
+        expected = outcome(Interpreter, source)
+        for engine in (CompiledInterpreter, VMInterpreter):
+            if outcome(engine, source) != expected:
+                raise RuntimeError(f"{engine.__name__} result differs from the tree walker on {source!r}")
+    print(f"{len(sources)} programs agree with the tree walker")
+    print(f"{'program':<12}{'walker (s)':>12}{'compiled (s)':>14}{'vm (s)':>10}{'vm speedup':>12}")
+    for name, source in dict(PROGRAMS, countdown=COUNTDOWN).items():
+        walker = best_of(lambda: run(Interpreter, source), repeat=3)
+        compiled = best_of(lambda: run(CompiledInterpreter, source), repeat=3)
+        vm = best_of(lambda: run(VMInterpreter, source), repeat=3)
+        print(f"{name:<12}{walker:>12.4f}{compiled:>14.4f}{vm:>10.4f}{walker / vm:>11.2f}x")
+
+
+def bench_cache():
+    # Cold start parses and optimizes the file; warm start maps the __lambdacache__ entry back to nodes
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'library.lambda')
+        generate_source(path, 5000)
+        print(f"source: {os.path.getsize(path) / 1e6:.1f} MB")
+        with open(path) as file:
+            source = file.read()
+        cold = best_of(lambda: cache.compile_source(source, 1), repeat=3)
+        expected = repr(cache.load_program(path))
+        print(f"cache entry: {os.path.getsize(cache.cache_path(path, 1)) / 1e6:.1f} MB")
+        if repr(cache.load_program(path)) != expected:
+            raise RuntimeError("cached program differs from the parsed one")
+        warm = best_of(lambda: cache.load_program(path), repeat=3)
+        print(f"{'load':<24}{'cold (s)':>10}{'warm (s)':>10}{'speedup':>10}")
+        print(f"{'parse+optimize / cache':<24}{cold:>10.3f}{warm:>10.3f}{cold / warm:>9.2f}x")
+        # Whole process, as `python main.py library.lambda` runs it
+        main = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+        process = {}
+        for flag in ('--no-cache', None):
+            def start():
+                arguments = [sys.executable, main, path] + ([flag] if flag else [])
+                subprocess.run(arguments, capture_output=True, check=True)
+            process[flag] = best_of(start, repeat=3)
+        cold, warm = process['--no-cache'], process[None]
+        print(f"{'python main.py':<24}{cold:>10.3f}{warm:>10.3f}{cold / warm:>9.2f}x")
+
+
+def bench_batch():
+    # CPU-bound corpus: one process per program vs. the worker pool at increasing sizes
+    cpus = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as directory:
+        for index in range(48):
+            with open(os.path.join(directory, f"p{index}.lambda"), 'w') as file:
+                file.write(FIB.replace('fib(18)', f'fib({16 + index % 3})'))
+        programs = batch.collect_programs([directory])
+        main = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+        start = time.perf_counter()
+        for path in programs:
+            subprocess.run([sys.executable, main, path], capture_output=True, check=True)
+        serial = time.perf_counter() - start
+        print(f"{len(programs)} programs, {cpus} CPUs")
+        print(f"{'runner':<20}{'wall (s)':>10}{'programs/s':>12}{'vs 1 worker':>13}")
+        print(f"{'main.py per file':<20}{serial:>10.3f}{len(programs) / serial:>12.1f}{'':>13}")
+        single = None
+        for jobs in sorted({1, 2, 4, cpus}):
+            if jobs > cpus:
+                continue
+            start = time.perf_counter()
+            records = list(batch.run_batch(programs, jobs))
+            elapsed = time.perf_counter() - start
+            if any(record['status'] != 'ok' for record in records):
+                raise RuntimeError("batch run failed")
+            single = single or elapsed
+            print(f"{f'batch -j {jobs}':<20}{elapsed:>10.3f}{len(programs) / elapsed:>12.1f}{single / elapsed:>12.2f}x")
+
+
+def run_parallel(source, workers):
+    # Includes starting the worker processes
+    ast = parse(source)
+    interpreter = ParallelInterpreter(ast, workers=workers)
+    interpreter.planner.learn(ast)
+    result = None
+    try:
+        for node in ast:
+            result = interpreter.evaluate(interpreter.planner.annotate(node), interpreter.global_env)
+    finally:
+        interpreter.close()
+    return result
+
+
+def bench_parallel():
+    cpus = os.cpu_count() or 1
+    print(f"{cpus} CPUs")
+    print(f"{'program':<12}{'workers':>8}{'time (s)':>10}{'speedup':>10}")
+    for name, source in (('fib', FIB.replace('fib(18)', 'fib(25)')), ('range sum', RANGE_SUM)):
+        expected = run(Interpreter, source)
+        sequential = best_of(lambda: run(Interpreter, source), repeat=1)
+        print(f"{name:<12}{'-':>8}{sequential:>10.3f}{1:>9.2f}x")
+        for workers in sorted({2, 4, cpus} - {1}):
+            if run_parallel(source, workers) != expected:
+                raise RuntimeError(f"parallel result differs on {name}")
+            elapsed = best_of(lambda: run_parallel(source, workers), repeat=1)
+            print(f"{name:<12}{workers:>8}{elapsed:>10.3f}{sequential / elapsed:>9.2f}x")
+
+
+def run_sampled(source):
+    ast = Optimizer(0).optimize(parse(source))
+    interpreter = Interpreter(ast)
+    result = None
+    with Sampler(interpreter):
+        for node in ast:
+            result = interpreter.evaluate(node, interpreter.global_env)
+    return result
+
+
+def run_profiled(source):
+    ast = Optimizer(0).optimize(parse(source))
+    interpreter = ProfilingInterpreter(ast)
+    result = None
+    for node in ast:
+        result = interpreter.evaluate(interpreter.instrument(node), interpreter.global_env)
+    return result
+
+
+def bench_profile():
+    # Cost of each profiling mode over the plain tree walker
+    print(f"{'program':<12}{'plain (s)':>11}{'sample (s)':>12}{'overhead':>10}{'calls (s)':>11}{'overhead':>10}")
+    for name, source in PROGRAMS.items():
+        expected = run(Interpreter, source)
+        if run_sampled(source) != expected or run_profiled(source) != expected:
+            raise RuntimeError(f"profiled result differs on {name}")
+        plain = best_of(lambda: run(Interpreter, source))
+        sampled = best_of(lambda: run_sampled(source))
+        profiled = best_of(lambda: run_profiled(source))
+        print(f"{name:<12}{plain:>11.4f}{sampled:>12.4f}{(sampled / plain - 1) * 100:>9.1f}%"
+              f"{profiled:>11.4f}{(profiled / plain - 1) * 100:>9.1f}%")
+
+
+SUITE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+
+
+def suite_programs(directory):
+    # The .lambda programs of the suite plus two large generated sources, as name -> source
+    programs = {}
+    for path in sorted(glob.glob(os.path.join(SUITE_DIR, '*.lambda'))):
+        with open(path) as file:
+            programs[os.path.splitext(os.path.basename(path))[0]] = file.read()
+    for name, generate in (('generated_source', lambda path: generate_source(path, 5000)),
+                           ('generated_script', lambda path: generate_script(path, 100, 5000))):
+        path = os.path.join(directory, name + '.lambda')
+        generate(path)
+        with open(path) as file:
+            programs[name] = file.read()
+    return programs
+
+
+def evaluate_all(statements):
+    interpreter = Interpreter(statements)
+    for node in statements:
+        try:
+            interpreter.evaluate(node, interpreter.global_env)
+        except Exception:
+            pass
+
+
+def measure_stages(source, repeat=5):
+    # Best time of Lexer.tokenize, Parser.parse (with the resolver) and Interpreter.evaluate on the parsed,
+    # unoptimized program, and the peak traced memory of one run of all three
+    tokens = Lexer(source).tokenize()
+    statements = Parser(tokens).parse()
+    result = {
+        'lex': best_of(lambda: Lexer(source).tokenize(), repeat),
+        'parse': best_of(lambda: Parser(tokens).parse(), repeat),
+        'evaluate': best_of(lambda: evaluate_all(statements), repeat),
+    }
+    del tokens, statements
+    gc.collect()
+    tracemalloc.start()
+    evaluate_all(Parser(Lexer(source).tokenize()).parse())
+    result['peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+    tracemalloc.stop()
+    return result
+
+
+def bench_suite():
+    results = {}
+    print(f"{'program':<20}{'lex (s)':>10}{'parse (s)':>11}{'evaluate (s)':>14}{'peak (MB)':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, source in suite_programs(directory).items():
+            result = results[name] = measure_stages(source)
+            print(f"{name:<20}{result['lex']:>10.4f}{result['parse']:>11.4f}{result['evaluate']:>14.4f}"
+                  f"{result['peak_kb'] / 1024:>11.1f}")
+    return results
+
+
+# A regression must be worse by the threshold and by these absolute amounts, so noise in tiny numbers is ignored
+NOISE_FLOOR = {'lex': 0.002, 'parse': 0.002, 'evaluate': 0.002, 'peak_kb': 64}
+
+
+def compare(baseline, results, threshold):
+    # Prints each metric against the baseline and returns the regressions found
+    regressions = []
+    print(f"{'benchmark':<30}{'metric':<10}{'baseline':>12}{'current':>12}{'change':>9}")
+    for bench_name, programs in results.items():
+        for program, metrics in programs.items():
+            previous = baseline.get(bench_name, {}).get(program)
+            if previous is None:
+                continue
+            for metric, value in metrics.items():
+                old = previous.get(metric)
+                if old is None:
+                    continue
+                change = (value - old) / old * 100 if old else 0.0
+                regressed = change > threshold and value - old > NOISE_FLOOR.get(metric, 0)
+                if regressed:
+                    regressions.append((bench_name, program, metric, change))
+                print(f"{bench_name + '/' + program:<30}{metric:<10}{old:>12.4f}{value:>12.4f}{change:>8.1f}%"
+                      f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def bench_scanner():
+    # Tokens per second of the regex alternation and of the hand-written Scanner, which must agree exactly
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'large.lambda')
+        generate_script(path, 20000, 20000)
+        with open(path) as file:
+            source = file.read()
+    expected = list(Lexer(source).regex_stream())
+    if Lexer(source).tokenize() != expected or list(Lexer(source.splitlines(True)).stream()) != expected:
+        raise RuntimeError("the Scanner's tokens differ from the regex lexer's")
+    print(f"source: {len(source) / 1e6:.1f} MB, {len(expected)} tokens")
+    print(f"{'lexer':<28}{'time (s)':>10}{'Mtokens/s':>11}")
+    modes = {
+        'regex alternation': lambda: list(Lexer(source).regex_stream()),
+        'Scanner.scan (arrays)': lambda: Scanner(source).scan(),
+        'Lexer.tokenize (tuples)': lambda: Lexer(source).tokenize(),
+        'Lexer.stream (lines)': lambda: list(Lexer(source.splitlines(True)).stream()),
+    }
+    for name, function in modes.items():
+        seconds = best_of(function, 3)
+        print(f"{name:<28}{seconds:>10.3f}{len(expected) / seconds / 1e6:>11.2f}")
+
+
+NESTINGS = {
+    'parentheses': lambda depth: '(' * depth + '1' + ')' * depth,
+    'operator chain': lambda depth: ' + '.join(['1'] * depth),
+    'mixed precedence': lambda depth: ' + '.join(['2 * 3 < 4 || 5 % 6 == 7'] * depth),
+    'negations': lambda depth: '!' * depth + 'True',
+    'nested calls': lambda depth: 'f(' * depth + '1' + ')' * depth,
+    'nested lambdas': lambda depth: '(Lambd x. ' * depth + 'x' + ')' * depth,
+}
+
+
+def bench_parser():
+    # Parser throughput on a large program, and parse time of expressions nested far past the recursion limit
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'large.lambda')
+        generate_script(path, 20000, 20000)
+        with open(path) as file:
+            tokens = Lexer(file.read()).tokenize()
+    seconds = best_of(lambda: Parser(tokens).parse(), 3)
+    print(f"large program: {len(tokens)} tokens in {seconds:.3f}s, {len(tokens) / seconds / 1e6:.2f} Mtokens/s")
+    depth = 20 * sys.getrecursionlimit()
+    print(f"{'nesting':<20}{'depth':>8}{'tokens':>10}{'parse (s)':>12}")
+    for name, build in NESTINGS.items():
+        tokens = Lexer(build(depth)).tokenize()
+        seconds = best_of(lambda: Parser(tokens).parse(), 3)
+        print(f"{name:<20}{depth:>8}{len(tokens):>10}{seconds:>12.4f}")
+
+
+def bench_ll():
+    # The table-driven LLParser against the hand-written Parser: same ASTs, throughput, deep nesting, and
+    # the cost of generating the table from BNF.txt against loading it from __lambdacache__
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'large.lambda')
+        generate_script(path, 20000, 20000)
+        with open(path) as file:
+            tokens = Lexer(file.read()).tokenize()
+    if repr(LLParser(tokens).parse()) != repr(Parser(tokens).parse()):
+        raise RuntimeError("LLParser and Parser build different trees")
+    print(f"large program: {len(tokens)} tokens")
+    print(f"{'parser':<20}{'time (s)':>10}{'Mtokens/s':>11}")
+    for name, parser_class in (('hand-written', Parser), ('LL(1) table', LLParser)):
+        seconds = best_of(lambda: parser_class(tokens).parse(), 3)
+        print(f"{name:<20}{seconds:>10.3f}{len(tokens) / seconds / 1e6:>11.2f}")
+    depth = 20 * sys.getrecursionlimit()
+    print(f"{'nesting':<20}{'depth':>8}{'Parser (s)':>12}{'LLParser (s)':>14}")
+    for name, build in NESTINGS.items():
+        tokens = Lexer(build(depth)).tokenize()
+        hand = best_of(lambda: Parser(tokens).parse(), 3)
+        table = best_of(lambda: LLParser(tokens).parse(), 3)
+        print(f"{name:<20}{depth:>8}{hand:>12.4f}{table:>14.4f}")
+    with open(ll_parser.BNF_PATH) as file:
+        text = file.read()
+    generate = best_of(lambda: ll_parser.generate(ll_parser.read_bnf(text)), 5)
+
+    def load():
+        ll_parser._grammars.clear()
+        ll_parser.load_grammar()
+
+    load()
+    print(f"table: generated in {generate * 1e3:.2f} ms, loaded from the cache in {best_of(load, 5) * 1e3:.2f} ms")
+
+
+NUMERIC = """
+Defun {name: poly, arguments: (x,)} 3 * x * x - 7 * x + 11
+Defun {name: collatz, arguments: (n,)} if (n % 2 == 0) {n / 2} else {3 * n + 1}
+Defun {name: blend, arguments: (x,)} (Lambd a. (Lambd b. (Lambd c. a * b + c % 7)))(x, x + 1, poly(x))
+Defun {name: clamp, arguments: (x,)} if (x > 1000 && x % 3 == 0) {1000} else {collatz(x) - x}
+"""
+
+
+def bench_vectorize():
+    # vectorize.map_function over a range against the per-element loop through the tree walker
+    count = 200000
+    interpreter = Interpreter([])
+    with contextlib.redirect_stdout(io.StringIO()):
+        interpreter.execute(parse(NUMERIC))
+    if vectorize.numpy is None:
+        print("numpy is not installed: map_function runs the per-element loop, timed alone")
+    print(f"{'function':<12}{'inputs':>9}{'loop (s)':>11}{'batched (s)':>13}{'speedup':>10}")
+    for name in ('poly', 'collatz', 'blend', 'clamp'):
+        inputs = range(-count // 2, count // 2)
+        start = time.perf_counter()
+        expected = vectorize.scalar_map(interpreter, interpreter.global_env.get(name), [inputs], 0, count)
+        loop = time.perf_counter() - start
+        if vectorize.numpy is None:
+            print(f"{name:<12}{count:>9}{loop:>11.3f}")
+            continue
+        if vectorize.map_function(interpreter, name, inputs) != expected:
+            raise RuntimeError(f"batched results differ on {name}")
+        batched = best_of(lambda: vectorize.map_function(interpreter, name, inputs), 3)
+        print(f"{name:<12}{count:>9}{loop:>11.3f}{batched:>13.4f}{loop / batched:>9.1f}x")
+
+
+CALLS = {
+    'defun': """
+Defun {name: add3, arguments: (a, b, c,)} a + b + c
+Defun {name: loop, arguments: (n, acc,)} if (n == 0) {acc} else {loop(n - 1, acc + add3(n, 1, 2))}
+Defun {name: rep, arguments: (k,)} if (k == 0) {0} else {loop(200, 0) + rep(k - 1)}
+rep(50)
+""",
+    'curried': """
+Defun {name: loop, arguments: (n, acc,)} if (n == 0) {acc} else {loop(n - 1, acc + (Lambd a. (Lambd b. (Lambd c. a + b + c)))(n, 1, 2))}
+Defun {name: rep, arguments: (k,)} if (k == 0) {0} else {loop(200, 0) + rep(k - 1)}
+rep(50)
+""",
+    'one by one': """
+Defun {name: apply, arguments: (f, x,)} f(x)
+Defun {name: loop, arguments: (n, acc,)} if (n == 0) {acc} else {loop(n - 1, acc + apply(apply((Lambd a. (Lambd b. (Lambd c. a + b + c)))(n), 1), 2))}
+Defun {name: rep, arguments: (k,)} if (k == 0) {0} else {loop(200, 0) + rep(k - 1)}
+rep(50)
+""",
+}
+
+
+def bench_calls():
+    # Call overhead: a Defunc, a lambda chain given all its arguments (bound into one frame) and the
+    # same chain applied to one argument at a time, each level building its own frame
+    print(f"{'calls':<12}{'walker (s)':>12}{'compiled (s)':>14}{'vm (s)':>10}")
+    for name, source in CALLS.items():
+        expected = outcome(Interpreter, source)
+        for engine in (CompiledInterpreter, VMInterpreter):
+            if outcome(engine, source) != expected:
+                raise RuntimeError(f"{engine.__name__} result differs from the tree walker on {name}")
+        times = [best_of(lambda: run(engine, source), repeat=3)
+                 for engine in (Interpreter, CompiledInterpreter, VMInterpreter)]
+        print(f"{name:<12}{times[0]:>12.4f}{times[1]:>14.4f}{times[2]:>10.4f}")
+
+
+# Repeated subexpressions: a tail call whose argument repeats an inlined call, and a recursive call made twice
+REPEATED = """
+Defun {name: norm, arguments: (a, b,)} a * a + b * b
+Defun {name: walk, arguments: (n, acc,)} if (n == 0) {acc} else {walk(n - 1, (norm(n, acc % 97) + 1) * (norm(n, acc % 97) + 1) % 1000003)}
+Defun {name: paths, arguments: (n,)} if (n < 2) {1} else {paths(n - 1) + paths(n - 1) % 7 + paths(n - 2)}
+walk(20000, 1)
+paths(13)
+"""
+
+
+def results_of(statements):
+    # As outcome(), for each statement: function values hold bodies the optimizer rewrites
+    interpreter = Interpreter(statements)
+    results = []
+    for node in statements:
+        try:
+            result = interpreter.evaluate(node, interpreter.global_env)
+            results.append(f"function of {result.parameters}" if isinstance(result, Closure) else repr(result))
+        except Exception as e:
+            results.append(f"{type(e).__name__}: {e}")
+    return results
+
+
+def bench_cse():
+    # Hash-consing and common-subexpression elimination at -O2: tree nodes of the optimized program, how
+    # many of them interning replaced by an identical node, the SharedExprs created, and the evaluation
+    # time without and with shared subexpressions
+    print(f"{'program':<20}{'nodes':>9}{'deduplicated':>14}{'shared':>8}{'unshared (s)':>14}{'shared (s)':>12}")
+    with tempfile.TemporaryDirectory() as directory:
+        programs = dict(suite_programs(directory), repeated=REPEATED)
+    for name, source in programs.items():
+        optimizer = Optimizer(2)
+        shared = optimizer.optimize(parse(source))
+        unshared = Optimizer(2, share=False).optimize(parse(source))
+        if results_of(shared) != results_of(unshared):
+            raise RuntimeError(f"shared subexpressions change the results of {name}")
+        nodes = sum(count_nodes(statement) for statement in unshared)
+        plain = best_of(lambda: results_of(unshared), repeat=3)
+        sharing = best_of(lambda: results_of(shared), repeat=3)
+        print(f"{name:<20}{nodes:>9}{optimizer.deduplicated:>8} ({optimizer.deduplicated / nodes:>3.0%})"
+              f"{optimizer.shared:>8}{plain:>14.4f}{sharing:>12.4f}")
+
+
+LAZY = {
+    # choose uses one of its two expensive arguments: call-by-need skips the other
+    'unused argument': """
+Defun {name: fib, arguments: (n,)} if (n < 2) {n} else {fib(n - 1) + fib(n - 2)}
+Defun {name: choose, arguments: (c, a, b,)} if c {a} else {b}
+Defun {name: rep, arguments: (k, acc,)} if (k == 0) {acc} else {rep(k - 1, acc + choose(k % 2 == 0, fib(14), fib(15)))}
+rep(20, 0)
+""",
+    # Every parameter is strict, so only the reads of variables cost extra
+    'strict': FIB,
+    # apply can't know whether f uses x, so every x is a thunk
+    'higher order': """
+Defun {name: apply, arguments: (f, x,)} f(x)
+Defun {name: loop, arguments: (n, acc,)} if (n == 0) {acc} else {loop(n - 1, acc + apply((Lambd y. y + 1), n * 2))}
+loop(20000, 0)
+""",
+    # keep may not use acc, so the accumulator grows a chain of thunks forced only at the end
+    'lazy accumulator': """
+Defun {name: keep, arguments: (b, x,)} if b {x} else {0}
+Defun {name: build, arguments: (n, acc,)} if (n == 0) {keep(True, acc)} else {build(n - 1, acc + n)}
+build(20000, 0)
+""",
+}
+
+
+# g and h were analyzed while f used its argument: after f is redefined they must not force theirs
+REDEFINED = """
+Defun {name: f, arguments: (x,)} x
+Defun {name: g, arguments: (y,)} f(y)
+Defun {name: h, arguments: (z,)} g(z)
+Defun {name: f, arguments: (x,)} 0
+g(1 / 0)
+h(1 / 0)
+"""
+
+
+def feed_lines(session, source):
+    for line in source.splitlines():
+        session.feed(line)
+
+
+def lazy_outputs(source):
+    # What LazyInterpreter prints for source given whole, streamed a statement at a time, and line by
+    # line to a REPL session
+    ast = Optimizer(1).optimize(parse(source))
+    outputs = []
+    for feed in (lambda: LazyInterpreter(ast).execute(ast),
+                 lambda: LazyInterpreter([]).execute(statement for statement in ast),
+                 lambda: feed_lines(Session(LazyInterpreter), source)):
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            feed()
+        outputs.append(output.getvalue())
+    return outputs
+
+
+def run_lazy(source):
+    ast = Optimizer(0).optimize(parse(source))
+    interpreter = LazyInterpreter(ast)
+    interpreter.learn(ast)
+    result = None
+    for node in ast:
+        result = interpreter.evaluate(interpreter.prepare(node), interpreter.global_env)
+    return result
+
+
+def bench_lazy():
+    # Call-by-need against the default eager tree walker
+    whole, streamed, session = lazy_outputs(REDEFINED)
+    if whole != "0\n0\n" or streamed != whole or session != whole:
+        raise RuntimeError(f"a redefined Defunc leaves stale strictness: {[whole, streamed, session]}")
+    print(f"{'program':<18}{'eager (s)':>11}{'lazy (s)':>10}{'lazy/eager':>12}")
+    for name, source in LAZY.items():
+        if run_lazy(source) != run(Interpreter, source):
+            raise RuntimeError(f"lazy result differs from the eager one on {name}")
+        eager = best_of(lambda: run(Interpreter, source), repeat=3)
+        lazy = best_of(lambda: run_lazy(source), repeat=3)
+        print(f"{name:<18}{eager:>11.4f}{lazy:>10.4f}{lazy / eager:>11.2f}x")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def load_server(requests, connections, window):
+    # Starts a server, warms its workers and splits requests over connections sending at the same time
+    evaluation = server.EvaluationServer()
+    try:
+        await evaluation.start()
+        address = evaluation.address()[:2]
+        await server.send_requests(address, requests[:evaluation.jobs], window)
+        shares = [requests[index::connections] for index in range(connections)]
+        start = time.perf_counter()
+        results = await asyncio.gather(*(server.send_requests(address, share, window) for share in shares))
+        elapsed = time.perf_counter() - start
+    finally:
+        await evaluation.close()
+    return [answer for result in results for answer in result], elapsed
+
+
+def bench_server():
+    # Latency and throughput of the evaluation server under concurrent pipelined load from this process,
+    # against starting one main.py per program
+    sources = CORPUS + [FIB.replace('fib(18)', 'fib(12)'), FACTORIAL, CLOSURES]
+    requests = [{'source': sources[index % len(sources)]} for index in range(240)]
+    main = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    latencies = []
+    with tempfile.TemporaryDirectory() as directory:
+        for index, source in enumerate(sources[:10]):
+            path = os.path.join(directory, f"p{index}.lambda")
+            with open(path, 'w') as file:
+                file.write(source)
+            start = time.perf_counter()
+            subprocess.run([sys.executable, main, '--no-cache', path], capture_output=True, check=True)
+            latencies.append(time.perf_counter() - start)
+    print(f"{os.cpu_count() or 1} CPUs, {len(requests)} requests per run, window of 8 unanswered per connection")
+    print(f"{'client':<20}{'requests/s':>12}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}")
+    print(f"{'main.py per program':<20}{len(latencies) / sum(latencies):>12.1f}"
+          f"{percentile(latencies, 0.5) * 1e3:>10.1f}{percentile(latencies, 0.95) * 1e3:>10.1f}"
+          f"{percentile(latencies, 0.99) * 1e3:>10.1f}")
+    for connections in (1, 4, 16):
+        answers, elapsed = asyncio.run(load_server(requests, connections, 8))
+        if any(answer['status'] not in ('ok', 'error') for _, answer in answers):
+            raise RuntimeError("the server did not run every request")
+        latencies = [latency for latency, _ in answers]
+        print(f"{f'{connections} connections':<20}{len(answers) / elapsed:>12.1f}"
+              f"{percentile(latencies, 0.5) * 1e3:>10.1f}{percentile(latencies, 0.95) * 1e3:>10.1f}"
+              f"{percentile(latencies, 0.99) * 1e3:>10.1f}")
+
+
+RUNAWAY = """
+Defun {name: spin, arguments: (n,)} spin(n + 1)
+spin(0)
+"""
+
+
+def run_sliced(source, quantum):
+    task = Task(Optimizer(0).optimize(parse(source)))
+    while not task.step(quantum):
+        pass
+    return task.output[-1]
+
+
+def finish_times(scheduler):
+    start = time.perf_counter()
+    return {task.name: (time.perf_counter() - start, task.status) for task in scheduler.run()}
+
+
+def bench_fuel():
+    # Cost of metering calls, with and without suspending every quantum calls, then 40 short programs
+    # queued behind a runaway one: run one after the other against time-sliced by a Scheduler
+    print(f"{'program':<12}{'plain (s)':>11}{'metered (s)':>13}{'overhead':>10}"
+          f"{'q=1000 (s)':>12}{'overhead':>10}{'q=100 (s)':>11}{'overhead':>10}")
+    for name, source in PROGRAMS.items():
+        if run_sliced(source, 100) != str(run(Interpreter, source)):
+            raise RuntimeError(f"time-sliced result differs on {name}")
+        plain = best_of(lambda: run(Interpreter, source), repeat=10)
+        metered = best_of(lambda: run(MeteredInterpreter, source), repeat=10)
+        large = best_of(lambda: run_sliced(source, 1000), repeat=10)
+        small = best_of(lambda: run_sliced(source, 100), repeat=10)
+        print(f"{name:<12}{plain:>11.4f}{metered:>13.4f}{metered / plain - 1:>10.1%}"
+              f"{large:>12.4f}{large / plain - 1:>10.1%}{small:>11.4f}{small / plain - 1:>10.1%}")
+
+    short = FIB.replace('fib(18)', 'fib(12)')
+    print(f"{'schedule':<22}{'short mean (ms)':>17}{'short max (ms)':>16}{'all (s)':>9}{'runaway':>10}")
+    for label, quantum in (('one after the other', 10 ** 9), ('quantum 1000', 1000), ('quantum 100', 100)):
+        scheduler = Scheduler(quantum)
+        scheduler.add(Task(parse(RUNAWAY), 'runaway', limit=300000))
+        for index in range(40):
+            scheduler.add(Task(parse(short), index))
+        times = finish_times(scheduler)
+        waits = [seconds for name, (seconds, _) in times.items() if name != 'runaway']
+        print(f"{label:<22}{sum(waits) / len(waits) * 1e3:>17.1f}{max(waits) * 1e3:>16.1f}"
+              f"{max(seconds for seconds, _ in times.values()):>9.3f}{times['runaway'][1]:>10}")
+
+
+def independent_source(functions, edited=None):
+    # Defuncs that don't call each other, each followed by a call of it; edited gets a different body
+    lines = []
+    for index in range(functions):
+        constant = 7 if index == edited else 3
+        lines.append(f"Defun {{name: f{index}, arguments: (n,)}} if (n < 2) {{n}} else {{n * {constant} + f{index}(n - 1)}}\n")
+        lines.append(f"f{index}(20)\n")
+    return "".join(lines)
+
+
+def bench_incremental():
+    # Latency of a one-Defunc edit: the whole program parsed and run again, against IncrementalProgram
+    print(f"{'statements':>10}{'full (ms)':>11}{'incremental (ms)':>18}{'parsed':>8}{'evaluated':>11}")
+    for functions in (50, 500, 5000):
+        before = independent_source(functions)
+        after = independent_source(functions, edited=functions // 2)
+        program = IncrementalProgram()
+        program.update(before)
+        with contextlib.redirect_stdout(io.StringIO()):
+            full = best_of(lambda: Interpreter([]).execute(cache.compile_source(after, 1)), repeat=3)
+        program.update(after)
+        if program.output() != [result for result in results_of(cache.compile_source(after, 1)) if result != 'None']:
+            raise RuntimeError(f"incremental results differ with {functions} functions")
+        edits = itertools.cycle([before, after])  # each update undoes or redoes the edit
+        incremental = best_of(lambda: program.update(next(edits)))
+        print(f"{2 * functions:>10}{full * 1e3:>11.1f}{incremental * 1e3:>18.2f}{program.parsed:>8}"
+              f"{program.evaluated:>11}")
+
+
+BENCHMARKS = {
+    'compiled': bench_compiled,
+    'deep': bench_deep,
+    'optimizer': bench_optimizer,
+    'memo': bench_memo,
+    'session': bench_session,
+    'stream': bench_stream,
+    'pipeline': bench_pipeline,
+    'pool': bench_pool,
+    'vm': bench_vm,
+    'cache': bench_cache,
+    'batch': bench_batch,
+    'parallel': bench_parallel,
+    'profile': bench_profile,
+    'suite': bench_suite,
+    'scanner': bench_scanner,
+    'parser': bench_parser,
+    'll': bench_ll,
+    'vectorize': bench_vectorize,
+    'calls': bench_calls,
+    'cse': bench_cse,
+    'lazy': bench_lazy,
+    'server': bench_server,
+    'fuel': bench_fuel,
+    'incremental': bench_incremental,
+}
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description="Benchmarks of the lambda interpreter.")
+    arg_parser.add_argument("names", nargs="*", choices=[[]] + list(BENCHMARKS), metavar="name",
+                            help=f"benchmarks to run (default: all): {', '.join(BENCHMARKS)}")
+    arg_parser.add_argument("--save", metavar="FILE",
+                            help="write the measured results (currently from suite) to a JSON baseline")
+    arg_parser.add_argument("--compare", metavar="FILE",
+                            help="compare the results with a saved baseline; exits with 1 on a regression")
+    arg_parser.add_argument("--threshold", type=float, default=10.0,
+                            help="percentage by which a metric must get worse to count as a regression")
+    return arg_parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    all_results = {}
+    for bench_name in args.names or list(BENCHMARKS):
+        print(f"== {bench_name} ==")
+        results = BENCHMARKS[bench_name]()
+        if results is not None:
+            all_results[bench_name] = results
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'results': all_results}, file, indent=2)
+        print(f"results saved to {args.save}")
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print(f"== compared with {args.compare} (threshold {args.threshold:g}%) ==")
+        found = compare(baseline['results'], all_results, args.threshold)
+        print(f"{len(found)} regression(s)")
+        if found:
+            sys.exit(1)
@@ -0,0 +1,95 @@
+import hashlib
+import mmap
+import os
+import sys
+
+from lexer import Lexer
+from node_pool import NodePool
+from optimizer import Optimizer
+from parser import Parser
+
+
+CACHE_DIR = '__lambdacache__'
+CACHE_FORMAT = 1
+
+# Modules whose source decides what a cached program looks like; editing any of them invalidates every entry.
+# interpreter.py holds the OPERATORS that constant folding applies
+FRONT_END = ('ast_node.py', 'lexer.py', 'scanner.py', 'parser.py', 'resolver.py', 'optimizer.py', 'node_pool.py',
+             'interpreter.py', 'cache.py')
+
+_version = None
+
+
+def interpreter_version():
+    global _version
+    if _version is None:
+        digest = hashlib.sha256(f"{CACHE_FORMAT} {sys.version_info[:2]} {sys.byteorder}".encode())
+        root = os.path.dirname(os.path.abspath(__file__))
+        for name in FRONT_END:
+            with open(os.path.join(root, name), 'rb') as file:
+                digest.update(file.read())
+        _version = digest.digest()
+    return _version
+
+
+def cache_key(source, opt_level):
+    # source is the program text as bytes
+    digest = hashlib.sha256(interpreter_version())
+    digest.update(bytes([opt_level]))
+    digest.update(source)
+    return digest.digest()
+
+
+def cache_path(filename, opt_level):
+    # Like __pycache__: one entry per source file and optimization level, next to the source
+    directory, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, CACHE_DIR, f"{name}.O{opt_level}.lpool")
+
+
+def compile_source(source, opt_level):
+    statements = Parser(Lexer(source).tokenize()).parse()
+    return Optimizer(opt_level).optimize(statements)
+
+
+def load(path, key):
+    # The cached statements, or None when the entry is missing, stale or unreadable
+    try:
+        with open(path, 'rb') as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:len(key)] != key:
+                    return None
+                return NodePool.loads(data, len(key))
+    except (OSError, ValueError):
+        return None
+
+
+def store(path, key, statements):
+    # Best effort: an unwritable directory only means the next run starts cold again
+    data = key + NodePool().extend(statements).dumps()
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temporary, 'wb') as file:
+            file.write(data)
+        os.replace(temporary, path)  # readers never see a partly written entry
+    except OSError:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+
+def load_program(filename, opt_level=1):
+    # Parsed and optimized statements of a .lambda file, from __lambdacache__ when the entry matches the
+    # file's content, the interpreter version and the optimization level; rebuilt and rewritten otherwise
+    with open(filename, 'rb') as file:
+        source = file.read()
+    key = cache_key(source, opt_level)
+    path = cache_path(filename, opt_level)
+    pool = load(path, key)
+    if pool is not None:
+        return list(pool.statements())
+    text = source.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')  # universal newlines, as open() reads it
+    statements = compile_source(text, opt_level)
+    store(path, key, statements)
+    return statements
@@ -0,0 +1,238 @@
+from ast_node import AstNode, FuncDef, LambdaExpr, FuncApp, Identifier, IntLit, BoolLit, UnaryOp, BinOp, IfStmt, SharedExpr
+from basic import Closure, DEFUNC, LAMBDA, Environment, Unset
+from interpreter import EvaluationError, Interpreter, OPERATORS
+from memo import MISSING
+from resolver import flatten_chain
+
+
+def apply_curried(func, args):
+    # A lambda applied to args: a chain of nested lambdas takes as many of them at once as it has
+    # parameters, anything else one at a time
+    position = 0
+    while position < len(args):
+        if type(func) is not Closure:
+            raise TypeError(f"Expected a function or lambda expression, but got: {func}")
+        chain = func.chain
+        if chain is not None and len(args) - position >= len(chain[0]):
+            count = len(chain[0])
+            func = chain[1](func.env.extend_scope(chain[0], args[position:position + count]))
+        else:
+            if func.kind == DEFUNC and func.arity != 1:
+                raise TypeError(f"Function expected {func.arity} arguments but got 1")
+            count = 1
+            func = func.body(func.env.extend_scope(func.names, args[position:position + 1]))
+        position += count
+    return func
+
+
+class Compiler:
+    # Turns an AST into nested closures taking the environment, so dispatch happens once per node
+    def __init__(self, memo=None):
+        self.cache = {}
+        self.memo = memo
+        self.prefix = None  # while compiling a statement's own code: a cell for its error prefix
+
+    def compile(self, node):
+        if self.prefix is not None:
+            return self.compile_node(node)  # statement code is compiled apart from function bodies
+        code = self.cache.get(node)
+        if code is None:
+            code = self.compile_node(node)
+            self.cache[node] = code
+        return code
+
+    def compile_statement(self, node):
+        # The cache only shares code within one top-level statement, so it never outgrows the largest one.
+        # Errors are reported once, with the prefix of the first FuncApp/IfStmt of the statement's own code
+        # that ran, as the tree walker does; function bodies only run inside a call, so they add none
+        prefix = self.prefix = [None]
+        try:
+            code = self.compile(node)
+        finally:
+            self.prefix = None
+            self.cache.clear()
+
+        def statement(env):
+            prefix[0] = None
+            try:
+                return code(env)
+            except (EvaluationError, RecursionError):
+                raise
+            except Exception as e:
+                if prefix[0] is None:
+                    raise
+                raise EvaluationError(f"{prefix[0]}: {str(e)}")
+
+        return statement
+
+    def compile_body(self, node):
+        # The code of a function body keeps its node, for the tree walker to run it instead
+        prefix, self.prefix = self.prefix, None
+        try:
+            code = self.compile(node)
+        finally:
+            self.prefix = prefix
+        code.node = node
+        return code
+
+    def compile_node(self, node):
+        if isinstance(node, (IntLit, BoolLit)):
+            value = node.val
+            return lambda env: value
+
+        elif isinstance(node, Identifier):
+            return self.compile_lookup(node.id_name, node.depth, node.index)
+
+        elif isinstance(node, UnaryOp):
+            if node.op != '!':
+                raise TypeError(f"invalid unary operator: {node.op}")
+            operand = self.compile(node.operand)
+            return lambda env: not operand(env)
+
+        elif isinstance(node, BinOp):
+            return self.compile_bin_op(node)
+
+        elif isinstance(node, LambdaExpr):
+            parameters = node.parameters
+            body = self.compile_body(node.expr_body)
+            chain = flatten_chain(node)
+            if chain is not None:
+                chain = chain[0], self.compile_body(chain[1])
+            return lambda env: Closure(LAMBDA, parameters, body, env, chain)
+
+        elif isinstance(node, FuncDef):
+            name = node.func_name
+            parameters = node.parameters
+            body = self.compile_body(node.func_body)
+            memo = self.memo
+            if memo is None:
+                return lambda env: env.define(name, Closure(DEFUNC, parameters, body, env))
+
+            def func_def(env):
+                env.define(name, Closure(DEFUNC, parameters, body, env))
+                memo.clear()  # cached results may depend on the old definition
+
+            return func_def
+
+        elif isinstance(node, IfStmt):
+            return self.compile_if_stmt(node)
+
+        elif isinstance(node, FuncApp):
+            return self.compile_func_app(node)
+
+        elif isinstance(node, SharedExpr):
+            expr = self.compile(node.expr)
+            slot = node.slot
+
+            def shared_expr(env):
+                slots = env.slots
+                if slot < len(slots) and slots[slot] is not Unset:
+                    return slots[slot]
+                return env.share(slot, expr(env))
+
+            return shared_expr
+
+        else:
+            raise TypeError(f"Unknown node type: {type(node)}")
+
+    def compile_lookup(self, name, depth, index):
+        if depth is None:
+            return lambda env: env.get(name)
+        if depth == 0:
+            return lambda env: env.slots[index]
+        if depth == 1:
+            return lambda env: env.parent.slots[index]
+        return lambda env: env.lookup(depth, index)
+
+    def compile_bin_op(self, node):
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+
+        if node.op == '||':
+            return lambda env: True if left(env) else right(env)
+        if node.op == '&&':
+            return lambda env: right(env) if left(env) else False
+
+        apply = OPERATORS.get(node.op)
+        if apply is None:
+            raise TypeError(f"Invalid operator: {node.op}")
+        return lambda env: apply(left(env), right(env))
+
+    def compile_if_stmt(self, node):
+        cond = self.compile(node.cond)
+        then_branch = self.compile(node.then_branch)
+        else_branch = self.compile(node.else_branch) if node.else_branch is not None else None
+
+        def if_stmt(env):
+            if cond(env):
+                return then_branch(env)
+            elif else_branch is not None:
+                return else_branch(env)
+            return None
+
+        return self.entering(if_stmt, "Error evaluating if-statement")
+
+    def compile_func_app(self, node):
+        if isinstance(node.function, str):
+            function = self.compile_lookup(node.function, node.depth, node.index)
+        else:
+            function = self.compile(node.function)
+        arguments = [self.compile(arg) for arg in node.arguments]
+        memo = self.memo
+
+        def func_app(env):
+            func = function(env)
+            args = [arg(env) for arg in arguments]
+            if type(func) is not Closure:
+                raise TypeError(f"Expected a function or lambda expression, but got: {func}")
+            if func.kind == DEFUNC:
+                if func.arity != len(args):
+                    raise TypeError(f"Function expected {func.arity} arguments but got {len(args)}")
+                if memo is not None and isinstance(func.env, Environment):
+                    key = memo.key(func, args)
+                    if key is not None:
+                        result = memo.get(key)
+                        if result is MISSING:
+                            result = func.body(func.env.extend_scope(func.names, args))
+                            memo.store(key, result)
+                        return result
+                return func.body(func.env.extend_scope(func.names, args))
+            return apply_curried(func, args)
+
+        return self.entering(func_app, "Error applying function")
+
+    def entering(self, code, message):
+        # In statement code, code first records message as the statement's error prefix, unless one is set
+        prefix = self.prefix
+        if prefix is None:
+            return code
+
+        def entered(env):
+            if prefix[0] is None:
+                prefix[0] = message
+            return code(env)
+
+        return entered
+
+
+class CompiledInterpreter(Interpreter):
+    # Runs each statement through its compiled closure instead of the tree walker
+    def __init__(self, ast, memo=None):
+        super().__init__(ast, memo)
+        self.compiler = Compiler(memo)
+
+    def evaluate(self, node, context):
+        # Compiled code recurses in Python: a statement deeper than the recursion limit runs again on the
+        # tree walker's explicit stack. Only Defuncs bind anything, so running it twice changes nothing
+        try:
+            return self.compiler.compile_statement(node)(context)
+        except RecursionError:
+            if isinstance(node, FuncDef):
+                raise
+            return super().evaluate(node, context)
+
+    def call(self, func, args, stack):
+        target = super().call(func, args, stack)
+        if target is not None and not isinstance(target[0], AstNode):
+            return target[0].node, target[1]
+        return target
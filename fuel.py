@@ -0,0 +1,147 @@
+from basic import Closure, DEFUNC
+from cache import load_program
+from interpreter import Interpreter, Suspended
+from collections import deque
+import argparse
+import sys
+
+
+class MeteredInterpreter(Interpreter):
+    # The tree walker with a fuel counter. Every call of a function or lambda burns one unit: calls are the
+    # only way a program loops, so every back edge is metered, tail calls included. When the fuel runs out
+    # the evaluation stops with Suspended before the called body runs; resume() continues it with the fuel
+    # then set, and dropping it aborts it. execute() treats running out as the end of the program.
+    def __init__(self, ast, memo=None, fuel=None):
+        super().__init__(ast, memo)
+        self.limit = fuel
+        self.fuel = fuel if fuel is not None else sys.maxsize  # calls left; -1 after a suspension
+
+    def execute(self, statements):
+        # Like Interpreter.execute, but the statement that runs out of fuel is the last one run
+        result = None
+        for node in statements:
+            try:
+                result = self.evaluate(node, self.global_env)
+                if result is not None:
+                    print(result)
+            except Suspended:
+                print(f"Error during the interpretation of node {node}: out of fuel after {self.limit} calls")
+                break
+            except Exception as e:
+                print(f"Error during the interpretation of node {node}: {e}")
+        return result
+
+    def resume(self, suspended):
+        return self.run(suspended.node, suspended.context, suspended.stack, suspended.error_prefix)
+
+    def call(self, func, args, stack):
+        fuel = self.fuel = self.fuel - 1
+        if fuel >= 0 and type(func) is Closure and func.kind == DEFUNC and func.arity == len(args):
+            return func.body, func.env.extend_scope(func.names, args)  # Interpreter.call, inlined for Defuncs
+        target = super().call(func, args, stack)
+        if target is None:
+            self.fuel += 1  # a lambda applied to nothing is its own value: nothing runs
+        elif fuel < 0:
+            raise Suspended(target[0], target[1], stack)
+        return target
+
+
+class Task:
+    # One program run by a Scheduler: its statements are evaluated in order, a slice of fuel at a time, and
+    # what execute() would print is collected in output. limit, when given, is the fuel of the whole
+    # program; a task that needs more is aborted like a MeteredInterpreter running out.
+    def __init__(self, statements, name=None, memo=None, limit=None):
+        self.name = name
+        self.statements = list(statements)
+        self.interpreter = MeteredInterpreter(self.statements, memo)
+        self.limit = limit
+        self.position = 0  # index of the statement being evaluated
+        self.suspended = None
+        self.used = 0
+        self.output = []
+        self.status = 'ready'  # 'done' or 'aborted' once finished
+
+    def step(self, fuel):
+        # Runs the program until it finishes or has made fuel more calls; returns True when it finished
+        if self.limit is not None:
+            fuel = min(fuel, self.limit - self.used)
+        interpreter = self.interpreter
+        while self.position < len(self.statements):
+            node = self.statements[self.position]
+            interpreter.fuel = fuel
+            try:
+                if self.suspended is not None:
+                    suspended, self.suspended = self.suspended, None
+                    result = interpreter.resume(suspended)
+                else:
+                    result = interpreter.evaluate(node, interpreter.global_env)
+                if result is not None:
+                    self.output.append(str(result))
+            except Suspended as suspended:
+                self.used += fuel - interpreter.fuel
+                if self.limit is not None and self.used > self.limit:
+                    self.output.append(f"Error during the interpretation of node {node}: "
+                                       f"out of fuel after {self.limit} calls")
+                    self.status = 'aborted'
+                    return True
+                self.suspended = suspended
+                return False
+            except Exception as e:
+                self.output.append(f"Error during the interpretation of node {node}: {e}")
+            self.used += fuel - interpreter.fuel
+            fuel = interpreter.fuel
+            self.position += 1
+        self.status = 'done'
+        return True
+
+
+class Scheduler:
+    # Time-slices many programs in one process: round robin over the tasks, each turn running one for at
+    # most quantum calls, so a long or runaway program delays the others by a bounded amount instead of
+    # holding the process until it ends
+    def __init__(self, quantum=1000):
+        self.quantum = quantum
+        self.ready = deque()
+
+    def add(self, task):
+        self.ready.append(task)
+        return task
+
+    def run(self):
+        # Yields each task as it finishes, until every task has
+        while self.ready:
+            task = self.ready.popleft()
+            if task.step(self.quantum):
+                yield task
+            else:
+                self.ready.append(task)
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description="Runs several programs in one process, interleaved a few "
+                                                     "calls at a time, and prints each one's output as it ends.")
+    arg_parser.add_argument("files", nargs="+", help="programs to run (.lambda)")
+    arg_parser.add_argument("--quantum", type=int, default=1000,
+                            help="calls a program makes before the next one runs (default: 1000)")
+    arg_parser.add_argument("--fuel", type=int, default=None,
+                            help="calls each program may make in total before it is aborted")
+    arg_parser.add_argument("-O", dest="opt_level", type=int, choices=[0, 1, 2], default=1,
+                            help="optimization level, as for main.py")
+    args = arg_parser.parse_args()
+    if args.quantum < 1:
+        arg_parser.error("--quantum must be at least 1")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    scheduler = Scheduler(args.quantum)
+    for path in args.files:
+        try:
+            scheduler.add(Task(load_program(path, args.opt_level), path, limit=args.fuel))
+        except Exception as e:
+            print(f"==> {path}: {e}")
+    for task in scheduler.run():
+        print(f"==> {task.name} ({task.status}, {task.used} calls)")
+        for line in task.output:
+            print(line)
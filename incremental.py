@@ -0,0 +1,336 @@
+from ast_node import FuncDef
+from compiler import CompiledInterpreter
+from interpreter import Interpreter
+from memo import MemoCache
+from optimizer import Optimizer, global_names
+from parser import Parser
+from scanner import Scanner, BASIC_OP, BOOL_OP, COMP_OP, LPAREN, ELSE
+from vm import VMInterpreter
+import argparse
+import bisect
+import itertools
+import os
+import sys
+import time
+
+
+# Kinds of the tokens that can continue a complete statement, so a statement followed by one is not over
+CONTINUATIONS = {BASIC_OP, BOOL_OP, COMP_OP, LPAREN, ELSE}
+
+
+class Statement:
+    # A parsed top-level statement and what its last evaluation left
+    __slots__ = ('node', 'name', 'names', 'order', 'value', 'key', 'output')
+
+    def __init__(self, node):
+        self.node = node
+        self.name = node.func_name if isinstance(node, FuncDef) else None  # set for a Defunc
+        self.names = global_names(node)
+        self.order = 0.0  # increases through the program; kept by unchanged statements across edits
+        self.value = None  # the function a Defunc binds
+        self.key = None  # name -> the Defunc Statement (or None) the last evaluation used for it
+        self.output = []  # the lines execute() prints for it
+
+
+class Chunk:
+    # Whole lines of the source holding whole statements; blank and comment lines after the last one belong
+    # to it too. first is the kind of its first token, None when it has no statements
+    __slots__ = ('text', 'statements', 'first')
+
+    def __init__(self, text, statements, first):
+        self.text = text
+        self.statements = statements
+        self.first = first
+
+
+def first_kind(chunks, index=0):
+    for chunk in itertools.islice(chunks, index, None):
+        if chunk.first is not None:
+            return chunk.first
+    return None
+
+
+def common_prefix(old, new):
+    # Length of the longest common prefix, by halving: each comparison is one memcmp of the undecided part
+    low, high = 0, min(len(old), len(new))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if new.startswith(old[low:middle], low):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def common_suffix(old, new, limit):
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if new.endswith(old[len(old) - middle:len(old) - low], 0, len(new) - low):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+class IncrementalProgram:
+    # A program that is resubmitted whole after each edit, as from an editor or a notebook. update() diffs
+    # the new source against the previous one: only the changed lines are scanned and parsed again, and
+    # unchanged statements keep their nodes. A top-level expression runs again only when it is new or a
+    # Defunc it uses, directly or through other Defuncs, was added, removed or changed; the others keep
+    # their output. Each runs in the global scope as it is at its point of the program. The work of an
+    # update follows the size of the edit and of what depends on it, not the size of the program, apart
+    # from copying a list of offsets. At most -O1: -O2 inlines Defuncs into other statements.
+    def __init__(self, interpreter_class=Interpreter, opt_level=1, memo=None):
+        if opt_level > 1:
+            raise ValueError("-O2 inlines Defuncs across statements, so they can't be rebuilt one at a time")
+        self.interpreter = interpreter_class([], memo)
+        self.optimizer = Optimizer(opt_level)
+        self.source = ""
+        self.chunks = []
+        self.offsets = [0]  # offset of each chunk in source, then len(source)
+        self.definitions = {}  # name -> the Defunc Statements of that name
+        self.users = {}  # name -> expression Statements whose last evaluation used it
+        self.parsed = 0  # statements parsed by the last update
+        self.evaluated = 0  # statements evaluated by the last update
+
+    def update(self, source):
+        # Returns the statements evaluated. A syntax error raises RuntimeError and leaves the program as it was
+        start, end, region = self.reparse(source)
+        removed = [statement for chunk in self.chunks[start:end] for statement in chunk.statements]
+        added = [statement for chunk in region for statement in chunk.statements]
+        offsets = []
+        offset = self.offsets[start]
+        for chunk in region:
+            offsets.append(offset)
+            offset += len(chunk.text)
+        delta = len(source) - len(self.source)
+        self.offsets[start:] = offsets + [position + delta for position in self.offsets[end:]]
+        self.chunks[start:end] = region
+        self.source = source
+        self.label(start, start + len(region), added)
+        return self.evaluate(removed, added)
+
+    def output(self):
+        # The output of the whole program, as execute() would print it
+        return [line for chunk in self.chunks for statement in chunk.statements for line in statement.output]
+
+    def reparse(self, source):
+        # (start, end, chunks): the chunks of source that replace self.chunks[start:end]
+        chunks, offsets, old = self.chunks, self.offsets, self.source
+        prefix = common_prefix(old, source)
+        suffix = common_suffix(old, source, min(len(old), len(source)) - prefix)
+        start = bisect.bisect_right(offsets, prefix) - 1  # chunks that end inside the common prefix
+        if 0 < start == len(chunks) and not chunks[-1].text.endswith('\n') and len(source) > len(old):
+            start -= 1  # the last line goes on
+        delta = len(source) - len(old)
+        end = max(start, bisect.bisect_left(offsets, len(old) - suffix, 0, len(chunks)))
+        if end < len(chunks) and offsets[end] + delta > offsets[start] and source[offsets[end] + delta - 1] != '\n':
+            end += 1  # the line before the first common chunk changed, so it doesn't start a line any more
+
+        # The changed lines are parsed alone, then with a neighbouring chunk at a time while a statement may
+        # run across the edges of the region
+        while True:
+            offset, tail = offsets[start], offsets[end] + delta
+            try:
+                region = self.parse(source[offset:tail], old.count('\n', 0, offset))
+            except RuntimeError:
+                # The region may start or end inside a statement: a syntax error only stands for the whole file
+                if start == 0 and end == len(chunks):
+                    raise
+                start = max(start - 1, 0)
+                end = min(end + 1, len(chunks))
+                continue
+            following = first_kind(region)
+            if first_kind(chunks, end) in CONTINUATIONS:
+                end += 1
+            elif start > 0 and (following if following is not None else first_kind(chunks, end)) in CONTINUATIONS:
+                start -= 1
+            else:
+                return start, end, region
+
+    def parse(self, text, line_offset):
+        # The chunks of text, whose first line is line line_offset + 1 of the source
+        scanner = Scanner(text)
+        scanner.line_num = line_offset + 1
+        tokens = scanner.scan()
+        parser = Parser(tokens)
+        starts = []  # index of each statement's first token
+        statements = []
+        position = 0
+        for statement in parser.statements():
+            starts.append(position)
+            statements.append(Statement(self.optimizer.optimize_statement(statement)))
+            position = parser.position
+        self.parsed = len(statements)
+        if not statements:
+            return [Chunk(text, [], None)] if text else []
+
+        line_starts = [0]
+        index = text.find('\n')
+        while index >= 0:
+            line_starts.append(index + 1)
+            index = text.find('\n', index + 1)
+        lines = tokens.lines
+        chunks = []
+        begin = first = 0
+        for index in range(1, len(statements) + 1):
+            if index < len(statements):
+                token = starts[index]
+                if lines[token] == lines[token - 1]:
+                    continue  # shares a line with the statement before it
+                split = line_starts[lines[token] - line_offset - 1]
+            else:
+                split = len(text)
+            chunks.append(Chunk(text[begin:split], statements[first:index], tokens.kinds[starts[first]]))
+            begin, first = split, index
+        return chunks
+
+    def label(self, start, end, added):
+        # Orders the statements of chunks[start:end] between their neighbours, numbering every statement
+        # again only when the gap between them is too narrow for floats
+        chunks = self.chunks
+        low = high = None
+        index = start - 1
+        while index >= 0 and not chunks[index].statements:
+            index -= 1
+        if index >= 0:
+            low = chunks[index].statements[-1].order
+        index = end
+        while index < len(chunks) and not chunks[index].statements:
+            index += 1
+        if index < len(chunks):
+            high = chunks[index].statements[0].order
+        if low is None:
+            low = (high if high is not None else 0.0) - len(added) - 1
+        if high is None:
+            high = low + len(added) + 1
+        step = (high - low) / (len(added) + 1)
+        if step <= max(abs(low), abs(high)) * 1e-9:
+            statements = [statement for chunk in chunks for statement in chunk.statements]
+            for index, statement in enumerate(statements):
+                statement.order = float(index)
+            return
+        for index, statement in enumerate(added):
+            statement.order = low + step * (index + 1)
+
+    def evaluate(self, removed, added):
+        interpreter = self.interpreter
+        env = interpreter.global_env
+        changed = set()  # names whose Defuncs were added or removed
+        for statement in removed:
+            if statement.name is not None:
+                self.definitions[statement.name].remove(statement)
+                changed.add(statement.name)
+            elif statement.key is not None:
+                for name in statement.key:
+                    self.users[name].discard(statement)
+        evaluated = []
+        dirty = set()
+        for statement in added:
+            if statement.name is not None:
+                self.definitions.setdefault(statement.name, []).append(statement)
+                changed.add(statement.name)
+                interpreter.evaluate(statement.node, env)
+                statement.value = env.variables[statement.name]
+                evaluated.append(statement)
+            else:
+                dirty.add(statement)
+        for name in changed:
+            dirty.update(self.users.get(name, ()))
+        if changed and interpreter.memo is not None:
+            interpreter.memo.clear()  # cached results may depend on a definition that is gone
+
+        for statement in sorted(dirty, key=lambda statement: statement.order):
+            key = self.dependencies(statement)
+            if key == statement.key:
+                continue
+            for name in statement.key or ():
+                self.users[name].discard(statement)
+            for name, definition in key.items():
+                self.users.setdefault(name, set()).add(statement)
+                if definition is None:
+                    env.variables.pop(name, None)
+                else:
+                    env.define(name, definition.value)
+            statement.key = key
+            statement.output = self.run(statement)
+            evaluated.append(statement)
+        self.evaluated = len(evaluated)
+        return evaluated
+
+    def visible(self, name, order):
+        # The Defunc bound to name at order in the program, or None
+        found = None
+        for definition in self.definitions.get(name, ()):
+            if definition.order < order and (found is None or definition.order > found.order):
+                found = definition
+        return found
+
+    def dependencies(self, statement):
+        # The Defuncs statement may call, through the bodies of those it calls directly
+        key = {}
+        pending = list(statement.names)
+        while pending:
+            name = pending.pop()
+            if name in key:
+                continue
+            definition = key[name] = self.visible(name, statement.order)
+            if definition is not None:
+                pending.extend(definition.names)
+        return key
+
+    def run(self, statement):
+        try:
+            result = self.interpreter.evaluate(statement.node, self.interpreter.global_env)
+            return [] if result is None else [str(result)]
+        except Exception as e:
+            return [f"Error during the interpretation of node {statement.node}: {e}"]
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description="Runs a program again each time its file changes, "
+                                                     "re-parsing and re-evaluating only what the edit affects.")
+    arg_parser.add_argument("file", help="program to watch (.lambda)")
+    engine = arg_parser.add_mutually_exclusive_group()
+    engine.add_argument("--compile", action="store_true",
+                        help="compile the AST to closures instead of walking the tree")
+    engine.add_argument("--vm", action="store_true",
+                        help="compile the AST to bytecode and run it on the stack VM")
+    arg_parser.add_argument("-O", dest="opt_level", type=int, choices=[0, 1], default=1,
+                            help="optimization level: 0 none, 1 constant folding (default)")
+    arg_parser.add_argument("--memo", action="store_true",
+                            help="cache results of Defunc calls with integer/boolean arguments")
+    arg_parser.add_argument("--interval", type=float, default=0.2,
+                            help="seconds between checks of the file (default: 0.2)")
+    return arg_parser.parse_args()
+
+
+def watch(program, filename, interval):
+    modified = None
+    while True:
+        try:
+            stamp = os.stat(filename).st_mtime_ns
+            if stamp != modified:
+                modified = stamp
+                with open(filename, 'r') as file:
+                    source = file.read()
+                start = time.perf_counter()
+                program.update(source)
+                elapsed = time.perf_counter() - start
+                print("\n".join(program.output()))
+                print(f"-- parsed {program.parsed}, evaluated {program.evaluated} statements in "
+                      f"{elapsed * 1e3:.1f} ms", file=sys.stderr)
+        except (OSError, RuntimeError) as e:
+            print(f"Error: {e}")
+        time.sleep(interval)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    interpreter_class = CompiledInterpreter if args.compile else VMInterpreter if args.vm else Interpreter
+    try:
+        watch(IncrementalProgram(interpreter_class, args.opt_level, MemoCache() if args.memo else None),
+              args.file, args.interval)
+    except KeyboardInterrupt:
+        pass
@@ -1,161 +1,318 @@
-from ast_node import FuncDef, LambdaExpr, FuncApp, Identifier, IntLit, BoolLit, UnaryOp, BinOp, IfStmt
+from ast_node import FuncDef, LambdaExpr, FuncApp, Identifier, IntLit, BoolLit, UnaryOp, BinOp, IfStmt, SharedExpr
+from basic import Closure, DEFUNC, LAMBDA, Environment, Unset
+from memo import MISSING
+from resolver import flatten_chain
+import operator
 
 
-class Environment:
-    def __init__(self, parent=None):
-        self.parent = parent
-        self.context = {}
+# Continuation frames kept on the evaluation stack of Interpreter.run
+# (kind, node, context, ...) for the kinds that continue a node; RETURN_HOOK calls frame[1] with the value
+BIN_LEFT, BIN_RIGHT, IF_COND, UNARY, APP_FUNC, APP_ARGS, CURRY, MEMO, RETURN_HOOK, SHARE = range(10)
 
-    def define(self, name, value):
-        self.context[name] = value
 
-    def extend_scope(self, names, values):
-        child = Environment(self)
-        for name, value in zip(names, values):
-            child.define(name, value)
-        return child
+def divide(left, right):
+    if right == 0:
+        raise ZeroDivisionError("Invalid, division by zero!")
+    return left // right
+
+
+# The binary operators other than the short-circuiting && and ||, which Interpreter.apply_operators adds
+OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': divide,
+    '%': operator.mod,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '>': operator.gt,
+    '<=': operator.le,
+    '>=': operator.ge,
+}
+
+
+class EvaluationError(RuntimeError):
+    # An error already reported with its prefix; nested evaluations pass it on unchanged
+    pass
 
-    def get(self, name):
-        if name in self.context:
-            return self.context[name]
-        elif self.parent:
-            return self.parent.get(name)
-        else:
-            raise NameError(f"Undefined variable: {name}")
+
+class Suspended(BaseException):
+    # Raised by a subclass's call() to stop Interpreter.run before entering a function: holds the body and
+    # environment the call returned and the continuation stack, and run() adds its error prefix, so
+    # run() can continue later where it stopped. Not an Exception, so error handling lets it through
+    def __init__(self, node, context, stack):
+        super().__init__()
+        self.node = node
+        self.context = context
+        self.stack = stack
+        self.error_prefix = None
 
 
 class Interpreter:
-    def __init__(self, ast):
+    def __init__(self, ast, memo=None):
         self.ast = ast
         self.global_env = Environment()
+        self.memo = memo  # MemoCache for results of Defunc calls, or None
+        self.chains = {}  # LambdaExpr -> its flattened chain, or None
 
     def interpret(self):
         print("Starting the interpretation - ")
         try:
-            result = None
-            for node in self.ast:
-                try:
-                    result = self.evaluate(node, self.global_env)
-                    if result is not None:
-                        print(result)
-                except Exception as e:
-                    print(f"Error during the interpretation of node {node}: {e}")
+            result = self.execute(self.ast)
             print("Interpretation is finished -")
             return result
         except Exception as e:
             raise RuntimeError(f"Runtime error during the interpretation: {str(e)}")
 
+    def close(self):
+        # Releases resources held by subclasses, such as worker processes
+        pass
+
+    def execute(self, statements):
+        # Evaluates top-level statements in the global scope, printing each result
+        result = None
+        for node in statements:
+            try:
+                result = self.evaluate(node, self.global_env)
+                if result is not None:
+                    print(result)
+            except Exception as e:
+                print(f"Error during the interpretation of node {node}: {e}")
+        return result
+
     def evaluate(self, node, context):
-        if isinstance(node, IntLit):
-            return node.val
+        return self.run(node, context, [], None)
 
-        elif isinstance(node, Identifier):
-            return context.get(node.id_name)
+    def run(self, node, context, stack, error_prefix):
+        # Explicit continuation stack instead of Python recursion. If-branches and function
+        # bodies are entered in tail position without pushing a frame, so tail calls run in
+        # constant space and other recursion is bounded by memory, not the recursion limit.
+        try:
+            while True:
+                node_type = type(node)
+                if node_type is IntLit or node_type is BoolLit:
+                    value = node.val
 
-        elif isinstance(node, BoolLit):
-            return node.val
+                elif node_type is Identifier:
+                    depth = node.depth
+                    if depth is None:
+                        value = context.get(node.id_name)
+                    else:
+                        while depth:
+                            context = context.parent
+                            depth -= 1
+                        value = context.slots[node.index]
 
-        elif isinstance(node, UnaryOp):
-            value = self.evaluate(node.operand, context)
-            return self.apply_unary_operator(node.op, value)
+                elif node_type is BinOp:
+                    stack.append((BIN_LEFT, node, context))
+                    node = node.left
+                    continue
 
-        elif isinstance(node, BinOp):
-            left = self.evaluate(node.left, context)
-            if node.op == '||' and left:
-                return True
-            if node.op == '&&' and not left:
-                return False
-            right = self.evaluate(node.right, context)
-            return self.apply_operators(node.op, left, right)
+                elif node_type is FuncApp:
+                    if error_prefix is None:
+                        error_prefix = "Error applying function"
+                    stack.append((APP_FUNC, node, context))
+                    if not isinstance(node.function, str):
+                        node = node.function
+                        continue
+                    value = self.lookup(node.function, node.depth, node.index, context)
 
-        elif isinstance(node, LambdaExpr):
-            return node.parameters, node.expr_body, context
+                elif node_type is IfStmt:
+                    if error_prefix is None:
+                        error_prefix = "Error evaluating if-statement"
+                    stack.append((IF_COND, node, context))
+                    node = node.cond
+                    continue
 
-        elif isinstance(node, FuncDef):
-            context.set(node.func_name, (node.parameters, node.func_body, context))
-            return None
+                elif node_type is UnaryOp:
+                    stack.append((UNARY, node, context))
+                    node = node.operand
+                    continue
 
-        elif isinstance(node, IfStmt):
-            try:
-                condition_value = self.evaluate(node.cond, context)
-                if condition_value:
-                    return self.evaluate(node.then_branch, context)
-                elif node.else_branch is not None:
-                    return self.evaluate(node.else_branch, context)
-                return None
-            except Exception as e:
-                raise RuntimeError(f"Error evaluating if-statement: {str(e)}")
+                elif node_type is LambdaExpr:
+                    value = Closure(LAMBDA, node.parameters, node.expr_body, context,
+                                    self.chain(node) if type(node.expr_body) is LambdaExpr else None)
+
+                elif node_type is FuncDef:
+                    context.define(node.func_name, Closure(DEFUNC, node.parameters, node.func_body, context))
+                    if self.memo is not None:
+                        self.memo.clear()  # cached results may depend on the old definition
+                    value = None
+
+                elif node_type is SharedExpr:
+                    slots = context.slots
+                    if node.slot < len(slots) and slots[node.slot] is not Unset:
+                        value = slots[node.slot]
+                    else:
+                        stack.append((SHARE, node, context))
+                        node = node.expr
+                        continue
 
-        elif isinstance(node, FuncApp):
-            try:
-                if isinstance(node.function, str):
-                    func = context.get(node.function)
                 else:
-                    func = self.evaluate(node.function, context)
+                    node, context, value = self.extension(node, context, stack)
+                    if node is not None:
+                        continue
 
-                args = [self.evaluate(arg, context) for arg in node.arguments]
-                if isinstance(func, tuple) and len(func) == 3:
-                    parameters, body, closure_env = func
+                # Hand the value to pending frames until one of them needs another node evaluated
+                while stack:
+                    frame = stack.pop()
+                    kind = frame[0]
 
-                    if isinstance(parameters, list):
-                        if len(parameters) != len(args):
-                            raise TypeError(f"Function expected {len(parameters)} arguments but got {len(args)}")
+                    if kind == BIN_LEFT:
+                        op = frame[1].op
+                        if op == '||' and value:
+                            value = True
+                            continue
+                        elif op == '&&' and not value:
+                            value = False
+                            continue
+                        else:
+                            stack.append((BIN_RIGHT, frame[1], frame[2], value))
+                            node = frame[1].right
+                            context = frame[2]
+                            break
 
-                        new_env = closure_env.extend_scope(parameters, args)
-                        return self.evaluate(body, new_env)
-                    else:  # Lambda expression
-                        for arg in args:
-                            func = self.execute_function(func, [arg])
-                        return func
+                    elif kind == BIN_RIGHT:
+                        value = self.apply_operators(frame[1].op, frame[3], value)
+                        continue
+
+                    elif kind == IF_COND:
+                        if_node = frame[1]
+                        if value:
+                            node = if_node.then_branch
+                        elif if_node.else_branch is not None:
+                            node = if_node.else_branch
+                        else:
+                            value = None
+                            continue
+                        context = frame[2]
+                        break
+
+                    elif kind == UNARY:
+                        value = self.apply_unary_operator(frame[1].op, value)
+                        continue
+
+                    elif kind == APP_FUNC:
+                        arguments = frame[1].arguments
+                        if arguments:
+                            stack.append((APP_ARGS, frame[1], frame[2], value, []))
+                            node = arguments[0]
+                            context = frame[2]
+                            break
+                        func, args = value, []
+
+                    elif kind == APP_ARGS:
+                        args = frame[4]
+                        args.append(value)
+                        arguments = frame[1].arguments
+                        if len(args) < len(arguments):
+                            stack.append(frame)
+                            node = arguments[len(args)]
+                            context = frame[2]
+                            break
+                        func = frame[3]
+
+                    elif kind == SHARE:
+                        frame[2].share(frame[1].slot, value)
+                        continue
+
+                    elif kind == MEMO:
+                        self.memo.store(frame[1], value)
+                        continue
+
+                    elif kind == RETURN_HOOK:
+                        frame[1](value)
+                        continue
+
+                    else:  # CURRY: apply the next argument to the lambda just returned
+                        args, position = frame[1], frame[2]
+                        if position + 1 < len(args):
+                            stack.append((CURRY, args, position + 1))
+                        node, context = self.call(value, [args[position]], stack)
+                        break
+
+                    # Only complete function applications reach this point
+                    if self.memo is not None:
+                        key = self.memo_key(func, args)
+                        if key is not None:
+                            cached = self.memo.get(key)
+                            if cached is not MISSING:
+                                value = cached
+                                continue
+                            stack.append((MEMO, key))
+
+                    target = self.call(func, args, stack)
+                    if target is None:
+                        value = func
+                    else:
+                        node, context = target
+                        break
 
                 else:
-                    raise TypeError(f"Expected a function or lambda expression, but got: {func}")
+                    return value
 
-            except Exception as e:
-                raise RuntimeError(f"Error applying function: {str(e)}")
+        except EvaluationError:
+            raise
+        except Suspended as suspended:
+            suspended.error_prefix = error_prefix
+            raise
+        except Exception as e:
+            if error_prefix is None:
+                raise
+            raise EvaluationError(f"{error_prefix}: {str(e)}")
 
-        else:
-            raise TypeError(f"Unknown node type: {type(node)}")
+    def extension(self, node, context, stack):
+        # Node types added by subclasses: returns (node, context, None) to evaluate node in context instead,
+        # or (None, context, value). Frames pushed onto stack receive the value of what is evaluated next
+        raise TypeError(f"Unknown node type: {type(node)}")
 
-    def execute_function(self, function, arguments):
-        parameters, body, closure_basic = function
+    def lookup(self, name, depth, index, context):
+        if depth is None:
+            return context.get(name)
+        return context.lookup(depth, index)
 
-        if len(arguments) != 1:
-            raise TypeError("Each lambda expression should receive exactly one argument.")
+    def chain(self, node):
+        chain = self.chains.get(node, MISSING)
+        if chain is MISSING:
+            chain = self.chains[node] = flatten_chain(node)
+        return chain
 
-        new_basic = closure_basic.extend_scope([parameters], arguments)
-        result = self.evaluate(body, new_basic)
-        return result
+    def memo_key(self, func, args):
+        # Only Defuncs are cached: their closure is the global scope, so the result depends on the arguments alone
+        if type(func) is Closure and func.kind == DEFUNC and isinstance(func.env, Environment):
+            return self.memo.key(func, args)
+        return None
+
+    def call(self, func, args, stack):
+        # Returns the (body, environment) to evaluate for the call, or None when a lambda gets no arguments
+        if type(func) is not Closure:
+            raise TypeError(f"Expected a function or lambda expression, but got: {func}")
+
+        if func.kind == DEFUNC:
+            if func.arity != len(args):
+                raise TypeError(f"Function expected {func.arity} arguments but got {len(args)}")
+            return func.body, func.env.extend_scope(func.names, args)
+
+        # Lambda expression: curried, one argument per application, or a whole chain at once
+        if not args:
+            return None
+        chain = func.chain
+        count = len(chain[0]) if chain is not None and len(args) >= len(chain[0]) else 1
+        if len(args) > count:
+            stack.append((CURRY, args, count))
+        if count > 1:
+            return chain[1], func.env.extend_scope(chain[0], args[:count])
+        return func.body, func.env.extend_scope(func.names, args[:1])
 
     def apply_operators(self, op, left, right):
-        if op == '+':
-            return left + right
-        elif op == '-':
-            return left - right
-        elif op == '*':
-            return left * right
-        elif op == '/':
-            if right == 0:
-                raise ZeroDivisionError("Invalid, division by zero!")
-            return left // right
-        elif op == '%':
-            return left % right
+        apply = OPERATORS.get(op)
+        if apply is not None:
+            return apply(left, right)
         elif op == '||':
             return left or right
         elif op == '&&':
             return left and right
-        elif op == '==':
-            return left == right
-        elif op == '!=':
-            return left != right
-        elif op == '<':
-            return left < right
-        elif op == '>':
-            return left > right
-        elif op == '<=':
-            return left <= right
-        elif op == '>=':
-            return left >= right
         else:
             raise TypeError(f"Invalid operator: {op}")
 
@@ -0,0 +1,258 @@
+import copy
+
+from ast_node import FuncDef, LambdaExpr, FuncApp, Identifier, IntLit, BoolLit, UnaryOp, BinOp, IfStmt, SharedExpr, \
+    children, replace_children
+from interpreter import Interpreter, RETURN_HOOK
+from optimizer import global_names
+
+
+class Thunk:
+    # An argument bound unevaluated: its node and context until it is first forced, then its value
+    __slots__ = ('node', 'context', 'value')
+
+    def __init__(self, node, context):
+        self.node = node
+        self.context = context
+        self.value = None
+
+    def store(self, value):
+        self.value = value
+        self.node = self.context = None  # the environment of the call site is no longer kept alive
+        return value
+
+    def __repr__(self):
+        return repr(self.value) if self.node is None else "<unevaluated argument>"
+
+
+class Delay:
+    # An argument passed lazily: evaluates to a Thunk of expr in the current context
+    __slots__ = ('expr',)
+
+    def __init__(self, expr):
+        self.expr = expr
+
+    def __repr__(self):
+        return repr(self.expr)
+
+
+class Force:
+    # A read of a local variable that may hold a Thunk, which is evaluated the first time it is read
+    __slots__ = ('variable',)
+
+    def __init__(self, variable):
+        self.variable = variable
+
+    def __repr__(self):
+        return repr(self.variable)
+
+
+def is_local(node):
+    return isinstance(node, Identifier) and node.depth is not None
+
+
+def forced_parameters(body, strict):
+    # Positions of the Defunc parameters that evaluating body always forces, unless the evaluation fails
+    # or diverges. strict: Defunc name -> positions of the parameters it is known to force
+    results = []
+    pending = [(body, False)]
+    while pending:
+        node, visited = pending.pop()
+        if not visited:
+            pending.append((node, True))
+            if not isinstance(node, LambdaExpr):  # a lambda's body runs only when it is called
+                pending.extend((child, False) for child in reversed(children(node)))
+            continue
+
+        count = 0 if isinstance(node, LambdaExpr) else len(children(node))
+        sets = results[len(results) - count:] if count else []
+        del results[len(results) - count:]
+
+        if isinstance(node, Identifier):
+            forced = {node.index} if node.depth == 0 else set()
+        elif isinstance(node, BinOp):
+            forced = sets[0] if node.op in ('&&', '||') else sets[0] | sets[1]
+        elif isinstance(node, IfStmt):
+            forced = sets[0] | (sets[1] & sets[2]) if len(sets) == 3 else sets[0]
+        elif isinstance(node, FuncApp):
+            if not isinstance(node.function, str):
+                forced = sets[0]
+            elif node.depth == 0:
+                forced = {node.index}
+            elif node.depth is None and node.function in strict:
+                forced = set().union(*(sets[i] for i in strict[node.function] if i < len(sets)))
+            else:
+                forced = set()
+        elif isinstance(node, (UnaryOp, SharedExpr)):
+            forced = sets[0]
+        else:
+            forced = set()
+        results.append(forced)
+    return results[0]
+
+
+def strictness(func_defs, strict):
+    # Greatest fixpoint over mutually recursive Defuncs: every parameter starts out strict, and a recursive
+    # call that never returns forces everything, so only parameters some path can skip are dropped
+    strict = dict(strict)
+    for func_def in func_defs:
+        strict[func_def.func_name] = set(range(len(func_def.parameters)))
+    changed = True
+    while changed:
+        changed = False
+        for func_def in func_defs:
+            name = func_def.func_name
+            forced = forced_parameters(func_def.func_body, strict) & strict[name]
+            if forced != strict[name]:
+                strict[name] = forced
+                changed = True
+    return strict
+
+
+def delay_arguments(root, strict):
+    # A copy of root for call-by-need: reads of local variables become Force, and each argument that the
+    # callee may not use becomes a Delay, except literals, lambdas and variables, which are passed as they
+    # are (a variable's Thunk is shared, not wrapped again). Arguments of strict parameters stay eager.
+    rewritten = {}
+    results = []
+    pending = [(root, False)]
+    while pending:
+        node, visited = pending.pop()
+        if not visited:
+            if id(node) in rewritten:
+                results.append(rewritten[id(node)])
+                continue
+            pending.append((node, True))
+            pending.extend((child, False) for child in reversed(children(node)))
+            continue
+
+        count = len(children(node))
+        new_children = results[len(results) - count:] if count else []
+        del results[len(results) - count:]
+        if id(node) in rewritten:
+            results.append(rewritten[id(node)])
+            continue
+
+        if is_local(node):
+            new = Force(node)
+        elif isinstance(node, FuncApp):
+            function = node.function
+            if isinstance(function, str):
+                eager = strict.get(function, ()) if node.depth is None else ()
+                if node.depth is not None:
+                    variable = Identifier(function)
+                    variable.depth, variable.index = node.depth, node.index
+                    function = Force(variable)
+            else:
+                eager = ()
+                function = new_children.pop(0)
+            arguments = [argument if position in eager else delay(argument)
+                         for position, argument in enumerate(new_children)]
+            new = FuncApp(function, arguments)
+            if isinstance(function, str):
+                new.depth, new.index = node.depth, node.index
+        elif any(child is not old for child, old in zip(new_children, children(node))):
+            new = copy.copy(node)
+            replace_children(new, new_children)
+        else:
+            new = node
+        rewritten[id(node)] = new
+        results.append(new)
+    return results[0]
+
+
+def delay(argument):
+    if isinstance(argument, Force):
+        return argument.variable
+    if isinstance(argument, (IntLit, BoolLit, LambdaExpr, Identifier)):
+        return argument
+    return Delay(argument)
+
+
+class LazyInterpreter(Interpreter):
+    # The tree walker with call-by-need arguments: an argument is bound as a Thunk and evaluated at most
+    # once, when the callee first reads it, so an argument the callee doesn't use is never computed (and
+    # may fail or not terminate). Strictness analysis keeps the arguments a Defunc always uses eager, so
+    # they skip the Thunk. Runs on a rewritten copy of each statement, like ParallelInterpreter.
+    def __init__(self, ast, memo=None):
+        super().__init__(ast, memo)
+        self.strict = {}  # Defunc name -> positions of the parameters it always forces
+        self.learned = set()  # id() of the FuncDefs analyzed
+        self.defined = set()
+        self.definitions = {}  # Defunc name -> the FuncDef last prepared for it, as it was before rewriting
+
+    def execute(self, statements):
+        if isinstance(statements, list):
+            self.learn(statements)
+        return super().execute(self.prepare(statement) for statement in statements)
+
+    def learn(self, statements):
+        # Analyzes the Defuncs in statements together, so mutually recursive ones see each other. A name
+        # defined more than once keeps no strict parameters: which definition a caller reaches depends on
+        # when it runs
+        counts = {}
+        func_defs = [statement for statement in statements if isinstance(statement, FuncDef)]
+        for func_def in func_defs:
+            counts[func_def.func_name] = counts.get(func_def.func_name, 0) + 1
+            self.learned.add(id(func_def))
+        single = []
+        redefined = set()
+        for func_def in func_defs:
+            name = func_def.func_name
+            if counts[name] == 1 and name not in self.defined:
+                single.append(func_def)
+            else:
+                self.strict.pop(name, None)
+                if name in self.defined:
+                    redefined.add(name)
+            self.defined.add(name)
+        self.strict = strictness(single, self.strict)
+        if redefined:
+            self.forget(redefined, counts)
+
+    def forget(self, redefined, batch):
+        # Defuncs already bound that call a redefined name, directly or through each other, were analyzed
+        # and rewritten with its old strict parameters: they keep none, and are bound again with bodies
+        # that pass every argument to it lazily. Those defined again in batch are handled by learn
+        callers = {}
+        for name, func_def in self.definitions.items():
+            for callee in global_names(func_def.func_body):
+                callers.setdefault(callee, []).append(name)
+        stale = set()
+        pending = list(redefined)
+        while pending:
+            for caller in callers.get(pending.pop(), ()):
+                if caller not in stale and caller not in batch:
+                    stale.add(caller)
+                    pending.append(caller)
+        for name in stale:
+            self.strict.pop(name, None)
+        for name in stale:
+            self.evaluate(delay_arguments(self.definitions[name], self.strict), self.global_env)
+
+    def prepare(self, statement):
+        # Statements that did not come in a list, such as a stream's, are analyzed as they arrive
+        if isinstance(statement, FuncDef):
+            if id(statement) not in self.learned:
+                self.learn([statement])
+            self.definitions[statement.func_name] = statement
+        return delay_arguments(statement, self.strict)
+
+    def extension(self, node, context, stack):
+        if type(node) is Force:
+            value = self.evaluate_variable(node.variable, context)
+            if type(value) is not Thunk:
+                return None, context, value
+            if value.node is None:
+                return None, context, value.value
+            stack.append((RETURN_HOOK, value.store))
+            return value.node, value.context, None
+        if type(node) is Delay:
+            return None, context, Thunk(node.expr, context)
+        return super().extension(node, context, stack)
+
+    def evaluate_variable(self, variable, context):
+        depth = variable.depth
+        while depth:
+            context = context.parent
+            depth -= 1
+        return context.slots[variable.index]
@@ -1,5 +1,7 @@
 import re
 
+from scanner import Scanner
+
 
 class Lexer:
     def __init__(self, code):
@@ -35,26 +37,45 @@ class Lexer:
         ('INVALID', r'.'),           # Any other character
     ]
 
-    # The master regular expression
+    # The master regular expression, kept as the reference for the Scanner
     tok_regex = '|'.join('(?P<%s>%s)' % pair for pair in token_spec)
+    tok_pattern = re.compile(tok_regex)
 
     def tokenize(self):
-        for movj in re.finditer(self.tok_regex, self.code):
-            kind = movj.lastgroup
-            value = movj.group(kind)
-            column = movj.start() - self.line_start
-            if kind == 'INTEGER':
-                value = int(value)
-            elif kind == 'NEWLINE':
-                self.line_start = movj.end()
-                self.line_num += 1
-                continue
-            elif kind == 'BOOLEAN':
-                value = True if value == 'True' else False
-            elif kind == 'JUMP' or kind == 'COMMENT':
-                continue
-            elif kind == 'INVALID':
-                raise RuntimeError(f'{value!r} unexpected on line {self.line_num}')
-            self.tokens.append((kind, value, self.line_num, column))
-        self.tokens.append(('EOF', 'EOF', self.line_num, column))
+        scanner = Scanner(self.code)
+        self.tokens.extend(scanner.scan())
+        self.line_num = scanner.line_num
         return self.tokens
+
+    def stream(self):
+        # Yields tokens as they are scanned. code is a string or an iterable of lines (e.g. an open file),
+        # so a large source never has to be held in memory as one string or one token list
+        scanner = Scanner(self.code)
+        for tokens in scanner.batches():
+            yield from tokens
+        self.line_num = scanner.line_num
+
+    def regex_stream(self):
+        # The same tokens matched with tok_pattern, the definition the Scanner reproduces by hand
+        chunks = (self.code,) if isinstance(self.code, str) else self.code
+        column = 0
+        for chunk in chunks:
+            self.line_start = 0
+            for movj in self.tok_pattern.finditer(chunk):
+                kind = movj.lastgroup
+                value = movj.group(kind)
+                column = movj.start() - self.line_start
+                if kind == 'INTEGER':
+                    value = int(value)
+                elif kind == 'NEWLINE':
+                    self.line_start = movj.end()
+                    self.line_num += 1
+                    continue
+                elif kind == 'BOOLEAN':
+                    value = True if value == 'True' else False
+                elif kind == 'JUMP' or kind == 'COMMENT':
+                    continue
+                elif kind == 'INVALID':
+                    raise RuntimeError(f'{value!r} unexpected on line {self.line_num}')
+                yield kind, value, self.line_num, column
+        yield 'EOF', 'EOF', self.line_num, column
@@ -0,0 +1,437 @@
+import hashlib
+import json
+import os
+import re
+
+from ast_node import FuncDef, LambdaExpr, FuncApp, Identifier, IntLit, BoolLit, UnaryOp, BinOp, IfStmt
+from resolver import Resolver
+
+
+BNF_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'BNF.txt')
+CACHE_DIR = '__lambdacache__'
+TABLE_FORMAT = 1
+
+# Token kinds that are terminals of the grammar by kind; any other token is the terminal of its text
+KIND_TERMINALS = {'INTEGER', 'BOOLEAN', 'LETTER', 'EOF'}
+
+EOF_TOKEN = ('EOF', 'EOF', -1, -1)
+
+# One symbol of a rule: <nonterminal>, "text", a token KIND, or the | between alternatives
+SYMBOL = re.compile(r'\s*(?:(<\w+>)|"([^"]*)"|([A-Z]+)|(\|))')
+
+_grammars = {}  # absolute path of a BNF file -> its Grammar
+
+
+def read_bnf(text):
+    # The rules of a BNF file: '<nonterminal>' -> alternatives, each a list of symbols, where a symbol is a
+    # '<nonterminal>' or a terminal (a token kind or text); "" contributes no symbol
+    rules = {}
+    lhs = None
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if '::=' in line:
+            head, line = line.split('::=', 1)
+            lhs = head.strip()
+            if not re.fullmatch(r'<\w+>', lhs):
+                raise ValueError(f"line {number}: {lhs!r} is not a nonterminal")
+            if lhs in rules:
+                raise ValueError(f"line {number}: {lhs} is defined twice")
+            rules[lhs] = [[]]
+        elif lhs is None or not line.startswith('|'):
+            raise ValueError(f"line {number}: expected a rule or a line starting with |")
+        position = 0
+        line = line.rstrip()
+        while position < len(line):
+            match = SYMBOL.match(line, position)
+            if match is None:
+                raise ValueError(f"line {number}: unexpected {line[position:]!r}")
+            position = match.end()
+            nonterminal, text, kind, bar = match.groups()
+            if bar:
+                rules[lhs].append([])
+            elif nonterminal or kind:
+                rules[lhs][-1].append(nonterminal or kind)
+            elif text:
+                rules[lhs][-1].append(text)
+    for alternatives in rules.values():
+        for rhs in alternatives:
+            for symbol in rhs:
+                if re.fullmatch(r'<\w+>', symbol) and symbol not in rules:
+                    raise ValueError(f"{symbol} is used but not defined")
+    return rules
+
+
+def sequence_first(symbols, rules, first, nullable):
+    # FIRST of a sequence of symbols, and whether all of them can be empty
+    terminals = set()
+    for symbol in symbols:
+        if symbol not in rules:
+            terminals.add(symbol)
+            return terminals, False
+        terminals |= first[symbol]
+        if symbol not in nullable:
+            return terminals, False
+    return terminals, True
+
+
+def first_sets(rules):
+    first = {lhs: set() for lhs in rules}
+    nullable = set()
+    changed = True
+    while changed:
+        changed = False
+        for lhs, alternatives in rules.items():
+            for rhs in alternatives:
+                terminals, empty = sequence_first(rhs, rules, first, nullable)
+                if not terminals <= first[lhs]:
+                    first[lhs] |= terminals
+                    changed = True
+                if empty and lhs not in nullable:
+                    nullable.add(lhs)
+                    changed = True
+    return first, nullable
+
+
+def follow_sets(rules, first, nullable):
+    follow = {lhs: set() for lhs in rules}
+    changed = True
+    while changed:
+        changed = False
+        for lhs, alternatives in rules.items():
+            for rhs in alternatives:
+                for position, symbol in enumerate(rhs):
+                    if symbol not in rules:
+                        continue
+                    terminals, empty = sequence_first(rhs[position + 1:], rules, first, nullable)
+                    if empty:
+                        terminals = terminals | follow[lhs]
+                    if not terminals <= follow[symbol]:
+                        follow[symbol] |= terminals
+                        changed = True
+    return follow
+
+
+def generate(rules):
+    # The Grammar of rules with its LL(1) prediction table. An alternative is predicted by the terminals
+    # that can start it and, when it can be empty, by those that can follow its nonterminal; where the two
+    # meet, the alternative that consumes the token wins, as a hand-written parser would decide (a name
+    # followed by '(' is a call). Any other overlap means the rules are not LL(1).
+    first, nullable = first_sets(rules)
+    follow = follow_sets(rules, first, nullable)
+    table = {lhs: {} for lhs in rules}
+    preferred = []
+    productions = [(lhs, rhs) for lhs, alternatives in rules.items() for rhs in alternatives]
+    empty_alternatives = []
+    for index, (lhs, rhs) in enumerate(productions):
+        terminals, empty = sequence_first(rhs, rules, first, nullable)
+        for terminal in terminals:
+            if terminal in table[lhs]:
+                raise ValueError(f"the grammar is not LL(1): {lhs} has two alternatives starting with {terminal!r}")
+            table[lhs][terminal] = index
+        if empty:
+            empty_alternatives.append(index)
+    for index in empty_alternatives:
+        lhs = productions[index][0]
+        for terminal in follow[lhs]:
+            if terminal in table[lhs]:
+                if table[lhs][terminal] in empty_alternatives:
+                    raise ValueError(f"the grammar is not LL(1): {lhs} has two empty alternatives before {terminal!r}")
+                preferred.append((lhs, terminal))
+                continue
+            table[lhs][terminal] = index
+    return Grammar(rules, first, follow, table, sorted(preferred))
+
+
+class Grammar:
+    # Rules read from a BNF file with their FIRST and FOLLOW sets and LL(1) prediction table:
+    # table[nonterminal][terminal] is the index in productions of the alternative to expand
+    def __init__(self, rules, first, follow, table, preferred):
+        self.rules = rules
+        self.productions = [(lhs, rhs) for lhs, alternatives in rules.items() for rhs in alternatives]
+        self.first = first
+        self.follow = follow
+        self.table = table
+        self.preferred = preferred  # (nonterminal, terminal) where the empty alternative gave way
+        self.driver = None  # LLParser's form of the table, built on first use
+
+    def dumps(self):
+        return json.dumps({
+            'rules': self.rules,
+            'first': {lhs: sorted(terminals) for lhs, terminals in self.first.items()},
+            'follow': {lhs: sorted(terminals) for lhs, terminals in self.follow.items()},
+            'table': self.table,
+            'preferred': self.preferred,
+        })
+
+    @classmethod
+    def loads(cls, text):
+        data = json.loads(text)
+        return cls(data['rules'], {lhs: set(terminals) for lhs, terminals in data['first'].items()},
+                   {lhs: set(terminals) for lhs, terminals in data['follow'].items()}, data['table'],
+                   [tuple(entry) for entry in data['preferred']])
+
+
+def load_grammar(path=BNF_PATH):
+    # The Grammar of a BNF file, generated once: the table is kept in __lambdacache__ next to the file, keyed
+    # by a hash of the file and of this module, and in memory for the rest of the process
+    path = os.path.abspath(path)
+    grammar = _grammars.get(path)
+    if grammar is not None:
+        return grammar
+    with open(path, 'rb') as file:
+        source = file.read()
+    with open(os.path.abspath(__file__), 'rb') as file:
+        key = hashlib.sha256(bytes([TABLE_FORMAT]) + file.read() + source).hexdigest()
+    directory, name = os.path.split(path)
+    table_path = os.path.join(directory, CACHE_DIR, f"{name}.table")
+    try:
+        with open(table_path) as file:
+            header, text = file.read().split('\n', 1)
+        if header != key:
+            raise ValueError("stale table")
+        grammar = Grammar.loads(text)
+    except (OSError, ValueError, KeyError):
+        grammar = generate(read_bnf(source.decode('utf-8')))
+        store_table(table_path, key + '\n' + grammar.dumps())
+    _grammars[path] = grammar
+    return grammar
+
+
+def store_table(path, text):
+    # Best effort, like cache.store: without a writable directory the table is generated again next time
+    temporary = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temporary, 'w') as file:
+            file.write(text)
+        os.replace(temporary, path)
+    except OSError:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+
+
+# Building the AST. Each nonterminal's action gets the values of its children, tokens for terminals,
+# and returns its own. Lists built by right-recursive rules hold their items last first, because the
+# innermost rule completes first. A nonterminal whose action is None only gives structure: it has no value.
+
+def first(children):
+    return children[0]
+
+
+def function_def(children):
+    return FuncDef(func_name=children[4][1], parameters=children[8], func_body=children[10])
+
+
+def parameters(children):
+    children[1].reverse()
+    return children[1]
+
+
+def parameter_list(children):
+    if not children:
+        return []
+    names = children[2]
+    names.append(children[0][1])
+    return names
+
+
+def if_statement(children):
+    return IfStmt(children[1], children[3], children[5])
+
+
+def else_part(children):
+    return children[2] if children else None
+
+
+def operator_level(children):
+    # <level> ::= <tighter level> <level_rest>: folds the operators to the left
+    value, pending = children
+    while pending:
+        op, right = pending.pop()
+        value = BinOp(value, op, right)
+    return value
+
+
+def operator_rest(children):
+    if not children:
+        return []
+    pending = children[2]
+    pending.append((children[0][1], children[1]))
+    return pending
+
+
+def unary(children):
+    if len(children) == 2:
+        return UnaryOp(children[0][1], children[1])
+    return children[0]
+
+
+def primary(children):
+    token = children[0]
+    if token[0] == 'INTEGER':
+        return IntLit(token[1])
+    if token[0] == 'BOOLEAN':
+        return BoolLit(token[1])
+    if token[0] == 'LETTER':
+        if children[1] is None:
+            return Identifier(token[1])
+        return FuncApp(function=token[1], arguments=children[1])
+    return children[1]
+
+
+def group(children):
+    if len(children) == 2:
+        return children[0]  # a parenthesized expression
+    lambda_expr = LambdaExpr(parameters=children[1][1], expr_body=children[3])
+    if children[5] is None:
+        return lambda_expr
+    return FuncApp(function=lambda_expr, arguments=children[5])
+
+
+def call(children):
+    # None when there is no argument list
+    if not children:
+        return None
+    children[1].reverse()
+    return children[1]
+
+
+def arguments(children):
+    if not children:
+        return []
+    values = children[1]
+    values.append(children[0])
+    return values
+
+
+def more_arguments(children):
+    return children[1] if children else []
+
+
+ACTIONS = {
+    '<program>': None,
+    '<statements>': None,
+    '<statement>': first,
+    '<function_def>': function_def,
+    '<function_body>': first,
+    '<parameters>': parameters,
+    '<parameter_list>': parameter_list,
+    '<if_statement>': if_statement,
+    '<else_part>': else_part,
+    '<expression>': first,
+    '<disjunction>': operator_level,
+    '<disjunction_rest>': operator_rest,
+    '<conjunction>': operator_level,
+    '<conjunction_rest>': operator_rest,
+    '<equality>': operator_level,
+    '<equality_rest>': operator_rest,
+    '<comparison>': operator_level,
+    '<comparison_rest>': operator_rest,
+    '<sum>': operator_level,
+    '<sum_rest>': operator_rest,
+    '<product>': operator_level,
+    '<product_rest>': operator_rest,
+    '<unary>': unary,
+    '<primary>': primary,
+    '<group>': group,
+    '<call>': call,
+    '<arguments>': arguments,
+    '<more_arguments>': more_arguments,
+}
+
+STATEMENT = '<statement>'  # completed statements are resolved and handed out one at a time
+
+
+def driver_tables(grammar):
+    # The table with nonterminals numbered and each entry replaced by the symbols to push, last first,
+    # below them the completion marker ~production whose action builds the node. A production whose
+    # action is None, or that passes on the value of its only child, needs no marker.
+    ids = {lhs: index for index, lhs in enumerate(grammar.rules)}
+    expansions = []
+    completions = []
+    for index, (lhs, rhs) in enumerate(grammar.productions):
+        if lhs not in ACTIONS:
+            raise ValueError(f"no action builds the value of {lhs}")
+        action = ACTIONS[lhs]
+        symbols = tuple(ids.get(symbol, symbol) for symbol in reversed(rhs))
+        emit = lhs == STATEMENT
+        if action is None or (action is first and len(rhs) == 1 and not emit):
+            expansions.append(symbols)
+        else:
+            expansions.append((~index,) + symbols)
+        completions.append((len(rhs), action, emit))
+    table = [{terminal: expansions[index] for terminal, index in grammar.table[lhs].items()}
+             for lhs in grammar.rules]
+    # Expanding a nonterminal leaves its leftmost symbol on top with the same token ahead, so where that
+    # symbol is a nonterminal with a non-empty entry for the token, its expansion is appended right away:
+    # an operand descends through every precedence level in one step
+    for entries in table:
+        for terminal, expansion in entries.items():
+            while expansion and type(expansion[-1]) is int and expansion[-1] >= 0:
+                leftmost = table[expansion[-1]].get(terminal)
+                if leftmost is None or not any(type(symbol) is str or symbol >= 0 for symbol in leftmost):
+                    break
+                expansion = expansion[:-1] + leftmost
+            entries[terminal] = expansion
+    return ids[next(iter(grammar.rules))], table, completions
+
+
+class LLParser:
+    # Table-driven LL(1) parser for the grammar of a BNF file, with the interface of Parser. One loop
+    # over an explicit stack of pending symbols predicts each alternative from the next token, so nesting
+    # costs list entries, not Python frames, and a grammar change only needs a new table.
+    def __init__(self, toks, bnf_path=BNF_PATH):
+        self.tokens = iter(toks)
+        self.grammar = load_grammar(bnf_path)
+        if self.grammar.driver is None:
+            self.grammar.driver = driver_tables(self.grammar)
+
+    def parse(self):
+        return list(self.statements())
+
+    def statements(self):
+        # Yields each top-level statement, resolved, as soon as it is parsed
+        start, table, completions = self.grammar.driver
+        resolver = Resolver()
+        tokens = self.tokens
+        stack = [start]
+        values = []
+        try:
+            token = next(tokens, EOF_TOKEN)
+            terminal = token[0] if token[0] in KIND_TERMINALS else token[1]
+            while stack:
+                top = stack.pop()
+                if type(top) is str:
+                    if top != terminal:
+                        self.error(token, [top])
+                    values.append(token)
+                    token = next(tokens, EOF_TOKEN)
+                    terminal = token[0] if token[0] in KIND_TERMINALS else token[1]
+                elif top >= 0:
+                    expansion = table[top].get(terminal)
+                    if expansion is None:
+                        self.error(token, table[top])
+                    stack.extend(expansion)
+                else:
+                    count, action, emit = completions[~top]
+                    if count:
+                        children = values[-count:]
+                        del values[-count:]
+                    else:
+                        children = []
+                    value = action(children)
+                    if emit:
+                        yield resolver.resolve_node(value)
+                    else:
+                        values.append(value)
+        except Exception as e:
+            raise RuntimeError(f"Parsing failed: {str(e)}")
+
+    def error(self, token, expected):
+        expected = ', '.join(sorted(map(repr, expected)))
+        raise SyntaxError(f"Syntax Error at line {token[2]}, column {token[3]}: expected {expected} "
+                          f"but got {token[0]} {token[1]!r}")
@@ -1,50 +1,153 @@
-from interpreter import Environment, Interpreter
+from cache import load_program
+from compiler import CompiledInterpreter
+from fuel import MeteredInterpreter
+from interpreter import Interpreter
+from lazy import LazyInterpreter
 from lexer import Lexer
+from memo import MemoCache
+from optimizer import Optimizer
+from parallel import ParallelInterpreter
 from parser import Parser
+from profiler import ProfilingInterpreter, Sampler, write_profile
+from session import Session
+from vm import VMInterpreter
+import argparse
+import functools
 import sys
 
 
-def run_file(filename):
+def run_file(filename, interpreter_class=Interpreter, opt_level=1, memo=None, stream=False, use_cache=True,
+             profile=None, profile_out=None):
     try:
-        with open(filename, 'r') as file:
-            execute = file.read()
-        tokens = Lexer(execute).tokenize()
-        ast = Parser(tokens).parse()
-        interpreter = Interpreter(ast)
-        interpreter.interpret()
+        if use_cache and not stream:
+            ast = load_program(filename, opt_level)
+        else:
+            with open(filename, 'r') as file:
+                if stream:
+                    run_stream(file, interpreter_class, opt_level, memo, profile, profile_out)
+                    return
+                # Lexed line by line as the parser asks for tokens
+                ast = Parser(Lexer(file).stream()).parse()
+            ast = Optimizer(opt_level).optimize(ast)
+        run_interpreter(interpreter_class(ast, memo), memo, profile, profile_out)
     except FileNotFoundError:
         print(f"Error: The file '{filename}' was not found.")
     except Exception as e:
         print(f"Error executing file '{filename}': {e}")
 
 
-def repl():
+def run_stream(file, interpreter_class=Interpreter, opt_level=1, memo=None, profile=None, profile_out=None):
+    # Each top-level statement runs as soon as it is parsed: output starts right away and memory
+    # stays bounded by the largest statement instead of the whole program
+    if hasattr(sys.stdout, "reconfigure"):
+        sys.stdout.reconfigure(line_buffering=True)  # results reach a pipe as they are printed
+    optimizer = Optimizer(opt_level)
+    statements = Parser(Lexer(file).stream()).statements()
+    interpreter = interpreter_class((optimizer.optimize_statement(statement) for statement in statements), memo)
+    run_interpreter(interpreter, memo, profile, profile_out)
+
+
+def run_interpreter(interpreter, memo=None, profile=None, profile_out=None):
+    # profile is None, 'calls' (interpreter is a ProfilingInterpreter) or 'sample'
+    sampler = Sampler(interpreter) if profile == 'sample' else None
+    try:
+        if sampler is not None:
+            sampler.start()
+        interpreter.interpret()
+    finally:
+        if sampler is not None:
+            sampler.stop()
+        interpreter.close()
+    if memo is not None:
+        print(memo.report())
+    if profile is not None:
+        write_profile(sampler if sampler is not None else interpreter.profile, profile_out)
+
+
+def repl(interpreter_class=Interpreter, opt_level=1, memo=None):
     print("Welcome to the Interpreter REPL. Type 'exit' to quit.")
-    global_env = Environment()
+    session = Session(interpreter_class, opt_level, memo)
 
     while True:
         try:
-            code = input(">>> ")
-            if code.lower() in {"exit"}:
+            code = input("... " if session.pending else ">>> ")
+            if not session.pending and code.lower() in {"exit"}:
                 break
 
-            tokens = Lexer(code).tokenize()
-            ast = Parser(tokens).parse()
-            interpreter = Interpreter(ast)
-            result = interpreter.interpret()
-
-            if result is not None:
-                print(result)
+            session.feed(code)
 
+        except EOFError:
+            break
         except Exception as e:
             print(f"Error: {e}")
+    session.interpreter.close()
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description="Interpreter for the lambda language.")
+    arg_parser.add_argument("file", nargs="?",
+                            help="program to run (.lambda), or - to stream one from stdin; starts the REPL when omitted")
+    engine = arg_parser.add_mutually_exclusive_group()
+    engine.add_argument("--compile", action="store_true",
+                        help="compile the AST to closures instead of walking the tree")
+    engine.add_argument("--vm", action="store_true",
+                        help="compile the AST to bytecode and run it on the stack VM")
+    engine.add_argument("--parallel", type=int, nargs="?", const=0, default=None, metavar="WORKERS",
+                        help="evaluate heavy independent operands in worker processes (default: one per CPU)")
+    engine.add_argument("--lazy", action="store_true",
+                        help="pass arguments by need: each is evaluated when first used, at most once")
+    arg_parser.add_argument("--profile", dest="profile", action="store_const", const="calls", default=None,
+                            help="time every call and print a profile to stderr")
+    arg_parser.add_argument("--sample", dest="profile", action="store_const", const="sample",
+                            help="profile by sampling the stack with a CPU timer; leaves the run unchanged")
+    arg_parser.add_argument("--profile-out", default=None, metavar="FILE",
+                            help="also write the profile as collapsed stacks, for flamegraph tools")
+    arg_parser.add_argument("--stream", action="store_true",
+                            help="run each top-level statement as soon as it is parsed")
+    arg_parser.add_argument("--no-cache", action="store_true",
+                            help="always parse the file instead of reusing the __lambdacache__ entry")
+    arg_parser.add_argument("-O", dest="opt_level", type=int, choices=[0, 1, 2], default=1,
+                            help="optimization level: 0 none, 1 constant folding (default), 2 also inlining")
+    arg_parser.add_argument("--memo", action="store_true",
+                            help="cache results of Defunc calls with integer/boolean arguments")
+    arg_parser.add_argument("--memo-size", type=int, default=4096,
+                            help="maximum number of cached results, least recently used evicted first")
+    arg_parser.add_argument("--fuel", type=int, default=None, metavar="CALLS",
+                            help="stop the program once it has made this many function calls (tree walker only)")
+    args = arg_parser.parse_args()
+    if args.fuel is not None and (args.compile or args.vm or args.parallel is not None or args.lazy or args.profile):
+        arg_parser.error("--fuel works with the tree walker only")
+    if args.profile and (args.compile or args.vm or args.parallel is not None or args.lazy):
+        arg_parser.error("--profile and --sample work with the tree walker only")
+    return args
 
 
 if __name__ == "__main__":
     try:
-        if len(sys.argv) > 1 and sys.argv[1].endswith(".lambda"):
-            run_file(sys.argv[1])
+        args = parse_args()
+        interpreter_class = Interpreter
+        if args.compile:
+            interpreter_class = CompiledInterpreter
+        elif args.vm:
+            interpreter_class = VMInterpreter
+        elif args.profile == "calls":
+            interpreter_class = ProfilingInterpreter
+        elif args.parallel is not None:
+            interpreter_class = functools.partial(ParallelInterpreter, workers=args.parallel or None)
+        elif args.lazy:
+            interpreter_class = LazyInterpreter
+        elif args.fuel is not None:
+            interpreter_class = functools.partial(MeteredInterpreter, fuel=args.fuel)
+        memo = MemoCache(args.memo_size) if args.memo else None
+        if args.file == "-":
+            try:
+                run_stream(sys.stdin, interpreter_class, args.opt_level, memo, args.profile, args.profile_out)
+            except Exception as e:
+                print(f"Error executing stdin: {e}")
+        elif args.file and args.file.endswith(".lambda"):
+            run_file(args.file, interpreter_class, args.opt_level, memo, args.stream, not args.no_cache,
+                     args.profile, args.profile_out)
         else:
-            repl()
+            repl(interpreter_class, args.opt_level, memo)
     except Exception as e:
         print(f"Unexpected error: {e}")
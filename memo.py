@@ -0,0 +1,52 @@
+from collections import OrderedDict
+
+
+MISSING = object()
+
+
+class MemoCache:
+    # Bounded LRU cache of Defunc results, keyed on the function value and its argument values
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, func, args):
+        # Only plain int/bool arguments are cached; True and 1 hash alike, so the type is part of the key.
+        # Function values stay alive in the global scope until redefined, which clears the cache
+        key = [id(func)]
+        for arg in args:
+            arg_type = type(arg)
+            if arg_type is not int and arg_type is not bool:
+                return None
+            key.append(arg_type is bool)
+            key.append(arg)
+        return tuple(key)
+
+    def get(self, key):
+        value = self.entries.get(key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def store(self, key, value):
+        self.entries[key] = value
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self.entries), 'maxsize': self.maxsize}
+
+    def report(self):
+        return (f"Memo cache: {self.hits} hits, {self.misses} misses, {self.evictions} evictions, "
+                f"{len(self.entries)}/{self.maxsize} entries")
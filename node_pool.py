@@ -0,0 +1,264 @@
+from array import array
+import struct
+
+from ast_node import FuncDef, LambdaExpr, FuncApp, Identifier, IntLit, BoolLit, UnaryOp, BinOp, IfStmt, SharedExpr, \
+    children
+
+
+# Node kinds stored in NodePool.kinds
+INT_LIT, BOOL_LIT, IDENTIFIER, UNARY_OP, BIN_OP, IF_STMT, FUNC_APP, LAMBDA_EXPR, FUNC_DEF, SHARED_EXPR = range(10)
+
+INT32_MIN, INT32_MAX = -2 ** 31, 2 ** 31 - 1
+NONE = -1
+
+# Binary layout of NodePool.dumps(): a header with the section sizes, then the arrays in native byte
+# order, the strings joined by NUL and the big integer literals as decimal text
+HEADER = struct.Struct('<4s5I')
+MAGIC = b'LNP1'
+
+# Operand layout per kind (fields a, b, c, d; unused fields are NONE):
+#   INT_LIT      a = value, or index into objects when d == 1 (doesn't fit in 32 bits)
+#   BOOL_LIT     a = 0 or 1
+#   IDENTIFIER   a = name (strings), b = depth, c = index (NONE when global)
+#   UNARY_OP     a = operator (strings), b = operand node
+#   BIN_OP       a = left node, b = operator (strings), c = right node
+#   IF_STMT      a = cond node, b = then node, c = else node
+#   FUNC_APP     a = callee node, b = first argument in lists, c = argument count,
+#                d = 1 when called by name (the callee is then an IDENTIFIER carrying name and address)
+#   LAMBDA_EXPR  a = parameter (strings), b = body node
+#   FUNC_DEF     a = name (strings), b = first parameter in lists, c = parameter count, d = body node
+#   SHARED_EXPR  a = slot, b = expression node
+
+
+class NodePool:
+    # Struct-of-arrays AST storage: a node is an integer index into parallel typed arrays, so a large
+    # program costs a few bytes per node and no Python objects. view() rebuilds the ast_node classes.
+    def __init__(self):
+        self.kinds = array('B')
+        self.a = array('i')
+        self.b = array('i')
+        self.c = array('i')
+        self.d = array('i')
+        self.lists = array('i')  # argument nodes and parameter names of FUNC_APP / FUNC_DEF
+        self.strings = []  # interned names and operators
+        self.string_index = {}
+        self.objects = []  # integer literals too large for the arrays
+        self.roots = array('i')  # top-level statements added with extend()
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def nbytes(self):
+        arrays = (self.kinds, self.a, self.b, self.c, self.d, self.lists, self.roots)
+        return sum(len(values) * values.itemsize for values in arrays)
+
+    def dumps(self):
+        strings = '\0'.join(self.strings).encode('utf-8')
+        objects = ','.join(str(value) for value in self.objects).encode('ascii')
+        header = HEADER.pack(MAGIC, len(self.kinds), len(self.lists), len(self.roots), len(strings), len(objects))
+        arrays = (self.kinds, self.a, self.b, self.c, self.d, self.lists, self.roots)
+        return b''.join([header] + [values.tobytes() for values in arrays] + [strings, objects])
+
+    @classmethod
+    def loads(cls, data, offset=0):
+        # data may be any buffer, e.g. an mmap; raises ValueError when it is not a node pool
+        if len(data) < offset + HEADER.size:
+            raise ValueError("Truncated node pool")
+        magic, nodes, lists, roots, strings, objects = HEADER.unpack_from(data, offset)
+        if magic != MAGIC:
+            raise ValueError("Not a node pool")
+        pool = cls()
+        offset += HEADER.size
+        sizes = ((pool.kinds, nodes), (pool.a, nodes), (pool.b, nodes), (pool.c, nodes), (pool.d, nodes),
+                 (pool.lists, lists), (pool.roots, roots))
+        for values, count in sizes:
+            end = offset + count * values.itemsize
+            values.frombytes(data[offset:end])
+            offset = end
+        if len(data) != offset + strings + objects:
+            raise ValueError("Truncated node pool")
+        text = bytes(data[offset:offset + strings]).decode('utf-8')
+        pool.strings = text.split('\0') if text else []
+        pool.string_index = {string: index for index, string in enumerate(pool.strings)}
+        text = bytes(data[offset + strings:offset + strings + objects]).decode('ascii')
+        pool.objects = [int(value) for value in text.split(',')] if text else []
+        return pool
+
+    def intern(self, string):
+        index = self.string_index.get(string)
+        if index is None:
+            index = self.string_index[string] = len(self.strings)
+            self.strings.append(string)
+        return index
+
+    def append(self, kind, a=NONE, b=NONE, c=NONE, d=NONE):
+        self.kinds.append(kind)
+        self.a.append(a)
+        self.b.append(b)
+        self.c.append(c)
+        self.d.append(d)
+        return len(self.kinds) - 1
+
+    def extend(self, statements):
+        # Adds top-level statements one at a time, so they can come straight from Parser.statements()
+        for statement in statements:
+            self.roots.append(self.add(statement))
+        return self
+
+    def add(self, root):
+        # Post-order flattening with an explicit stack; returns the index of root. A node reached again
+        # through another parent (the optimizer interns identical subtrees) is stored once
+        added = {}
+        results = []
+        pending = [(root, False)]
+        while pending:
+            node, visited = pending.pop()
+            if not visited:
+                if id(node) in added:
+                    results.append(added[id(node)])
+                    continue
+                pending.append((node, True))
+                pending.extend((child, False) for child in reversed(children(node)))
+                continue
+            count = len(children(node))
+            operands = results[len(results) - count:]
+            del results[len(results) - count:]
+            if id(node) not in added:
+                added[id(node)] = self.add_node(node, operands)
+            results.append(added[id(node)])
+        return results[0]
+
+    def add_node(self, node, operands):
+        if isinstance(node, BoolLit):
+            return self.append(BOOL_LIT, int(node.val))
+
+        elif isinstance(node, IntLit):
+            if INT32_MIN <= node.val <= INT32_MAX:
+                return self.append(INT_LIT, node.val)
+            self.objects.append(node.val)
+            return self.append(INT_LIT, len(self.objects) - 1, d=1)
+
+        elif isinstance(node, Identifier):
+            return self.add_name(node.id_name, node.depth, node.index)
+
+        elif isinstance(node, UnaryOp):
+            return self.append(UNARY_OP, self.intern(node.op), operands[0])
+
+        elif isinstance(node, BinOp):
+            return self.append(BIN_OP, operands[0], self.intern(node.op), operands[1])
+
+        elif isinstance(node, IfStmt):
+            else_branch = operands[2] if node.else_branch is not None else NONE
+            return self.append(IF_STMT, operands[0], operands[1], else_branch)
+
+        elif isinstance(node, FuncApp):
+            by_name = isinstance(node.function, str)
+            if by_name:
+                callee = self.add_name(node.function, node.depth, node.index)
+            else:
+                callee = operands[0]
+                operands = operands[1:]
+            start = len(self.lists)
+            self.lists.extend(operands)
+            return self.append(FUNC_APP, callee, start, len(operands), int(by_name))
+
+        elif isinstance(node, LambdaExpr):
+            return self.append(LAMBDA_EXPR, self.intern(node.parameters), operands[0])
+
+        elif isinstance(node, FuncDef):
+            start = len(self.lists)
+            self.lists.extend(self.intern(name) for name in node.parameters)
+            return self.append(FUNC_DEF, self.intern(node.func_name), start, len(node.parameters), operands[0])
+
+        elif isinstance(node, SharedExpr):
+            return self.append(SHARED_EXPR, node.slot, operands[0])
+
+        raise TypeError(f"Unknown node type: {type(node)}")
+
+    def add_name(self, name, depth, index):
+        if depth is None:
+            return self.append(IDENTIFIER, self.intern(name))
+        return self.append(IDENTIFIER, self.intern(name), depth, index)
+
+    def kind(self, index):
+        return self.kinds[index]
+
+    def int_value(self, index):
+        return self.objects[self.a[index]] if self.d[index] == 1 else self.a[index]
+
+    def statements(self):
+        # The top-level statements as ast_node objects
+        for root in self.roots:
+            yield self.view(root)
+
+    def view(self, root):
+        # Rebuilds the ast_node tree rooted at index, for code written against the node classes
+        results = {}
+        pending = [(root, False)]
+        while pending:
+            index, visited = pending.pop()
+            kind = self.kinds[index]
+            operands = self.operand_nodes(index)
+            if not visited:
+                pending.append((index, True))
+                pending.extend((operand, False) for operand in operands if operand not in results)
+                continue
+            if index not in results:
+                results[index] = self.build(index, kind, [results[operand] for operand in operands])
+        return results[root]
+
+    def operand_nodes(self, index):
+        kind = self.kinds[index]
+        if kind == UNARY_OP:
+            return [self.b[index]]
+        elif kind == BIN_OP:
+            return [self.a[index], self.c[index]]
+        elif kind == IF_STMT:
+            return [self.a[index], self.b[index]] + ([self.c[index]] if self.c[index] != NONE else [])
+        elif kind == FUNC_APP:
+            arguments = list(self.lists[self.b[index]:self.b[index] + self.c[index]])
+            return arguments if self.d[index] == 1 else [self.a[index]] + arguments
+        elif kind == LAMBDA_EXPR:
+            return [self.b[index]]
+        elif kind == FUNC_DEF:
+            return [self.d[index]]
+        elif kind == SHARED_EXPR:
+            return [self.b[index]]
+        return []
+
+    def build(self, index, kind, operands):
+        strings = self.strings
+        if kind == INT_LIT:
+            return IntLit(self.int_value(index))
+        elif kind == BOOL_LIT:
+            return BoolLit(bool(self.a[index]))
+        elif kind == IDENTIFIER:
+            node = Identifier(strings[self.a[index]])
+            node.depth, node.index = self.address(index)
+            return node
+        elif kind == UNARY_OP:
+            return UnaryOp(strings[self.a[index]], operands[0])
+        elif kind == BIN_OP:
+            return BinOp(operands[0], strings[self.b[index]], operands[1])
+        elif kind == IF_STMT:
+            return IfStmt(*operands)
+        elif kind == FUNC_APP:
+            if self.d[index] == 1:
+                callee = self.a[index]
+                node = FuncApp(strings[self.a[callee]], operands)
+                node.depth, node.index = self.address(callee)
+                return node
+            return FuncApp(operands[0], operands[1:])
+        elif kind == LAMBDA_EXPR:
+            return LambdaExpr(strings[self.a[index]], operands[0])
+        elif kind == SHARED_EXPR:
+            return SharedExpr(operands[0], self.a[index])
+        else:
+            start = self.b[index]
+            parameters = [strings[name] for name in self.lists[start:start + self.c[index]]]
+            return FuncDef(strings[self.a[index]], parameters, operands[0])
+
+    def address(self, index):
+        if self.b[index] == NONE:
+            return None, None
+        return self.b[index], self.c[index]
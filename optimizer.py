@@ -0,0 +1,460 @@
+import copy
+
+from ast_node import FuncDef, LambdaExpr, FuncApp, Identifier, IntLit, BoolLit, UnaryOp, BinOp, IfStmt, SharedExpr, \
+    children, replace_children
+from interpreter import OPERATORS
+from resolver import Resolver
+
+
+def is_literal(node):
+    return isinstance(node, (IntLit, BoolLit))
+
+
+def literal(value):
+    return BoolLit(value) if isinstance(value, bool) else IntLit(value)
+
+
+def bound_names(node):
+    # Names a node binds for its children
+    if isinstance(node, LambdaExpr):
+        return {node.parameters}
+    elif isinstance(node, FuncDef):
+        return set(node.parameters)
+    return None
+
+
+def count_nodes(node):
+    count = 0
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        count += 1
+        pending.extend(children(node))
+    return count
+
+
+def global_names(node):
+    # Global names a subtree reads, including functions called by name
+    names = set()
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, Identifier) and node.depth is None:
+            names.add(node.id_name)
+        elif isinstance(node, FuncApp) and isinstance(node.function, str) and node.depth is None:
+            names.add(node.function)
+        pending.extend(children(node))
+    return names
+
+
+def cyclic_names(calls):
+    # Names on a cycle of the call graph (name -> global names its body calls): the members of strongly
+    # connected components with more than one name, and names that call themselves. Tarjan's algorithm
+    # with an explicit stack, so long call chains don't hit the recursion limit
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    cyclic = set()
+    for root in calls:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(calls[root]))]
+        while work:
+            name, callees = work[-1]
+            for callee in callees:
+                if callee not in calls:
+                    continue
+                if callee not in index:
+                    index[callee] = low[callee] = len(index)
+                    stack.append(callee)
+                    on_stack.add(callee)
+                    work.append((callee, iter(calls[callee])))
+                    break
+                if callee in on_stack:
+                    low[name] = min(low[name], index[callee])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[name])
+                if low[name] == index[name]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == name:
+                            break
+                    if len(component) > 1 or name in calls[name]:
+                        cyclic.update(component)
+    return cyclic
+
+
+def binds_or_calls_locals(node):
+    # Lambdas and calls through parameters would need more than plain substitution to inline
+    pending = [node]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, LambdaExpr):
+            return True
+        if isinstance(node, FuncApp) and isinstance(node.function, str) and node.depth is not None:
+            return True
+        pending.extend(children(node))
+    return False
+
+
+def copy_tree(node, arguments=None):
+    # Copies a Defunc body, replacing references to its parameters with copies of the argument nodes
+    results = []
+    pending = [(node, False)]
+    while pending:
+        node, visited = pending.pop()
+        if not visited:
+            pending.append((node, True))
+            pending.extend((child, False) for child in reversed(children(node)))
+            continue
+
+        count = len(children(node))
+        new_children = results[len(results) - count:] if count else []
+        del results[len(results) - count:]
+
+        if isinstance(node, Identifier):
+            if arguments is not None and node.depth == 0:
+                source = arguments[node.index]
+                if isinstance(source, Identifier):
+                    copy = Identifier(source.id_name)
+                    copy.depth, copy.index = source.depth, source.index
+                else:
+                    copy = literal(source.val)
+            else:
+                copy = Identifier(node.id_name)
+                copy.depth, copy.index = node.depth, node.index
+        elif isinstance(node, (IntLit, BoolLit)):
+            copy = literal(node.val)
+        elif isinstance(node, BinOp):
+            copy = BinOp(new_children[0], node.op, new_children[1])
+        elif isinstance(node, UnaryOp):
+            copy = UnaryOp(node.op, new_children[0])
+        elif isinstance(node, IfStmt):
+            copy = IfStmt(*new_children)
+        elif isinstance(node, FuncApp):
+            function = node.function if isinstance(node.function, str) else new_children.pop(0)
+            copy = FuncApp(function, new_children)
+            copy.depth, copy.index = node.depth, node.index
+        elif isinstance(node, LambdaExpr):
+            copy = LambdaExpr(node.parameters, new_children[0])
+        else:
+            copy = FuncDef(node.func_name, node.parameters, new_children[0])
+        results.append(copy)
+    return results[0]
+
+
+def intern_key(node, owner):
+    # Equal keys mean structurally identical nodes, once their children are the interned ones.
+    # owner is the innermost Defunc or lambda around node, so no node belongs to two function bodies
+    kids = tuple(id(child) for child in children(node))
+    if isinstance(node, (IntLit, BoolLit)):
+        return type(node), owner, node.val
+    elif isinstance(node, Identifier):
+        return Identifier, owner, node.id_name, node.depth, node.index
+    elif isinstance(node, (UnaryOp, BinOp)):
+        return type(node), owner, node.op, kids
+    elif isinstance(node, IfStmt):
+        return IfStmt, owner, kids
+    elif isinstance(node, FuncApp):
+        function = node.function if isinstance(node.function, str) else None
+        return FuncApp, owner, function, node.depth, node.index, kids
+    elif isinstance(node, LambdaExpr):
+        return LambdaExpr, owner, node.parameters, kids
+    return None
+
+
+def intern_subtrees(root):
+    # Hash-consing of a resolved statement: structurally identical subtrees of one function body are
+    # replaced, in place, by the first of them, so the body becomes a DAG. Returns the number of nodes
+    # replaced; each replaced node's children were already replaced, so they are counted one by one
+    table = {}
+    deduplicated = 0
+    results = []
+    pending = [(root, None, False)]
+    while pending:
+        node, owner, visited = pending.pop()
+        if not visited:
+            inner = id(node) if isinstance(node, (FuncDef, LambdaExpr)) else owner
+            pending.append((node, owner, True))
+            pending.extend((child, inner, False) for child in reversed(children(node)))
+            continue
+
+        count = len(children(node))
+        if count:
+            replace_children(node, results[len(results) - count:])
+            del results[len(results) - count:]
+        key = intern_key(node, owner)
+        if key is not None:
+            canonical = table.setdefault(key, node)
+            if canonical is not node:
+                deduplicated += 1
+                node = canonical
+        results.append(node)
+    return deduplicated
+
+
+def positions(node, tail):
+    # (child, whether it is in tail position) for the children of a node in the given position
+    kids = children(node)
+    if isinstance(node, IfStmt):
+        return [(kids[0], False)] + [(child, tail) for child in kids[1:]]
+    return [(child, False) for child in kids]
+
+
+def exclusive(first, second):
+    # Paths are the if-branches taken to reach an occurrence; different branches of one if never both run
+    branches = dict(first)
+    return any(branches.get(if_stmt, branch) != branch for if_stmt, branch in second)
+
+
+def share_subexpressions(func_def):
+    # Common-subexpression elimination for one Defunc with an interned body: an expression that a call
+    # can evaluate more than once, such as a repeated f(n - 1), is wrapped in SharedExpr, so only its
+    # first evaluation per call computes it. Expressions have no side effects and names can't be rebound
+    # during a call, so the value can't change in between. Occurrences in tail position stay as they are
+    # to keep tail calls in constant space, and lambda bodies, which run in frames of their own, are not
+    # searched. Returns a new FuncDef, sharing unchanged nodes with func_def, and the number of SharedExprs
+    if not isinstance(func_def.parameters, list):
+        return func_def, 0
+    occurrences = {}  # id(node) -> the paths of its occurrences
+    sizes = {}
+    seen = set()
+    pending = [(func_def.func_body, True, ())]
+    while pending:
+        node, tail, path = pending.pop()
+        if isinstance(node, LambdaExpr):
+            continue
+        if not tail and isinstance(node, (UnaryOp, BinOp, IfStmt, FuncApp)):
+            if id(node) not in sizes:
+                sizes[id(node)] = count_nodes(node)
+            if sizes[id(node)] >= 3:
+                occurrences.setdefault(id(node), []).append(path)
+        # The children of a node met again in the same position were already counted
+        if (id(node), tail) in seen:
+            continue
+        seen.add((id(node), tail))
+        if isinstance(node, IfStmt):
+            kids = children(node)
+            pending.append((kids[0], False, path))
+            pending.extend((child, tail, path + ((id(node), branch),)) for branch, child in enumerate(kids[1:]))
+        else:
+            pending.extend((child, False, path) for child in children(node))
+
+    slots = {}
+    for key, paths in occurrences.items():
+        if any(not exclusive(paths[i], paths[j]) for i in range(len(paths)) for j in range(i)):
+            slots[key] = len(func_def.parameters) + len(slots)
+    if not slots:
+        return func_def, 0
+
+    # Path copying: nodes on the way to a shared expression are copied, the rest stay shared
+    rewritten = {}  # (id(node), tail) -> its rewritten node
+    results = []
+    pending = [(func_def.func_body, True, False)]
+    while pending:
+        node, tail, visited = pending.pop()
+        key = (id(node), tail)
+        count = 0 if isinstance(node, LambdaExpr) else len(children(node))
+        if not visited:
+            if key in rewritten:
+                results.append(rewritten[key])
+                continue
+            pending.append((node, tail, True))
+            if count:
+                pending.extend((child, child_tail, False) for child, child_tail in reversed(positions(node, tail)))
+            continue
+
+        new_children = results[len(results) - count:] if count else []
+        del results[len(results) - count:]
+        if key in rewritten:
+            results.append(rewritten[key])
+            continue
+        new = node
+        if any(child is not old for child, old in zip(new_children, children(node))):
+            new = copy.copy(node)
+            replace_children(new, new_children)
+        if not tail and id(node) in slots:
+            new = SharedExpr(new, slots[id(node)])
+        rewritten[key] = new
+        results.append(new)
+    return FuncDef(func_def.func_name, func_def.parameters, results[0]), len(slots)
+
+
+# Inlined bodies rewritten inside one another at most, whatever the call graph: a backstop against
+# expanding calls without end
+MAX_INLINE_DEPTH = 8
+
+
+class Optimizer:
+    # Rewrites parsed statements before they reach the interpreter.
+    # Level 1 folds literal subexpressions, prunes if-statements with literal conditions and
+    # simplifies !, && and || with literal operands, then interns identical subtrees. Level 2 also
+    # inlines small non-recursive Defuncs whose arguments are literals or identifiers and, unless share
+    # is False, shares the repeated subexpressions of Defunc bodies.
+    def __init__(self, level=1, inline_limit=16, share=True):
+        self.level = level
+        self.inline_limit = inline_limit
+        self.share = share
+        self.functions = {}  # Defuncs seen so far that may be inlined, by name
+        self.calls = {}  # every Defunc seen so far -> the global names its body calls
+        self.called = set()  # names some Defunc in calls calls
+        self.cyclic = None  # names on a cycle of calls, recomputed after calls changes
+        self.depth = 0  # inlined bodies being rewritten inside one another
+        self.stable = set()  # names defined exactly once in the program being optimized
+        self.deduplicated = 0  # nodes replaced by an identical one, over all statements optimized
+        self.shared = 0  # SharedExprs created
+
+    def optimize(self, statements):
+        # Whole-program mode: Defuncs defined once may also be inlined into other Defunc bodies
+        if self.level <= 0:
+            return statements
+        counts = {}
+        for statement in statements:
+            if isinstance(statement, FuncDef):
+                counts[statement.func_name] = counts.get(statement.func_name, 0) + 1
+        self.stable = {name for name, count in counts.items() if count == 1}
+        for statement in statements:
+            if isinstance(statement, FuncDef) and statement.func_name in self.stable:
+                self.define(statement)  # a cycle through a Defunc defined further down is known up front
+        statements = [self.optimize_statement(statement) for statement in statements]
+        self.stable = set()
+        return statements
+
+    def optimize_statement(self, statement):
+        # A Defunc redefined later would leave stale copies in bodies that inlined it, so outside
+        # optimize() calls are only inlined into top-level expressions, which run immediately
+        if self.level <= 0:
+            return statement
+        if isinstance(statement, FuncDef):
+            self.define(statement)
+        statement = self.rewrite(statement)
+        Resolver().resolve_node(statement)
+        self.deduplicated += intern_subtrees(statement)
+        if isinstance(statement, FuncDef):
+            self.functions.pop(statement.func_name, None)
+            # Inlined copies are taken from the body before its subexpressions are shared
+            if self.level >= 2 and self.inlinable(statement):
+                self.functions[statement.func_name] = statement
+            if self.level >= 2 and self.share:
+                statement, count = share_subexpressions(statement)
+                self.shared += count
+        return statement
+
+    def rewrite(self, root, scopes=(), owner=None):
+        # Post-order walk with an explicit stack so long operator chains don't hit the recursion limit.
+        # owner is the name of the Defunc whose body is being rewritten, if any
+        results = []
+        pending = [(root, scopes, owner, False)]
+        while pending:
+            node, scopes, owner, visited = pending.pop()
+            if not visited:
+                nested = bound_names(node)
+                inner = scopes + (nested,) if nested is not None else scopes
+                if isinstance(node, FuncDef):
+                    owner = node.func_name
+                pending.append((node, scopes, owner, True))
+                pending.extend((child, inner, owner, False) for child in reversed(children(node)))
+                continue
+
+            count = len(children(node))
+            if count:
+                replace_children(node, results[len(results) - count:])
+                del results[len(results) - count:]
+            results.append(self.simplify(node, scopes, owner))
+        return results[0]
+
+    def simplify(self, node, scopes, owner):
+        if isinstance(node, BinOp):
+            left, right = node.left, node.right
+            if is_literal(left):
+                if node.op == '||':
+                    return BoolLit(True) if left.val else right
+                if node.op == '&&':
+                    return right if left.val else BoolLit(False)
+                if is_literal(right) and node.op in OPERATORS:
+                    try:
+                        return literal(OPERATORS[node.op](left.val, right.val))
+                    except Exception:
+                        return node  # leave the error to run time
+
+        elif isinstance(node, UnaryOp):
+            if node.op == '!' and is_literal(node.operand):
+                return BoolLit(not node.operand.val)
+
+        elif isinstance(node, IfStmt):
+            if is_literal(node.cond):
+                branch = node.then_branch if node.cond.val else node.else_branch
+                # A statement's errors take the prefix of its first if-statement or call, so outside Defuncs
+                # only a branch that can't fail replaces the if
+                if branch is not None and (owner is not None or is_literal(branch)):
+                    return branch
+
+        elif isinstance(node, FuncApp) and self.level >= 2:
+            return self.inline(node, scopes, owner)
+
+        return node
+
+    def define(self, func_def):
+        name = func_def.func_name
+        names = global_names(func_def.func_body)
+        if self.calls.get(name) == names:
+            return
+        if self.cyclic is not None and name not in self.calls and name not in self.called:
+            # Nothing calls a new name yet, so the only cycle it can be on is a call to itself
+            if name in names:
+                self.cyclic.add(name)
+        else:
+            self.cyclic = None
+        self.calls[name] = names
+        self.called.update(names)
+
+    def recursive(self, name):
+        if self.cyclic is None:
+            self.cyclic = cyclic_names(self.calls)
+        return name in self.cyclic
+
+    def inlinable(self, func_def):
+        if not isinstance(func_def.parameters, list) or binds_or_calls_locals(func_def.func_body):
+            return False
+        if count_nodes(func_def.func_body) > self.inline_limit:
+            return False
+        return func_def.func_name not in global_names(func_def.func_body)
+
+    def inline(self, node, scopes, owner):
+        if not isinstance(node.function, str) or node.depth is not None:
+            return node
+        func_def = self.functions.get(node.function)
+        if func_def is None or len(func_def.parameters) != len(node.arguments):
+            return node
+        if owner is None or owner not in self.stable or node.function not in self.stable:
+            return node  # outside Defuncs the call may be what gives the statement's errors their prefix
+        if owner == node.function or self.recursive(node.function):
+            return node
+        if self.depth >= MAX_INLINE_DEPTH:
+            return node
+        # Only arguments that can neither fail nor diverge, since unused parameters disappear
+        if not all(is_literal(arg) or (isinstance(arg, Identifier) and arg.depth is not None)
+                   for arg in node.arguments):
+            return node
+
+        # The body's globals must not be captured by parameters bound around the call site
+        local_names = set().union(*scopes) if scopes else set()
+        if global_names(func_def.func_body) & local_names:
+            return node
+
+        body = copy_tree(func_def.func_body, node.arguments)
+        self.depth += 1
+        try:
+            return self.rewrite(body, scopes, owner)
+        finally:
+            self.depth -= 1
@@ -0,0 +1,260 @@
+from concurrent.futures import Future, ProcessPoolExecutor
+import multiprocessing
+import os
+import threading
+import time
+
+from ast_node import FuncDef, FuncApp, Identifier, BinOp, children, replace_children
+from basic import Closure, Environment
+from interpreter import Interpreter
+
+
+# Static cost of a call that may not terminate quickly (a function that can reach a recursive one);
+# every other node costs 1. An operand is heavy when its cost reaches the interpreter's threshold.
+CALL_COST = 1000
+
+# A split that finishes faster than this was not worth the threads and processes; its node then
+# stays sequential for exponentially more encounters
+MIN_SPLIT_SECONDS = 0.01
+
+
+class Parallel:
+    # Marks a BinOp or FuncApp whose heavy operands may be evaluated at the same time
+    __slots__ = ('node', 'heavy', 'misses', 'skip')
+
+    def __init__(self, node, heavy):
+        self.node = node
+        self.heavy = heavy  # one flag per operand
+        self.misses = 0
+        self.skip = 0
+
+    def __repr__(self):
+        return repr(self.node)
+
+
+class Const:
+    # A value that is already computed, used to hand a parallel FuncApp's operands back to the machine
+    __slots__ = ('val',)
+
+    def __init__(self, val):
+        self.val = val
+
+    def __repr__(self):
+        return repr(self.val)
+
+
+class Planner:
+    # Finds the BinOps and FuncApps with more than one heavy operand and wraps them in Parallel nodes
+    def __init__(self, threshold=CALL_COST):
+        self.threshold = threshold
+        self.calls = {}  # Defunc name -> global names used in its body
+        self.expensive = set()
+
+    def learn(self, statements):
+        # Records the Defuncs in statements, so calls to them are costed before they are defined
+        for statement in statements:
+            if isinstance(statement, FuncDef):
+                self.calls[statement.func_name] = global_names(statement.func_body)
+        self.expensive = self.reaching_recursion()
+
+    def reaching_recursion(self):
+        # Functions that can reach a function that calls itself, directly or through others
+        reach = {}
+        for name in self.calls:
+            seen = set()
+            pending = list(self.calls[name])
+            while pending:
+                callee = pending.pop()
+                if callee in self.calls and callee not in seen:
+                    seen.add(callee)
+                    pending.extend(self.calls[callee])
+            reach[name] = seen
+        recursive = {name for name in self.calls if name in reach[name]}
+        return {name for name in self.calls if name in recursive or reach[name] & recursive}
+
+    def annotate(self, statement):
+        if isinstance(statement, FuncDef) and statement.func_name not in self.calls:
+            self.learn([statement])
+        costs = {}
+        pending = [(statement, False)]
+        while pending:
+            node, visited = pending.pop()
+            if not visited:
+                if id(node) not in costs:  # a subtree shared by two parents is annotated once
+                    pending.append((node, True))
+                    pending.extend((child, False) for child in children(node))
+                continue
+            cost = 1 + sum(costs[id(child)] for child in children(node))
+            if isinstance(node, FuncApp) and isinstance(node.function, str) and node.depth is None \
+                    and node.function in self.expensive:
+                cost += CALL_COST
+            costs[id(node)] = cost
+            replace_children(node, [self.wrap(child, costs) for child in children(node)])
+        return self.wrap(statement, costs)
+
+    def wrap(self, node, costs):
+        if isinstance(node, BinOp) and node.op not in ('&&', '||'):
+            operands = [node.left, node.right]
+        elif isinstance(node, FuncApp):
+            operands = node.arguments
+        else:
+            return node
+        heavy = [costs.get(id(operand), 0) >= self.threshold for operand in operands]
+        return Parallel(node, heavy) if sum(heavy) > 1 else node
+
+
+def global_names(root):
+    names = set()
+    pending = [root]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, Identifier) and node.depth is None:
+            names.add(node.id_name)
+        elif isinstance(node, FuncApp) and isinstance(node.function, str) and node.depth is None:
+            names.add(node.function)
+        pending.extend(children(node))
+    return names
+
+
+class ParallelInterpreter(Interpreter):
+    # The tree walker, except that at Parallel nodes the heavy operands run at the same time. The first
+    # max_depth levels of splits are expanded on threads of this process, and the operands at the last
+    # level go to a pool of worker processes that evaluate them sequentially, so a tree-recursive call
+    # becomes about 2 ** max_depth similar tasks. Evaluation is pure, so only values travel between processes.
+    def __init__(self, ast, memo=None, workers=None, max_depth=None, threshold=CALL_COST):
+        super().__init__(ast, memo)
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        if max_depth is None:
+            max_depth = max(1, (self.workers - 1).bit_length() + 1)  # about two tasks per worker
+        self.max_depth = max_depth
+        self.planner = Planner(threshold)
+        self.pool = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def execute(self, statements):
+        if not self.splits():
+            return super().execute(statements)
+        if isinstance(statements, list):
+            self.planner.learn(statements)
+        return super().execute(self.planner.annotate(statement) for statement in statements)
+
+    def splits(self):
+        # Memoized results computed in other processes could not be shared, so memo runs stay sequential
+        return self.workers > 1 and self.memo is None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def extension(self, node, context, stack):
+        if isinstance(node, Const):
+            return None, context, node.val
+        if isinstance(node, Parallel):
+            depth = getattr(self.local, 'depth', 0)
+            if depth >= self.max_depth or node.skip:
+                if node.skip:
+                    node.skip -= 1
+                return node.node, context, None
+            return self.split(node, context, depth)
+        return super().extension(node, context, stack)
+
+    def split(self, parallel, context, depth):
+        node = parallel.node
+        operands = [node.left, node.right] if isinstance(node, BinOp) else node.arguments
+        start = time.perf_counter()
+        futures = [self.spawn(operand, context, depth + 1) if heavy else None
+                   for operand, heavy in zip(operands, parallel.heavy)]
+        values = [self.evaluate(operand, context) if future is None else future.result()
+                  for operand, future in zip(operands, futures)]
+        if time.perf_counter() - start < MIN_SPLIT_SECONDS:
+            parallel.misses += 1
+            parallel.skip = 2 ** min(parallel.misses, 16)
+        else:
+            parallel.misses = 0
+        if isinstance(node, BinOp):
+            return None, context, self.apply_operators(node.op, values[0], values[1])
+        function = node.function
+        if not isinstance(function, str):
+            function = Const(self.evaluate(function, context))
+        call = FuncApp(function, [Const(value) for value in values])
+        call.depth, call.index = node.depth, node.index
+        return call, context, None
+
+    def spawn(self, node, context, depth):
+        # A heavy operand runs on a thread that may split further, or at the last level in a worker process
+        if depth >= self.max_depth:
+            return self.executor().submit(evaluate_remote, node, context)
+        future = Future()
+
+        def run():
+            self.local.depth = depth
+            try:
+                future.set_result(self.evaluate(node, context))
+            except BaseException as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    def executor(self):
+        with self.lock:
+            if self.pool is None:
+                # forkserver: forking the interpreter while split threads are running is not safe
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self.pool = ProcessPoolExecutor(self.workers, mp_context=context)
+            return self.pool
+
+
+class SequentialInterpreter(Interpreter):
+    # Runs annotated trees without splitting; used in the worker processes
+    def extension(self, node, context, stack):
+        if isinstance(node, Parallel):
+            return node.node, context, None
+        if isinstance(node, Const):
+            return None, context, node.val
+        return super().extension(node, context, stack)
+
+
+worker = None
+
+
+def evaluate_remote(node, context):
+    global worker
+    if worker is None:
+        worker = SequentialInterpreter([])
+    # node and context are this task's own unpickled copy, so the Parallel markers of the functions in
+    # scope can be dropped instead of being stepped over at every call
+    scope = context
+    while scope is not None:
+        if isinstance(scope, Environment):
+            for name, value in scope.variables.items():
+                scope.variables[name] = strip_function(value)
+        else:
+            scope.slots[:] = [strip_function(value) for value in scope.slots]
+        scope = scope.parent
+    return worker.evaluate(strip(node), context)
+
+
+def strip_function(value):
+    if type(value) is Closure:
+        chain = value.chain and (value.chain[0], strip(value.chain[1]))
+        return Closure(value.kind, value.parameters, strip(value.body), value.env, chain)
+    return value
+
+
+def strip(root):
+    # root with the Parallel markers in its tree replaced by the nodes they wrap
+    if isinstance(root, Parallel):
+        root = root.node
+    pending = [root]
+    while pending:
+        node = pending.pop()
+        kids = children(node)
+        if any(isinstance(child, Parallel) for child in kids):
+            kids = [child.node if isinstance(child, Parallel) else child for child in kids]
+            replace_children(node, kids)
+        pending.extend(kids)
+    return root
@@ -1,35 +1,35 @@
+from collections import deque
 from ast_node import FuncDef, LambdaExpr, FuncApp, Identifier, IntLit, BoolLit, UnaryOp, BinOp, IfStmt
+from ll_parser import load_grammar
+from resolver import Resolver
 
 
-class BNFLoader:
-    def __init__(self, bnf_file_path):
-        self.rules = self.grammar(bnf_file_path)
+# Binding strength of the binary operators, loosest first; all of them are left-associative.
+# The prefix '!' binds tighter than any of them.
+PRECEDENCE = {
+    '||': 1,
+    '&&': 2,
+    '==': 3, '!=': 3,
+    '<': 4, '>': 4, '<=': 4, '>=': 4,
+    '+': 5, '-': 5,
+    '*': 6, '/': 6, '%': 6,
+}
+UNARY_PRECEDENCE = 7
+BINARY_TOKENS = {'BASIC_OP', 'BOOL_OP', 'COMP_OP'}
 
-    def grammar(self, file_path_way):
-        rules = {}
-        with open(file_path_way, 'r') as f:
-            content = f.read()
-            lines = content.splitlines()
-            current_non_terminal = None
-            for line in lines:
-                if line.strip() == "":
-                    continue
-                if "::=" in line:
-                    parts = line.split("::=")
-                    current_non_terminal = parts[0].strip()
-                    rules[current_non_terminal] = [p.strip() for p in parts[1].split("|")]
-                else:
-                    rules[current_non_terminal].extend([p.strip() for p in line.split("|")])
-        return rules
+# Groups left open on the operator stack of Parser.parse_expression
+PAREN_GROUP, LAMBDA_GROUP, ARGUMENTS_GROUP = range(3)
 
 
 class Parser:
     def __init__(self, toks, bnf_path=None, debug=False):
-        self.tokens = toks
+        # toks may be a list or any token iterator (e.g. Lexer.stream()); it is consumed incrementally
+        self.tokens = iter(toks)
+        self.lookahead = deque()  # tokens read past current_token
         self.position = 0
-        self.current_token = self.tokens[self.position] if toks else None
+        self.current_token = next(self.tokens, None)
         self.debug = debug
-        self.rules = BNFLoader(bnf_path).rules if bnf_path else None
+        self.rules = load_grammar(bnf_path).rules if bnf_path else None  # read once per process, see ll_parser
 
     '''def log(self, message):
         if self.debug:
@@ -37,10 +37,16 @@ class Parser:
 
     def advance(self):
         self.position += 1
-        if self.position < len(self.tokens):
-            self.current_token = self.tokens[self.position]
+        if self.lookahead:
+            self.current_token = self.lookahead.popleft()
         else:
-            self.current_token = ('EOF', 'EOF', -1, -1)
+            self.current_token = next(self.tokens, ('EOF', 'EOF', -1, -1))
+
+    def peek(self):
+        # The token after current_token
+        if not self.lookahead:
+            self.lookahead.append(next(self.tokens, ('EOF', 'EOF', -1, -1)))
+        return self.lookahead[0]
 
     def error(self, message):
         line = self.current_token[2]
@@ -51,7 +57,7 @@ class Parser:
     def parse(self):
         try:
             result = self.program()
-            return result
+            return Resolver().resolve(result)
         except Exception as e:
             raise RuntimeError(f"Parsing failed: {str(e)}")
 
@@ -66,8 +72,6 @@ class Parser:
             return self.parse_function_def()
         elif self.current_token[0] == 'IF':
             return self.parse_if_statement()
-        elif self.current_token[0] == 'LPAREN' and self.tokens[self.position + 1][0] == 'LAMBD':
-            return self.parse_lambda_expr()
         else:
             return self.parse_expression()
 
@@ -77,6 +81,18 @@ class Parser:
             statements.append(self.parse_statement())
         return statements
 
+    def statements(self):
+        # Yields each top-level statement, resolved, as soon as it is parsed
+        resolver = Resolver()
+        while True:
+            try:
+                if self.current_token[0] == 'EOF':
+                    return
+                statement = self.parse_statement()
+            except Exception as e:
+                raise RuntimeError(f"Parsing failed: {str(e)}")
+            yield resolver.resolve_node(statement)
+
     def parse_function_def(self):
         try:
             self.expect('DEFUN')
@@ -115,50 +131,10 @@ class Parser:
         except SyntaxError as e:
             self.error(f"Error parsing if statement: {e}")
 
-    def parse_lambda_expr(self):
-        self.expect('LPAREN')
-        self.expect('LAMBD')
-        if self.current_token[0] == 'LETTER':
-            params = self.current_token[1]
-            self.expect('LETTER')
-            self.expect('DOT')
-        body = self.parse_expression()
-        self.expect('RPAREN')
-        lambda_expr = LambdaExpr(parameters=params, expr_body=body)
-        if self.current_token[0] == 'LPAREN':
-            return self.parse_lambda_call(lambda_expr)
-        return lambda_expr
-
-    def parse_function_call(self, func):
-        func = self.current_token[1]
-        self.expect('LETTER')
-        self.expect('LPAREN')
-        args = self.parse_args()
-        self.expect('RPAREN')
-        return FuncApp(function=func, arguments=args)
-
-    def parse_lambda_call(self, func):
-        self.expect('LPAREN')
-        args = self.parse_args()
-        self.expect('RPAREN')
-        return FuncApp(function=func, arguments=args)
-
-    def parse_args(self):
-        args = []
-        while self.current_token[0] != 'RPAREN':
-            args.append(self.parse_expression())
-            if self.current_token[0] == 'COMMA':
-                self.expect('COMMA')
-            elif self.current_token[0] == 'RPAREN':
-                break
-            else:
-                self.error(f"Unexpected token in argument list: {self.current_token}")
-        return args
-
     def parse_params(self):
         params = []
         self.expect('LPAREN')
-        while self.current_token[0] == 'LETTER' and self.tokens[self.position + 1][0] == 'COMMA':
+        while self.current_token[0] == 'LETTER' and self.peek()[0] == 'COMMA':
             params.append(self.current_token[1])
             self.expect('LETTER')
             self.expect('COMMA')
@@ -166,52 +142,100 @@ class Parser:
         return params
 
     def parse_expression(self):
-
-        def parse_term():
-            if self.current_token[0] == 'NOT':
-                op = self.current_token[1]
-                self.expect('NOT')
-                expr = self.parse_expression()
-                unary_op = UnaryOp(op, expr)
-                return unary_op
-
-            if self.current_token[0] == 'LPAREN' and self.position + 1 < len(self.tokens) and self.tokens[self.position + 1][0] == 'LAMBD':
-                return self.parse_lambda_expr()
-
-            if self.current_token[0] == 'LETTER' and self.position + 1 < len(self.tokens) and self.tokens[self.position + 1][0] == 'LPAREN':
-                return self.parse_function_call(self.current_token[1])
-
-            if self.current_token[0] == 'INTEGER':
-                number = IntLit(self.current_token[1])
-                self.expect('INTEGER')
-                return number
-
-            if self.current_token[0] == 'LETTER':
-                identifier = Identifier(self.current_token[1])
-                self.expect('LETTER')
-                return identifier
-
-            if self.current_token[0] == 'BOOLEAN':
-                boolean = BoolLit(self.current_token[1])
-                self.expect('BOOLEAN')
-                return boolean
-
-            if self.current_token[0] == 'LPAREN':
-                self.expect('LPAREN')
-                expr = self.parse_expression()
+        # Shunting-yard: operands and pending operators are kept on explicit stacks, and every construct
+        # that encloses an expression (parentheses, call arguments, lambda bodies) is a marker on the
+        # operator stack, so nesting depth and chain length only cost list entries, not Python frames
+        operands = []
+        operators = []  # (precedence, op) of operators, or (0, group, ...) markers of open groups
+        while True:
+            # An operand, after any number of prefix operators
+            token = self.current_token
+            kind = token[0]
+            if kind == 'NOT':
+                operators.append((UNARY_PRECEDENCE, token[1]))
+                self.advance()
+                continue
+            if kind == 'INTEGER':
+                operands.append(IntLit(token[1]))
+                self.advance()
+            elif kind == 'BOOLEAN':
+                operands.append(BoolLit(token[1]))
+                self.advance()
+            elif kind == 'LETTER':
+                if self.peek()[0] == 'LPAREN':
+                    self.advance()
+                    self.advance()
+                    if self.open_arguments(operators, token[1]):
+                        continue
+                    operands.append(FuncApp(function=token[1], arguments=[]))
+                else:
+                    operands.append(Identifier(token[1]))
+                    self.advance()
+            elif kind == 'LPAREN':
+                self.advance()
+                if self.current_token[0] == 'LAMBD':
+                    self.advance()
+                    params = self.current_token[1]
+                    self.expect('LETTER')
+                    self.expect('DOT')
+                    operators.append((0, LAMBDA_GROUP, params))
+                else:
+                    operators.append((0, PAREN_GROUP))
+                continue
+            else:
+                self.error(
+                    f"Unexpected token: '{kind}' at line {token[2]}, column {token[3]}")
+
+            # Binary operators after the operand; anything else closes groups until one takes another operand
+            while True:
+                token = self.current_token
+                if token[0] in BINARY_TOKENS:
+                    precedence = PRECEDENCE[token[1]]
+                    while operators and operators[-1][0] >= precedence:
+                        self.reduce(operators, operands)
+                    operators.append((precedence, token[1]))
+                    self.advance()
+                    break
+                while operators and operators[-1][0]:
+                    self.reduce(operators, operands)
+                if not operators:
+                    return operands.pop()
+                group = operators[-1]
+                if group[1] == ARGUMENTS_GROUP:
+                    group[3].append(operands.pop())
+                    if token[0] == 'COMMA':
+                        self.expect('COMMA')
+                        if self.current_token[0] != 'RPAREN':
+                            break
+                    elif token[0] != 'RPAREN':
+                        self.error(f"Unexpected token in argument list: {token}")
+                    self.expect('RPAREN')
+                    operators.pop()
+                    operands.append(FuncApp(function=group[2], arguments=group[3]))
+                    continue
                 self.expect('RPAREN')
-                return expr
-
-            self.error(
-                f"Unexpected token: '{self.current_token[0]}' at line {self.current_token[2]}, column {self.current_token[3]}")
-
-        def parse_operation(parse_func, valid_operators):
-            left = parse_func()
-            while self.current_token[0] in valid_operators:
-                op = self.current_token[1]
-                self.expect(self.current_token[0])
-                right = parse_func()
-                left = BinOp(left, op, right)
-            return left
-
-        return parse_operation(parse_term, {'BASIC_OP', 'BOOL_OP', 'COMP_OP'})
+                operators.pop()
+                if group[1] == LAMBDA_GROUP:
+                    lambda_expr = LambdaExpr(parameters=group[2], expr_body=operands.pop())
+                    if self.current_token[0] == 'LPAREN':
+                        self.advance()
+                        if self.open_arguments(operators, lambda_expr):
+                            break
+                        lambda_expr = FuncApp(function=lambda_expr, arguments=[])
+                    operands.append(lambda_expr)
+
+    def open_arguments(self, operators, function):
+        # After the '(' of a call: True when arguments follow, False for an empty argument list
+        if self.current_token[0] == 'RPAREN':
+            self.advance()
+            return False
+        operators.append((0, ARGUMENTS_GROUP, function, []))
+        return True
+
+    def reduce(self, operators, operands):
+        precedence, op = operators.pop()
+        if precedence == UNARY_PRECEDENCE:
+            operands.append(UnaryOp(op, operands.pop()))
+        else:
+            right = operands.pop()
+            operands.append(BinOp(operands.pop(), op, right))
@@ -0,0 +1,266 @@
+import copy
+import signal
+import sys
+import time
+
+from ast_node import FuncDef, LambdaExpr, children, replace_children
+from basic import Closure
+from interpreter import Interpreter, RETURN_HOOK, MEMO, CURRY
+
+
+TOP_LEVEL = '<top level>'
+
+
+def lambda_name(node):
+    return f"<lambda {node.parameters}>"
+
+
+class Profile:
+    # Deterministic measurements of a ProfilingInterpreter run
+    def __init__(self, max_stack=128):
+        self.max_stack = max_stack  # deeper frames are folded into their ancestor in the collapsed stacks
+        self.calls = {}
+        self.inclusive = {}
+        self.exclusive = {}
+        self.frames = 0  # environments allocated by extend_scope
+        self.node_counts = {}
+        self.max_depth = 0
+        self.active = []  # [name, start, time in callees, path] per running function
+        self.running = {}  # name -> activations in self.active, so recursion is counted once in inclusive time
+        self.path_ids = {}  # (parent path, name) -> path; stack paths are interned, so entering one is O(1)
+        self.path_names = []
+        self.path_parents = []
+        self.path_time = {}
+
+    def path(self, parent, name):
+        key = (parent, name)
+        path = self.path_ids.get(key)
+        if path is None:
+            path = self.path_ids[key] = len(self.path_names)
+            self.path_names.append(name)
+            self.path_parents.append(parent)
+        return path
+
+    def enter(self, name):
+        active = self.active
+        parent = active[-1][3] if active else None
+        path = self.path(parent, name) if len(active) < self.max_stack else parent
+        active.append([name, time.perf_counter(), 0.0, path])
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.running[name] = self.running.get(name, 0) + 1
+        if len(active) > self.max_depth:
+            self.max_depth = len(active)
+
+    def leave(self, value=None):
+        name, start, callees, path = self.active.pop()
+        elapsed = time.perf_counter() - start
+        self.running[name] -= 1
+        if not self.running[name]:
+            self.inclusive[name] = self.inclusive.get(name, 0.0) + elapsed
+        self.exclusive[name] = self.exclusive.get(name, 0.0) + elapsed - callees
+        self.path_time[path] = self.path_time.get(path, 0.0) + elapsed - callees
+        if self.active:
+            self.active[-1][2] += elapsed
+
+    def unwind(self, depth):
+        # Closes the functions an error left running
+        while len(self.active) > depth:
+            self.leave()
+
+    def collapsed(self):
+        # One "outer;inner;innermost microseconds" line per stack, as flamegraph.pl and speedscope read it
+        lines = []
+        for path, seconds in self.path_time.items():
+            lines.append(f"{self.stack_string(path)} {round(seconds * 1e6)}")
+        return "\n".join(sorted(lines))
+
+    def stack_string(self, path):
+        names = []
+        while path is not None:
+            names.append(self.path_names[path])
+            path = self.path_parents[path]
+        return ";".join(reversed(names))
+
+    def report(self):
+        functions = [name for name in self.calls if name != TOP_LEVEL]
+        functions.sort(key=lambda name: self.exclusive.get(name, 0.0), reverse=True)
+        total = sum(self.exclusive.values()) or 1.0
+        lines = [f"{'function':<24}{'calls':>10}{'incl (ms)':>12}{'excl (ms)':>12}{'excl %':>8}"]
+        for name in [TOP_LEVEL] + functions:
+            if name not in self.calls:
+                continue
+            exclusive = self.exclusive.get(name, 0.0)
+            lines.append(f"{name:<24}{self.calls[name]:>10}{self.inclusive.get(name, 0.0) * 1e3:>12.3f}"
+                         f"{exclusive * 1e3:>12.3f}{exclusive / total * 100:>7.1f}%")
+        lines.append(f"max recursion depth: {self.max_depth}, environments allocated: {self.frames}")
+        lines.append("nodes evaluated: " + ", ".join(
+            f"{kind} {count}" for kind, count in sorted(self.node_counts.items(), key=lambda item: -item[1])))
+        return "\n".join(lines)
+
+
+class Counted:
+    # Wraps each node of a profiled program, so its evaluation is counted before the machine continues with it
+    __slots__ = ('node', 'kind')
+
+    def __init__(self, node):
+        self.node = node
+        self.kind = type(node).__name__
+
+    def __repr__(self):
+        return repr(self.node)
+
+
+class ProfilingInterpreter(Interpreter):
+    # The tree walker with every call timed: call() pushes a RETURN_HOOK frame that closes the call, so
+    # tail calls keep a frame each while profiling. Runs on a counted copy of each statement.
+    def __init__(self, ast, memo=None):
+        super().__init__(ast, memo)
+        self.profile = Profile()
+        self.names = {}  # id(function body) -> name of the function
+
+    def execute(self, statements):
+        return super().execute(self.instrument(statement) for statement in statements)
+
+    def instrument(self, statement):
+        # A copy of statement with each node wrapped in Counted; the original stays with the optimizer
+        root = copy.copy(statement)
+        pending = [root]
+        while pending:
+            node = pending.pop()
+            kids = [copy.copy(child) for child in children(node)]
+            replace_children(node, [Counted(child) for child in kids])
+            if isinstance(node, FuncDef):
+                self.names[id(node.func_body)] = node.func_name
+            elif isinstance(node, LambdaExpr):
+                self.names[id(node.expr_body)] = lambda_name(node)
+            pending.extend(kids)
+        return Counted(root)
+
+    def evaluate(self, node, context):
+        depth = len(self.profile.active)
+        self.profile.enter(TOP_LEVEL)
+        try:
+            return super().evaluate(node, context)
+        finally:
+            self.profile.unwind(depth)
+
+    def extension(self, node, context, stack):
+        if type(node) is Counted:
+            counts = self.profile.node_counts
+            counts[node.kind] = counts.get(node.kind, 0) + 1
+            return node.node, context, None
+        return super().extension(node, context, stack)
+
+    def call(self, func, args, stack):
+        target = super().call(func, args, stack)
+        if target is not None:
+            self.profile.frames += 1
+            self.profile.enter(self.names.get(id(target[0]), '<lambda>'))
+            stack.append((RETURN_HOOK, self.profile.leave))
+        return target
+
+
+class Sampler:
+    # Statistical profile of an unmodified Interpreter: a SIGPROF timer interrupts the run every interval
+    # seconds of CPU time and reads the continuation stack of the running Interpreter.run. Results
+    # are exactly those of an unprofiled run, and between samples nothing extra executes.
+    def __init__(self, interpreter, interval=0.005, max_stack=256):
+        self.interpreter = interpreter
+        self.interval = interval
+        self.max_stack = max_stack  # innermost frames read per sample
+        self.samples = 0
+        self.stacks = {}  # tuple of function names -> samples
+        self.node_counts = {}
+        self.max_depth = 0
+        self.owners = {}  # id(node) -> name of the function whose body contains it
+        self.known = 0
+        self.previous = None
+
+    def start(self):
+        self.previous = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.previous or signal.SIG_DFL)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def learn(self):
+        # Maps the nodes of every function in the global scope to the function's name
+        variables = self.interpreter.global_env.variables
+        if len(variables) == self.known:
+            return
+        self.known = len(variables)
+        for name, value in variables.items():
+            if type(value) is Closure:
+                pending = [(value.body, name)]
+                while pending:
+                    node, owner = pending.pop()
+                    self.owners[id(node)] = owner
+                    if isinstance(node, LambdaExpr):
+                        owner = lambda_name(node)
+                    pending.extend((child, owner) for child in children(node))
+
+    def sample(self, signum, frame):
+        machines = []
+        while frame is not None:
+            if frame.f_code is Interpreter.run.__code__:
+                machines.append(frame)
+            frame = frame.f_back
+        if not machines:
+            return
+        self.learn()
+        names = []
+        for machine in reversed(machines):  # outermost evaluation first
+            local = machine.f_locals
+            entries = [(entry[1], entry[2]) for entry in local.get('stack', ())[-self.max_stack:]
+                       if entry[0] not in (MEMO, CURRY, RETURN_HOOK)]
+            entries.append((local.get('node'), local.get('context')))
+            previous = None
+            for node, context in entries:
+                name = self.owners.get(id(node), TOP_LEVEL)
+                # A new environment in the same function is a new (recursive) activation
+                if not names or name != names[-1] or (context is not previous and name != TOP_LEVEL):
+                    names.append(name)
+                previous = context
+        kind = type(machines[0].f_locals.get('node')).__name__
+        self.node_counts[kind] = self.node_counts.get(kind, 0) + 1
+        self.samples += 1
+        self.max_depth = max(self.max_depth, len(names))
+        stack = tuple(names)
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def collapsed(self):
+        return "\n".join(sorted(f"{';'.join(stack)} {count}" for stack, count in self.stacks.items()))
+
+    def report(self):
+        own = {}
+        total = {}
+        for stack, count in self.stacks.items():
+            own[stack[-1]] = own.get(stack[-1], 0) + count
+            for name in set(stack):
+                total[name] = total.get(name, 0) + count
+        samples = self.samples or 1
+        lines = [f"{'function':<24}{'self':>10}{'self %':>8}{'total':>10}{'total %':>8}"]
+        for name in sorted(total, key=lambda name: own.get(name, 0), reverse=True):
+            lines.append(f"{name:<24}{own.get(name, 0):>10}{own.get(name, 0) / samples * 100:>7.1f}%"
+                         f"{total[name]:>10}{total[name] / samples * 100:>7.1f}%")
+        lines.append(f"{self.samples} samples every {self.interval * 1e3:g} ms of CPU time, "
+                     f"deepest sampled stack: {self.max_depth}")
+        lines.append("nodes being evaluated: " + ", ".join(
+            f"{kind} {count}" for kind, count in sorted(self.node_counts.items(), key=lambda item: -item[1])))
+        return "\n".join(lines)
+
+
+def write_profile(profiler, collapsed_path=None):
+    # The flat table goes to stderr, so the program's own output is unchanged
+    print(profiler.report(), file=sys.stderr)
+    if collapsed_path:
+        with open(collapsed_path, 'w') as file:
+            file.write(profiler.collapsed() + "\n")
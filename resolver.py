@@ -0,0 +1,104 @@
+import copy
+
+from ast_node import FuncDef, LambdaExpr, FuncApp, Identifier, IntLit, BoolLit, UnaryOp, BinOp, IfStmt, children, \
+    replace_children
+
+
+class Resolver:
+    # Annotates identifiers (and calls by name) with the static (depth, index) of their binding,
+    # so evaluation indexes frame slots instead of hashing names up the scope chain.
+    # Names not bound by an enclosing Defun/Lambd keep depth None and are looked up globally.
+
+    def resolve(self, statements):
+        for statement in statements:
+            self.resolve_node(statement)
+        return statements
+
+    def resolve_node(self, node, scopes=()):
+        root = node
+        pending = [(node, scopes)]
+        while pending:
+            node, scopes = pending.pop()
+
+            if isinstance(node, Identifier):
+                node.depth, node.index = self.address(node.id_name, scopes)
+
+            elif isinstance(node, BinOp):
+                pending.append((node.right, scopes))
+                pending.append((node.left, scopes))
+
+            elif isinstance(node, UnaryOp):
+                pending.append((node.operand, scopes))
+
+            elif isinstance(node, IfStmt):
+                if node.else_branch is not None:
+                    pending.append((node.else_branch, scopes))
+                pending.append((node.then_branch, scopes))
+                pending.append((node.cond, scopes))
+
+            elif isinstance(node, FuncApp):
+                for arg in reversed(node.arguments):
+                    pending.append((arg, scopes))
+                if isinstance(node.function, str):
+                    node.depth, node.index = self.address(node.function, scopes)
+                else:
+                    pending.append((node.function, scopes))
+
+            elif isinstance(node, LambdaExpr):
+                pending.append((node.expr_body, scopes + ({node.parameters: 0},)))
+
+            elif isinstance(node, FuncDef):
+                slots = {name: index for index, name in enumerate(node.parameters)}
+                pending.append((node.func_body, scopes + (slots,)))
+
+        return root
+
+    def address(self, name, scopes):
+        depth = 0
+        for scope in reversed(scopes):
+            if name in scope:
+                return depth, scope[name]
+            depth += 1
+        return None, None
+
+
+def flatten_chain(node):
+    # For a chain of directly nested lambdas (Lambd a. (Lambd b. body)): the chain's parameters and a copy
+    # of its innermost body addressed for one frame holding all of them, so applying the chain to enough
+    # arguments binds them in one step. None for a single lambda, or a body with nodes of other kinds.
+    names = []
+    body = node
+    while type(body) is LambdaExpr:
+        names.append(body.parameters)
+        body = body.expr_body
+    count = len(names)
+    if count < 2:
+        return None
+
+    def readdress(target, nesting):
+        # nesting: lambdas between target and the innermost body; their frames keep their place
+        depth = target.depth
+        if depth is None or depth < nesting:
+            return
+        if depth - nesting < count:
+            target.depth, target.index = nesting, count - 1 - (depth - nesting)
+        else:
+            target.depth = depth - (count - 1)
+
+    root = copy.copy(body)
+    pending = [(root, 0)]
+    while pending:
+        current, nesting = pending.pop()
+        if type(current) not in CHAIN_NODES:
+            return None
+        if type(current) is Identifier or (type(current) is FuncApp and isinstance(current.function, str)):
+            readdress(current, nesting)
+        kids = [copy.copy(child) for child in children(current)]
+        replace_children(current, kids)
+        if type(current) is LambdaExpr:
+            nesting += 1
+        pending.extend((child, nesting) for child in kids)
+    return names, root
+
+
+CHAIN_NODES = {LambdaExpr, FuncApp, Identifier, IntLit, BoolLit, UnaryOp, BinOp, IfStmt}
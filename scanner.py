@@ -0,0 +1,204 @@
+from array import array
+import re
+
+
+# Token kinds as small ints; KIND_NAMES[kind] is the name the Lexer's (kind, value, line, column) tuples carry
+(DEFUN, NAME, ARGUMENTS, LAMBD, IF, ELSE, INTEGER, BOOLEAN, LETTER, BASIC_OP, BOOL_OP, COMP_OP, NOT,
+ LPAREN, RPAREN, LBRACE, RBRACE, COMMA, COLON, DOT, EOF) = range(21)
+
+KIND_NAMES = ('DEFUN', 'NAME', 'ARGUMENTS', 'LAMBD', 'IF', 'ELSE', 'INTEGER', 'BOOLEAN', 'LETTER', 'BASIC_OP',
+              'BOOL_OP', 'COMP_OP', 'NOT', 'LPAREN', 'RPAREN', 'LBRACE', 'RBRACE', 'COMMA', 'COLON', 'DOT', 'EOF')
+
+# Words that are scanned as identifiers but are keywords or booleans: word -> (kind, value)
+KEYWORDS = {
+    'Defun': (DEFUN, 'Defun'),
+    'name': (NAME, 'name'),
+    'arguments': (ARGUMENTS, 'arguments'),
+    'Lambd': (LAMBD, 'Lambd'),
+    'if': (IF, 'if'),
+    'else': (ELSE, 'else'),
+    'True': (BOOLEAN, True),
+    'False': (BOOLEAN, False),
+}
+
+# Classes of the first character of a lexeme, numbered after the token kinds: a character whose class is
+# a token kind is a complete one-character token of that kind. Characters not listed are OTHER.
+WORD, BLANK, NEWLINE, DIGIT, MINUS, EQUALS, DOUBLED, COMMENT, OTHER = range(EOF + 1, EOF + 10)
+
+CLASSES = {'\n': NEWLINE, ' ': BLANK, '\t': BLANK, '#': COMMENT, '-': MINUS, '&': DOUBLED, '|': DOUBLED,
+           '=': EQUALS, '!': EQUALS, '<': EQUALS, '>': EQUALS,
+           '+': BASIC_OP, '*': BASIC_OP, '/': BASIC_OP, '%': BASIC_OP, '(': LPAREN, ')': RPAREN,
+           '{': LBRACE, '}': RBRACE, ',': COMMA, ':': COLON, '.': DOT}
+CLASSES.update((c, WORD) for c in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_')
+CLASSES.update((c, DIGIT) for c in '0123456789')
+
+# Kind of '=', '!', '<' and '>' alone, and with '=' after them ('=' alone is not a token)
+ALONE = {'!': NOT, '<': COMP_OP, '>': COMP_OP}
+
+# Runs of characters that continue a lexeme once its first character has decided its kind
+WORD_RUN = re.compile(r'[a-zA-Z_0-9]*')
+DIGIT_RUN = re.compile(r'\d+')  # any Unicode decimal digits, as int() reads them
+BLANK_RUN = re.compile(r'[ \t]*')
+
+
+class Tokens:
+    # Scanned tokens as parallel arrays: token i is (kinds[i], values[i], lines[i], columns[i])
+    __slots__ = ('kinds', 'values', 'lines', 'columns')
+
+    def __init__(self):
+        self.kinds = array('B')
+        self.values = []
+        self.lines = array('i')
+        self.columns = array('i')
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __iter__(self):
+        # The tokens as the Lexer's (kind name, value, line, column) tuples
+        return zip(map(KIND_NAMES.__getitem__, self.kinds), self.values, self.lines, self.columns)
+
+
+class Scanner:
+    # Single pass over the source that picks each lexeme's kind from its first character, so keywords
+    # cost one dictionary lookup after their word is scanned. Produces exactly the tokens, positions and
+    # errors of Lexer.token_spec, including its \b rules: a word or number must not run into a letter.
+    def __init__(self, code):
+        self.code = code  # a string or an iterable of lines (e.g. an open file)
+        self.line_num = 1
+        self.column = 0  # column of the last lexeme, which the EOF token reports
+
+    def scan(self):
+        # All tokens, ending with EOF
+        tokens = Tokens()
+        for chunk in self.chunks():
+            invalid = self.scan_chunk(chunk, tokens)
+            if invalid is not None:
+                raise self.error(invalid)
+        self.finish(tokens)
+        return tokens
+
+    def batches(self):
+        # Yields the tokens chunk by chunk; a chunk with an invalid character yields the tokens before it
+        # and then raises, so a consumer sees the same tokens as from the regex stream before the error
+        for chunk in self.chunks():
+            tokens = Tokens()
+            invalid = self.scan_chunk(chunk, tokens)
+            yield tokens
+            if invalid is not None:
+                raise self.error(invalid)
+        tokens = Tokens()
+        self.finish(tokens)
+        yield tokens
+
+    def chunks(self):
+        return (self.code,) if isinstance(self.code, str) else self.code
+
+    def error(self, character):
+        return RuntimeError(f'{character!r} unexpected on line {self.line_num}')
+
+    def finish(self, tokens):
+        tokens.kinds.append(EOF)
+        tokens.values.append('EOF')
+        tokens.lines.append(self.line_num)
+        tokens.columns.append(self.column)
+
+    def scan_chunk(self, chunk, tokens):
+        # Appends the tokens of chunk and returns None, or the first invalid character of chunk
+        kinds = tokens.kinds.append
+        values = tokens.values.append
+        lines = tokens.lines.append
+        columns = tokens.columns.append
+        classes = CLASSES.get
+        keywords = KEYWORDS.get
+        word_end = WORD_RUN.match
+        line = self.line_num
+        line_start = 0
+        previous_start = 0  # line_start before the last newline, for the column of a trailing newline
+        start = -1
+        i = 0
+        n = len(chunk)
+        try:
+            while i < n:
+                start = i
+                c = chunk[i]
+                kind = classes(c, OTHER)
+
+                if kind == WORD:
+                    i = word_end(chunk, i + 1).end()
+                    if i < n and (chunk[i].isalnum() or chunk[i] == '_'):
+                        return c  # runs into a non-ASCII letter or digit: no \b after the word
+                    word = chunk[start:i]
+                    keyword = keywords(word)
+                    if keyword is None:
+                        kinds(LETTER)
+                        values(word)
+                    else:
+                        kinds(keyword[0])
+                        values(keyword[1])
+
+                elif kind == BLANK:
+                    i = BLANK_RUN.match(chunk, i + 1).end()
+                    continue
+
+                elif kind < EOF:
+                    i += 1
+                    kinds(kind)
+                    values(c)
+
+                elif kind == NEWLINE:
+                    i += 1
+                    previous_start = line_start
+                    line_start = i
+                    line += 1
+                    continue
+
+                elif kind == DIGIT or kind == MINUS or (kind == OTHER and c.isdecimal()):
+                    if kind == MINUS and not (i + 1 < n and chunk[i + 1].isdecimal()):
+                        i += 1
+                        kinds(BASIC_OP)
+                        values('-')
+                    else:
+                        i = DIGIT_RUN.match(chunk, i + 1 if kind == MINUS else i).end()
+                        kinds(INTEGER)
+                        values(int(chunk[start:i]))
+                        if i < n and classes(chunk[i]) == WORD:
+                            lines(line)
+                            columns(start - line_start)
+                            return chunk[i]  # no \b before a word that follows a number
+
+                elif kind == EQUALS:
+                    if i + 1 < n and chunk[i + 1] == '=':
+                        i += 2
+                        kinds(COMP_OP)
+                        values(chunk[start:i])
+                    elif c == '=':
+                        return c
+                    else:
+                        i += 1
+                        kinds(ALONE[c])
+                        values(c)
+
+                elif kind == DOUBLED:
+                    if not (i + 1 < n and chunk[i + 1] == c):
+                        return c
+                    i += 2
+                    kinds(BOOL_OP)
+                    values(c + c)
+
+                elif kind == COMMENT:
+                    i = chunk.find('\n', i)
+                    if i < 0:
+                        i = n
+                    continue
+
+                else:
+                    return c
+
+                lines(line)
+                columns(start - line_start)
+        finally:
+            self.line_num = line
+            if start >= 0:
+                self.column = start - (previous_start if chunk[start] == '\n' else line_start)
+        return None
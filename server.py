@@ -0,0 +1,236 @@
+import batch
+from cache import compile_source
+from interpreter import Interpreter
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+
+# A worker gets this long past a request's deadline to report the timeout itself before the server
+# answers for it (a worker that died never answers)
+GRACE_SECONDS = 1.0
+
+# Longest request line accepted, so a whole program fits in one request
+MAX_REQUEST_BYTES = 16 * 1024 * 1024
+
+# Run once by every worker as it starts, so the first real request doesn't pay for the imports,
+# the scanner and parser tables or the first allocations of the interpreter
+WARM_UP = """
+Defun {name: fact, arguments: (n,)} if (n == 0) {1} else {n * fact(n - 1)}
+(Lambd x. fact(x) + 1)(5)
+"""
+
+
+def init_server_worker(settings):
+    batch.init_worker(settings)
+    with contextlib.redirect_stdout(io.StringIO()):
+        statements = compile_source(WARM_UP, settings['opt_level'])
+        Interpreter(statements).execute(statements)
+
+
+class EvaluationServer:
+    # Accepts programs as JSON lines on a Unix or TCP socket and runs them on a pool of warm worker
+    # processes. A request is {"id": any, "source": program text, "deadline": seconds (optional)};
+    # the answer is one JSON line with the same id and the fields of a batch.py record (status, result,
+    # output, errors, seconds). Requests on a connection may be pipelined: each answer is written as
+    # soon as its program finishes, so answers can arrive in another order than their requests.
+    def __init__(self, jobs=None, timeout=None, memory_mb=None, engine='walker', opt_level=1, memo=False,
+                 memo_size=4096, max_pending=1024):
+        settings = {'timeout': timeout, 'memory_mb': memory_mb, 'engine': engine, 'opt_level': opt_level,
+                    'memo': memo, 'memo_size': memo_size, 'cache': False}
+        self.jobs = jobs or os.cpu_count() or 1
+        self.timeout = timeout
+        self.max_pending = max_pending  # requests queued or running; more are answered with status busy
+        self.pending = 0
+        self.pool = multiprocessing.Pool(self.jobs, initializer=init_server_worker, initargs=(settings,))
+        self.server = None
+        self.path = None
+
+    async def start(self, path=None, host='127.0.0.1', port=0):
+        # Listens on the Unix socket path if given, else on host:port (port 0 picks a free one)
+        if path is not None:
+            self.path = path
+            self.server = await asyncio.start_unix_server(self.handle, path, limit=MAX_REQUEST_BYTES)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port, limit=MAX_REQUEST_BYTES)
+        return self.server
+
+    def address(self):
+        return self.server.sockets[0].getsockname()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+        self.pool.terminate()
+        self.pool.join()
+
+    async def handle(self, reader, writer):
+        # One connection: a task per request, and the connection stays open until every answer is written
+        replies = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:  # longer than MAX_REQUEST_BYTES
+                    write_line(writer, {'id': None, 'status': 'invalid', 'error': "request too long"})
+                    break
+                if not line:
+                    break
+                if line.strip():
+                    reply = asyncio.ensure_future(self.reply(line, writer))
+                    replies.add(reply)
+                    reply.add_done_callback(replies.discard)
+            if replies:
+                await asyncio.gather(*replies)
+        except ConnectionError:
+            pass  # the client left; programs already queued still run, their answers are dropped
+        finally:
+            writer.close()
+
+    async def reply(self, line, writer):
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise TypeError("a request is a JSON object")
+            request_id = request.get('id')
+            source = request['source']
+            deadline = request.get('deadline')
+            if not isinstance(source, str) or not (deadline is None or isinstance(deadline, (int, float))):
+                raise TypeError("source must be a string and deadline a number of seconds")
+        except (ValueError, KeyError, TypeError) as e:
+            record = {'status': 'invalid', 'error': f"{type(e).__name__}: {e}"}
+        else:
+            record = await self.evaluate(source, deadline)
+        record['id'] = request_id
+        write_line(writer, record)
+        await writer.drain()
+
+    async def evaluate(self, source, seconds=None):
+        # The worker's record for source; seconds, when given, is the deadline counted from now. Without
+        # one the server's timeout is, so the wait for a worker that died with the program stays bounded
+        if self.pending >= self.max_pending:
+            return {'status': 'busy', 'error': f"{self.pending} requests are already pending"}
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if seconds is None:
+            seconds = self.timeout
+        deadline = time.monotonic() + seconds if seconds is not None else None
+
+        def resolve(record):
+            if not future.done():
+                future.set_result(record)
+
+        def failed(error):
+            resolve({'status': 'error', 'error': f"{type(error).__name__}: {error}"})
+
+        # The pool calls back on its result thread; the future belongs to the event loop
+        self.pool.apply_async(batch.run_source, (source, deadline),
+                              callback=lambda record: loop.call_soon_threadsafe(resolve, record),
+                              error_callback=lambda error: loop.call_soon_threadsafe(failed, error))
+        self.pending += 1
+        try:
+            if deadline is None:
+                return await future
+            try:
+                return await asyncio.wait_for(future, max(0.0, deadline - time.monotonic()) + GRACE_SECONDS)
+            except asyncio.TimeoutError:
+                return {'status': 'timeout', 'error': "no answer from the worker before the deadline"}
+        finally:
+            self.pending -= 1
+
+
+def write_line(writer, record):
+    writer.write((json.dumps(record) + "\n").encode('utf-8'))
+
+
+async def connect(address):
+    # address: the path of a Unix socket, or a (host, port) pair
+    if isinstance(address, str):
+        return await asyncio.open_unix_connection(address, limit=MAX_REQUEST_BYTES)
+    return await asyncio.open_connection(address[0], address[1], limit=MAX_REQUEST_BYTES)
+
+
+async def send_requests(address, requests, window=16):
+    # Load generator for one connection: sends requests (dicts with a source and an optional deadline),
+    # keeping at most window of them unanswered, and returns (latency in seconds, answer) per request
+    reader, writer = await connect(address)
+    slots = asyncio.Semaphore(window)
+    sent = {}
+    answers = {}
+
+    async def send():
+        for index, request in enumerate(requests):
+            await slots.acquire()
+            sent[index] = time.perf_counter()
+            write_line(writer, dict(request, id=index))
+            await writer.drain()
+
+    sender = asyncio.ensure_future(send())
+    try:
+        while len(answers) < len(requests):
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("the server closed the connection")
+            answer = json.loads(line)
+            answers[answer['id']] = (time.perf_counter() - sent[answer['id']], answer)
+            slots.release()
+        await sender
+    finally:
+        sender.cancel()
+        writer.close()
+    return [answers[index] for index in range(len(requests))]
+
+
+def parse_args():
+    arg_parser = argparse.ArgumentParser(description="Evaluation server: runs programs sent as JSON lines on a "
+                                                     "pool of warm worker processes.")
+    address = arg_parser.add_mutually_exclusive_group()
+    address.add_argument("--socket", default=None, metavar="PATH", help="listen on this Unix socket")
+    address.add_argument("--port", type=int, default=7878, help="listen on this TCP port (default: 7878)")
+    arg_parser.add_argument("--host", default='127.0.0.1', help="TCP address to listen on (default: 127.0.0.1)")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=None,
+                            help="number of worker processes (default: number of CPUs)")
+    arg_parser.add_argument("--timeout", type=float, default=None,
+                            help="seconds any program may run, whatever its request's deadline; also the "
+                                 "deadline of requests that give none")
+    arg_parser.add_argument("--memory-mb", type=int, default=None,
+                            help="address space limit of each worker process, in MB")
+    arg_parser.add_argument("--engine", choices=sorted(batch.ENGINES), default='walker',
+                            help="execution engine (default: walker)")
+    arg_parser.add_argument("-O", dest="opt_level", type=int, choices=[0, 1, 2], default=1,
+                            help="optimization level, as for main.py")
+    arg_parser.add_argument("--memo", action="store_true",
+                            help="cache results of Defunc calls with integer/boolean arguments")
+    arg_parser.add_argument("--memo-size", type=int, default=4096,
+                            help="maximum number of cached results per program")
+    arg_parser.add_argument("--max-pending", type=int, default=1024,
+                            help="requests queued or running before new ones are answered with status busy")
+    return arg_parser.parse_args()
+
+
+async def serve(args):
+    server = EvaluationServer(args.jobs, args.timeout, args.memory_mb, args.engine, args.opt_level, args.memo,
+                              args.memo_size, args.max_pending)
+    try:
+        await server.start(args.socket, args.host, args.port)
+        print(f"listening on {server.address()} with {server.jobs} workers", file=sys.stderr)
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        pass
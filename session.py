@@ -0,0 +1,44 @@
+from ast_node import FuncDef, IfStmt
+from interpreter import Interpreter
+from lexer import Lexer
+from optimizer import Optimizer
+from parser import Parser
+
+
+class Session:
+    # One interpreter kept alive across REPL inputs: the global scope, memo cache, compiled closures and
+    # the optimizer's known Defuncs persist, and each input is lexed and parsed on its own.
+    def __init__(self, interpreter_class=Interpreter, opt_level=1, memo=None):
+        self.interpreter = interpreter_class([], memo)
+        self.optimizer = Optimizer(opt_level)
+        self.pending = []  # lines of a statement that is not complete yet
+
+    def feed(self, line):
+        # Returns the last result of the statements completed by this line, or None while more input is needed
+        if not self.pending and not line.strip():
+            return None
+        self.pending.append(line)
+        parser = None
+        try:
+            parser = Parser(Lexer("\n".join(self.pending)).tokenize())
+            statements = parser.parse()
+        except RuntimeError:
+            # Ran out of tokens mid-statement: wait for the next line, unless it was blank
+            if parser is not None and parser.current_token[0] == 'EOF' and line.strip():
+                return None
+            self.pending = []
+            raise
+        if line.strip() and statements and self.awaits_else(statements[-1]):
+            return None
+        self.pending = []
+        return self.run(statements)
+
+    def awaits_else(self, statement):
+        # An if without else at the end of the input may still get its else on the next line
+        if isinstance(statement, FuncDef):
+            statement = statement.func_body
+        return isinstance(statement, IfStmt) and statement.else_branch is None
+
+    def run(self, statements):
+        statements = [self.optimizer.optimize_statement(statement) for statement in statements]
+        return self.interpreter.execute(statements)
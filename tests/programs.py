@@ -0,0 +1,54 @@
+import glob
+import os
+
+from basic import Closure
+from benchmark import CORPUS, COUNTDOWN, SUM, SUITE_DIR, parse
+from optimizer import Optimizer
+
+
+# Mutual recursion far beyond the recursion limit, which inlining must not unroll
+MUTUAL = """
+Defun {name: even, arguments: (n,)} if (n == 0) {True} else {odd(n - 1)}
+Defun {name: odd, arguments: (n,)} if (n == 0) {False} else {even(n - 1)}
+even(5001)
+odd(50001)
+"""
+
+# Errors raised deep inside function bodies: each is reported once, with the prefix of the statement's first
+# call or if-statement
+ERRORS = [
+    "Defun {name: f, arguments: (n,)} if (n == 0) {1 / 0} else {f(n - 1)}\nf(50)",
+    "Defun {name: f, arguments: (n,)} if (n == 0) {1 / 0} else {1 + f(n - 1)}\nf(5000)",
+    "Defun {name: f, arguments: (n,)} n\nf(1) + (1 / 0)",
+    "(1 / 0) + (Lambd x. x)(1)",
+    "Defun {name: f, arguments: (n,)} if (n == 0) {g(1)} else {f(n - 1)}\nif (f(3)) {1} else {2}",
+]
+
+
+def programs():
+    # CORPUS, the programs in benchmarks/, deep recursion and nested errors, as name -> source
+    sources = {f"corpus {index}": source for index, source in enumerate(CORPUS)}
+    for path in sorted(glob.glob(os.path.join(SUITE_DIR, '*.lambda'))):
+        with open(path) as file:
+            sources[os.path.basename(path)] = file.read()
+    sources.update(countdown=COUNTDOWN, sum=SUM, mutual=MUTUAL)
+    sources.update((f"error {index}", source) for index, source in enumerate(ERRORS))
+    return sources
+
+
+def results(interpreter_class, source, opt_level=1):
+    # What each statement evaluates to, or the error it raises; function values hold engine-specific bodies,
+    # so only their parameters are compared
+    statements = Optimizer(opt_level).optimize(parse(source))
+    interpreter = interpreter_class(statements)
+    results = []
+    for node in statements:
+        try:
+            result = interpreter.evaluate(node, interpreter.global_env)
+            results.append(f"function of {result.parameters}" if isinstance(result, Closure) else repr(result))
+        except Exception as e:
+            results.append(f"{type(e).__name__}: {e}")
+    return results
+
+
+PROGRAMS = programs()
@@ -0,0 +1,18 @@
+import pytest
+
+from compiler import CompiledInterpreter
+from interpreter import Interpreter
+from programs import PROGRAMS, results
+from vm import VMInterpreter
+
+
+@pytest.mark.parametrize('engine', [CompiledInterpreter, VMInterpreter], ids=['compile', 'vm'])
+@pytest.mark.parametrize('name', list(PROGRAMS))
+def test_engine_agrees_with_tree_walker(engine, name):
+    assert results(engine, PROGRAMS[name]) == results(Interpreter, PROGRAMS[name])
+
+
+def test_compiled_error_has_one_prefix():
+    [result] = results(CompiledInterpreter, "Defun {name: f, arguments: (n,)} if (n == 0) {1 / 0} else {f(n - 1)}\n"
+                                            "f(50)")[1:]
+    assert result == "EvaluationError: Error applying function: Invalid, division by zero!"
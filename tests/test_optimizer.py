@@ -0,0 +1,68 @@
+import pytest
+
+from ast_node import FuncDef
+from benchmark import parse
+from interpreter import Interpreter
+from optimizer import Optimizer, global_names
+from programs import PROGRAMS, results
+
+
+# Folding must keep the side of && and || that decides the result, and an if without else that it prunes
+# must still evaluate to nothing
+EDGE_CASES = {
+    'or literal left': "3 || (1 / 0)\n0 || False\nFalse || 7",
+    'and literal left': "0 && (1 / 0)\nTrue && 4\n3 && False",
+    'literal right': "Defun {name: f, arguments: (x,)} (1 / x) && False\n"
+                     "Defun {name: g, arguments: (x,)} (1 / x) || True\nf(0)\nf(1)\ng(0)\ng(2)",
+    'parameter and literal': "Defun {name: f, arguments: (x,)} x || True\n"
+                             "Defun {name: g, arguments: (x,)} True && x\nf(0)\nf(5)\ng(0)\ng(3)",
+    'if without else, false': "if (1 > 2) {1 / 0}\nDefun {name: f, arguments: (x,)} if (False) {x}\nf(1)",
+    'if without else, true': "if (1 < 2) {5}\nDefun {name: f, arguments: (x,)} if (1 < 2) {x + 1}\nf(1)",
+    'pruned if keeps error prefix': "if (1 < 2) {1 / 0}\nDefun {name: f, arguments: (x,)} 1 / x\n"
+                                    "if (True) {f(0)} else {2}",
+    'inlined call keeps error prefix': "Defun {name: f, arguments: (x,)} if (True) {1 / x}\nf(0)",
+    'recursive': "Defun {name: f, arguments: (n,)} if (n == 0) {0} else {f(n - 1) + 1}\n"
+                 "Defun {name: g, arguments: (n,)} f(n)\ng(3000)",
+    'mutually recursive': "Defun {name: even, arguments: (n,)} if (n == 0) {True} else {odd(n - 1)}\n"
+                          "Defun {name: odd, arguments: (n,)} if (n == 0) {False} else {even(n - 1)}\n"
+                          "Defun {name: start, arguments: (n,)} even(n)\nstart(5001)\nodd(20001)",
+}
+
+
+def bodies(source, opt_level):
+    return {statement.func_name: statement.func_body for statement in Optimizer(opt_level).optimize(parse(source))
+            if isinstance(statement, FuncDef)}
+
+
+@pytest.mark.parametrize('opt_level', [1, 2])
+@pytest.mark.parametrize('name', list(PROGRAMS) + list(EDGE_CASES))
+def test_optimized_program_gives_same_results(name, opt_level):
+    source = PROGRAMS[name] if name in PROGRAMS else EDGE_CASES[name]
+    assert results(Interpreter, source, opt_level) == results(Interpreter, source, 0)
+
+
+def test_mutually_recursive_defuncs_are_not_inlined():
+    optimized = bodies(EDGE_CASES['mutually recursive'], 2)
+    assert 'odd' in global_names(optimized['even'])
+    assert 'even' in global_names(optimized['odd'])
+    assert 'even' in global_names(optimized['start'])
+
+
+def test_cycle_through_later_definition_is_not_inlined():
+    source = ("Defun {name: a, arguments: (n,)} if (n == 0) {0} else {b(n - 1)}\n"
+              "Defun {name: b, arguments: (n,)} if (n == 0) {1} else {c(n)}\n"
+              "Defun {name: c, arguments: (n,)} a(n)\nc(3)")
+    optimized = bodies(source, 2)
+    assert 'b' in global_names(optimized['a'])
+    assert 'a' in global_names(optimized['c'])
+
+
+def test_recursive_defunc_is_not_inlined():
+    optimized = bodies(EDGE_CASES['recursive'], 2)
+    assert 'f' in global_names(optimized['f'])
+    assert 'f' in global_names(optimized['g'])
+
+
+def test_non_recursive_defunc_is_inlined():
+    optimized = bodies("Defun {name: inc, arguments: (x,)} x + 1\nDefun {name: g, arguments: (y,)} inc(y) * 2", 2)
+    assert 'inc' not in global_names(optimized['g'])
@@ -0,0 +1,336 @@
+from ast_node import AstNode, LambdaExpr, FuncApp, Identifier, IntLit, BoolLit, UnaryOp, BinOp, IfStmt, SharedExpr
+from basic import Closure, DEFUNC, Environment
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # every batch then runs through the interpreter, one input at a time
+
+
+INT, BOOL = range(2)  # static types of vectorized expressions
+
+# Lanes evaluated together; an overflow only sends its own chunk back to the interpreter
+CHUNK = 1 << 16
+
+# Inlined calls a kernel may nest, so deep non-recursive call chains stay scalar instead of growing huge kernels
+MAX_INLINE_DEPTH = 32
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+CALLEE = '<mapped function>'  # name the scalar path binds the function to
+
+
+class Unvectorizable(Exception):
+    # The function uses something that has no array form; the whole batch runs on the interpreter
+    pass
+
+
+class Fallback(Exception):
+    # A chunk would overflow int64 or divide by zero; the interpreter evaluates that chunk instead
+    pass
+
+
+class VectorCompiler:
+    # Compiles a numeric function into nested closures over NumPy arrays holding one lane per input.
+    # Run-time values are a flat list of arrays, one per bound parameter; an IfStmt or short-circuit
+    # operator evaluates each branch on the lanes that take it, so no lane computes what the scalar
+    # interpreter would skip. Calls to non-recursive functions with AST bodies are inlined.
+    def __init__(self):
+        self.inlining = []  # bodies being inlined, to refuse recursion
+
+    def compile_function(self, function, arity):
+        # Code taking the argument arrays for a function value applied to arity arguments
+        arguments = [(self.load(position), INT) for position in range(arity)]
+        return self.compile_call(function, arguments, arity)[0]
+
+    def load(self, position):
+        return lambda values: values[position]
+
+    def compile(self, node, scope, outer, width):
+        # scope: flat positions of the parameters in lexical scope, a tuple per level, innermost last;
+        # outer: the environment beyond them; width: the number of values bound so far
+        if isinstance(node, (IntLit, BoolLit)):
+            return self.constant(node.val)
+
+        elif isinstance(node, Identifier):
+            if node.depth is not None and node.depth < len(scope):
+                position = scope[-1 - node.depth][node.index]
+                return self.load(position), INT
+            return self.constant(self.outer_value(node.id_name, node.depth, node.index, scope, outer))
+
+        elif isinstance(node, UnaryOp) and node.op == '!':
+            operand, kind = self.compile(node.operand, scope, outer, width)
+            if kind == BOOL:
+                return (lambda values: ~operand(values)), BOOL
+            return (lambda values: operand(values) == 0), BOOL
+
+        elif isinstance(node, BinOp):
+            return self.compile_bin_op(node, scope, outer, width)
+
+        elif isinstance(node, IfStmt) and node.else_branch is not None:
+            return self.compile_if_stmt(node, scope, outer, width)
+
+        elif isinstance(node, SharedExpr):
+            return self.compile(node.expr, scope, outer, width)
+
+        elif isinstance(node, FuncApp):
+            arguments = [self.compile(argument, scope, outer, width) for argument in node.arguments]
+            if isinstance(node.function, str):
+                if node.depth is not None and node.depth < len(scope):
+                    raise Unvectorizable("calls a function passed as an argument")
+                function = self.outer_value(node.function, node.depth, node.index, scope, outer)
+                return self.compile_call(function, arguments, width)
+            if isinstance(node.function, LambdaExpr):
+                return self.compile_lambda_call(node.function, arguments, scope, outer, width)
+
+        raise Unvectorizable(f"no array form for {type(node).__name__}")
+
+    def outer_value(self, name, depth, index, scope, outer):
+        # A value bound outside the kernel, fixed for the whole batch
+        try:
+            if depth is None:
+                return outer.get(name)
+            return outer.lookup(depth - len(scope), index)
+        except NameError:
+            raise Unvectorizable(f"undefined name {name}")  # the interpreter reports it for each row
+
+    def constant(self, value):
+        if type(value) is bool:
+            value = numpy.bool_(value)
+            return (lambda values: value), BOOL
+        if type(value) is int and INT64_MIN <= value <= INT64_MAX:
+            value = numpy.int64(value)
+            return (lambda values: value), INT
+        raise Unvectorizable(f"no array form for the value {value!r}")
+
+    def compile_call(self, function, arguments, width):
+        # Inlines a function value applied to compiled arguments; its body only sees its own closure
+        if not (type(function) is Closure and isinstance(function.body, AstNode)):
+            raise Unvectorizable("calls a function that is not a tree")
+        if function.kind == DEFUNC:
+            if function.arity != len(arguments):
+                raise Unvectorizable("wrong number of arguments")  # the interpreter reports the error
+            return self.bind(function.body, [arguments], (), function.env, width)
+        lambda_expr = LambdaExpr(function.parameters, function.body)
+        return self.compile_lambda_call(lambda_expr, arguments, (), function.env, width)
+
+    def compile_lambda_call(self, lambda_expr, arguments, scope, outer, width):
+        # Curried application: each argument enters the body of the next lambda of the chain
+        levels = []
+        body = lambda_expr
+        for argument in arguments:
+            if not isinstance(body, LambdaExpr):
+                raise Unvectorizable("applies a lambda to more arguments than it takes")
+            levels.append([argument])
+            body = body.expr_body
+        if isinstance(body, LambdaExpr) or not levels:
+            raise Unvectorizable("the result is a function")
+        return self.bind(body, levels, scope, outer, width)
+
+    def bind(self, body, levels, scope, outer, width):
+        # Code that appends the argument values of each level and runs body on the extended values
+        if any(body is inlined for inlined in self.inlining) or len(self.inlining) >= MAX_INLINE_DEPTH:
+            raise Unvectorizable("recursive function")
+        codes = []
+        for level in levels:
+            positions = []
+            for code, kind in level:
+                if kind != INT:
+                    raise Unvectorizable("boolean argument")  # parameters are typed INT
+                codes.append(code)
+                positions.append(width)
+                width += 1
+            scope = scope + (tuple(positions),)
+        self.inlining.append(body)
+        try:
+            result, kind = self.compile(body, scope, outer, width)
+        finally:
+            self.inlining.pop()
+
+        def call(values):
+            return result(values + [lane_array(code(values), values) for code in codes])
+
+        return call, kind
+
+    def compile_bin_op(self, node, scope, outer, width):
+        left, left_kind = self.compile(node.left, scope, outer, width)
+        right, right_kind = self.compile(node.right, scope, outer, width)
+        op = node.op
+
+        if op == '||' or op == '&&':
+            # True if left else right, and right if left else False: the result is a boolean only when right is
+            if right_kind != BOOL:
+                raise Unvectorizable("&& or || with a non-boolean right operand")
+            truth = truthy(left, left_kind)
+            taken = op == '&&'
+
+            def short_circuit(values):
+                mask = truth(values)
+                if not isinstance(mask, numpy.ndarray):
+                    return right(values) if bool(mask) == taken else numpy.bool_(not taken)
+                result = numpy.full(len(mask), not taken)
+                lanes = mask if taken else ~mask
+                if lanes.any():
+                    result[lanes] = right(subset(values, lanes))
+                return result
+
+            return short_circuit, BOOL
+
+        if left_kind != right_kind:
+            raise Unvectorizable("operands of different types")
+        if op in COMPARISONS:
+            apply = COMPARISONS[op]
+            return (lambda values: apply(left(values), right(values))), BOOL
+        if left_kind != INT or op not in ARITHMETIC:
+            raise Unvectorizable(f"no array form for {op} on these operands")
+        apply = ARITHMETIC[op]
+        return (lambda values: apply(left(values), right(values))), INT
+
+    def compile_if_stmt(self, node, scope, outer, width):
+        cond, cond_kind = self.compile(node.cond, scope, outer, width)
+        then_branch, then_kind = self.compile(node.then_branch, scope, outer, width)
+        else_branch, else_kind = self.compile(node.else_branch, scope, outer, width)
+        if then_kind != else_kind:
+            raise Unvectorizable("branches of different types")
+        truth = truthy(cond, cond_kind)
+        dtype = numpy.bool_ if then_kind == BOOL else numpy.int64
+
+        def if_stmt(values):
+            mask = truth(values)
+            if not isinstance(mask, numpy.ndarray):
+                return then_branch(values) if mask else else_branch(values)
+            result = numpy.empty(len(mask), dtype)
+            if mask.any():
+                result[mask] = then_branch(subset(values, mask))
+            if not mask.all():
+                inverse = ~mask
+                result[inverse] = else_branch(subset(values, inverse))
+            return result
+
+        return if_stmt, then_kind
+
+
+def truthy(code, kind):
+    if kind == BOOL:
+        return code
+    return lambda values: code(values) != 0
+
+
+def subset(values, mask):
+    return [value[mask] for value in values]
+
+
+def lane_array(value, values):
+    # Arguments are bound as full arrays, so later subsets can index them like the parameters
+    if isinstance(value, numpy.ndarray) or not values:
+        return value
+    return numpy.full(len(values[0]), value)
+
+
+def add(left, right):
+    result = left + right
+    if (((left ^ result) & (right ^ result)) < 0).any():
+        raise Fallback("overflow")
+    return result
+
+
+def subtract(left, right):
+    result = left - right
+    if (((left ^ right) & (left ^ result)) < 0).any():
+        raise Fallback("overflow")
+    return result
+
+
+def multiply(left, right):
+    # The float product is exact enough to tell whether the int64 one wrapped around
+    if (numpy.abs(numpy.multiply(left, right, dtype=numpy.float64)) >= 2.0 ** 63).any():
+        raise Fallback("overflow")
+    return left * right
+
+
+def divide(left, right):
+    check_divisor(left, right)
+    return left // right
+
+
+def remainder(left, right):
+    check_divisor(left, right)
+    return left % right
+
+
+def check_divisor(left, right):
+    # The interpreter raises division by zero for these lanes; INT64_MIN // -1 does not fit
+    if (right == 0).any() or ((left == INT64_MIN) & (right == -1)).any():
+        raise Fallback("division")
+
+
+ARITHMETIC = {'+': add, '-': subtract, '*': multiply, '/': divide, '%': remainder}
+
+if numpy is not None:
+    COMPARISONS = {'==': numpy.equal, '!=': numpy.not_equal, '<': numpy.less, '>': numpy.greater,
+                   '<=': numpy.less_equal, '>=': numpy.greater_equal}
+
+
+def map_function(interpreter, function, *columns):
+    # [function(columns[0][i], columns[1][i], ...) for each i], with integer columns. function is a
+    # function value or the name of a global one. When NumPy is installed and the function is numeric
+    # all the way down, the whole batch is evaluated as array operations; other batches, and chunks
+    # that would overflow int64 or divide by zero, are evaluated by the interpreter one row at a time.
+    if isinstance(function, str):
+        function = interpreter.global_env.get(function)
+    if len(set(map(len, columns))) > 1:
+        raise ValueError("columns of different lengths")
+    count = len(columns[0]) if columns else 0
+    kernel = None
+    if numpy is not None and columns:
+        try:
+            kernel = VectorCompiler().compile_function(function, len(columns))
+        except Unvectorizable:
+            pass
+    if kernel is None:
+        return scalar_map(interpreter, function, columns, 0, count)
+    results = []
+    for start in range(0, count, CHUNK):
+        stop = min(start + CHUNK, count)
+        arrays = [int64_array(column, start, stop) for column in columns]
+        if any(array is None for array in arrays):
+            results.extend(scalar_map(interpreter, function, columns, start, stop))
+            continue
+        try:
+            with numpy.errstate(all='ignore'):
+                value = kernel(arrays)
+        except Fallback:
+            results.extend(scalar_map(interpreter, function, columns, start, stop))
+            continue
+        if isinstance(value, numpy.ndarray):
+            results.extend(value.tolist())
+        else:
+            results.extend([value.item()] * (stop - start))
+    return results
+
+
+def int64_array(column, start, stop):
+    # The rows start:stop of column as an int64 array, or None when one of them is not an int that fits
+    if isinstance(column, range):
+        rows = column[start:stop]
+        if rows and not (INT64_MIN <= min(rows[0], rows[-1]) and max(rows[0], rows[-1]) <= INT64_MAX):
+            return None
+        return numpy.arange(rows.start, rows.stop, rows.step, dtype=numpy.int64)
+    rows = column[start:stop]
+    if any(type(row) is not int for row in rows):
+        return None  # bools and other values keep their own semantics in the interpreter
+    try:
+        return numpy.array(rows, dtype=numpy.int64)
+    except OverflowError:
+        return None
+
+
+def scalar_map(interpreter, function, columns, start, stop):
+    # The per-element loop: each row is a call evaluated by the interpreter
+    scope = Environment(interpreter.global_env, {CALLEE: function})
+    results = []
+    for row in zip(*(column[start:stop] for column in columns)):
+        call = FuncApp(CALLEE, [BoolLit(value) if type(value) is bool else IntLit(value) for value in row])
+        results.append(interpreter.evaluate(call, scope))
+    return results
@@ -0,0 +1,368 @@
+from ast_node import FuncDef, LambdaExpr, FuncApp, Identifier, IntLit, BoolLit, UnaryOp, BinOp, IfStmt, SharedExpr
+from basic import Closure, DEFUNC, LAMBDA, Environment, Unset
+from interpreter import EvaluationError, Interpreter, OPERATORS
+from memo import MISSING
+from resolver import flatten_chain
+
+
+# Opcodes; an instruction is an (opcode, argument) pair of ints in Code.code
+(CONST, LOAD_GLOBAL, LOAD_FAST, LOAD_OUTER, LOAD_DEEP, BINARY, NOT, JUMP, JUMP_IF_FALSE, OR_JUMP, AND_JUMP,
+ MAKE_CLOSURE, DEFINE, CALL, TAIL_CALL, RETURN, PREFIX, LOAD_SHARED, STORE_SHARED) = range(19)
+
+OPCODE_NAMES = ['CONST', 'LOAD_GLOBAL', 'LOAD_FAST', 'LOAD_OUTER', 'LOAD_DEEP', 'BINARY', 'NOT', 'JUMP',
+                'JUMP_IF_FALSE', 'OR_JUMP', 'AND_JUMP', 'MAKE_CLOSURE', 'DEFINE', 'CALL', 'TAIL_CALL', 'RETURN',
+                'PREFIX', 'LOAD_SHARED', 'STORE_SHARED']
+
+# BINARY takes an index into these
+BINARY_OPERATORS = list(OPERATORS)
+BINARY_FUNCTIONS = [OPERATORS[op] for op in BINARY_OPERATORS]
+
+# Error prefixes selected by PREFIX, the same ones Interpreter.evaluate reports
+PREFIXES = ["Error applying function", "Error evaluating if-statement"]
+
+# Frames kept on the call stack of VMInterpreter.run
+RETURN_TO, CURRY, MEMO = range(3)
+
+
+class Code:
+    # One compiled statement or function body: flat instructions plus the constants they index
+    __slots__ = ('name', 'code', 'consts')
+
+    def __init__(self, name):
+        self.name = name
+        self.code = []
+        self.consts = []
+
+    def emit(self, op, arg=0):
+        self.code.append(op)
+        self.code.append(arg)
+        return len(self.code) - 1  # position of the argument, for patch()
+
+    def patch(self, position, target=None):
+        self.code[position] = len(self.code) if target is None else target
+
+    def const(self, value):
+        # Constants are shared by identity, or by value and type for literals (True and 1 stay apart)
+        for index, existing in enumerate(self.consts):
+            if existing is value or (type(existing) is type(value) and type(value) in (int, bool, str)
+                                     and existing == value):
+                return index
+        self.consts.append(value)
+        return len(self.consts) - 1
+
+    def __repr__(self):
+        return f"<code {self.name}>"
+
+
+def disassemble(code):
+    # Human-readable listing of code and the function bodies it creates
+    lines = []
+    pending = [code]
+    while pending:
+        code = pending.pop(0)
+        lines.append(f"{code.name}:")
+        for pc in range(0, len(code.code), 2):
+            op, arg = code.code[pc], code.code[pc + 1]
+            if op in (CONST, LOAD_GLOBAL, LOAD_DEEP, DEFINE, LOAD_SHARED):
+                detail = repr(code.consts[arg])
+            elif op == MAKE_CLOSURE:
+                detail = repr(code.consts[arg][2])
+                pending.append(code.consts[arg][2])
+                if code.consts[arg][3] is not None:
+                    pending.append(code.consts[arg][3][1])
+            elif op == BINARY:
+                detail = BINARY_OPERATORS[arg]
+            elif op == PREFIX:
+                detail = PREFIXES[arg]
+            else:
+                detail = str(arg)
+            lines.append(f"  {pc:>5} {OPCODE_NAMES[op]:<14}{detail}")
+    return "\n".join(lines)
+
+
+class BytecodeCompiler:
+    # Compiles a resolved AST to Code. Calls in tail position become TAIL_CALL and if-branches in tail
+    # position end in RETURN, so tail recursion runs in constant space like the tree walker
+    def compile_statement(self, node):
+        code = Code('<statement>')
+        self.emit_node(node, code, True, True)
+        code.emit(RETURN)
+        return code
+
+    def compile_function(self, name, body):
+        code = Code(name)
+        self.emit_node(body, code, True, False)
+        code.emit(RETURN)
+        return code
+
+    def emit_node(self, node, code, tail, top):
+        # top is set in statement code only: PREFIX records which error prefix applies, as the tree
+        # walker does for the first FuncApp/IfStmt it reaches. Function bodies only run inside a call.
+        if isinstance(node, (IntLit, BoolLit)):
+            code.emit(CONST, code.const(node.val))
+
+        elif isinstance(node, Identifier):
+            self.emit_lookup(node.id_name, node.depth, node.index, code)
+
+        elif isinstance(node, UnaryOp):
+            if node.op != '!':
+                raise TypeError(f"invalid unary operator: {node.op}")
+            self.emit_node(node.operand, code, False, top)
+            code.emit(NOT)
+
+        elif isinstance(node, BinOp):
+            self.emit_bin_op(node, code, tail, top)
+
+        elif isinstance(node, IfStmt):
+            if top:
+                code.emit(PREFIX, 1)
+            self.emit_node(node.cond, code, False, top)
+            to_else = code.emit(JUMP_IF_FALSE)
+            self.emit_node(node.then_branch, code, tail, top)
+            if tail:
+                code.emit(RETURN)
+            else:
+                to_end = code.emit(JUMP)
+            code.patch(to_else)
+            if node.else_branch is not None:
+                self.emit_node(node.else_branch, code, tail, top)
+            else:
+                code.emit(CONST, code.const(None))
+            if not tail:
+                code.patch(to_end)
+
+        elif isinstance(node, FuncApp):
+            if top:
+                code.emit(PREFIX, 0)
+            if isinstance(node.function, str):
+                self.emit_lookup(node.function, node.depth, node.index, code)
+            else:
+                self.emit_node(node.function, code, False, top)
+            for arg in node.arguments:
+                self.emit_node(arg, code, False, top)
+            code.emit(TAIL_CALL if tail else CALL, len(node.arguments))
+
+        elif isinstance(node, LambdaExpr):
+            body = self.compile_function('<lambda>', node.expr_body)
+            chain = flatten_chain(node)
+            if chain is not None:
+                chain = chain[0], self.compile_function('<lambda chain>', chain[1])
+            code.emit(MAKE_CLOSURE, code.const((LAMBDA, node.parameters, body, chain)))
+
+        elif isinstance(node, SharedExpr):
+            # LOAD_SHARED pushes the slot's value and jumps past the expression once it has been computed
+            target = [node.slot, None]
+            code.emit(LOAD_SHARED, code.const(target))
+            self.emit_node(node.expr, code, False, top)
+            code.emit(STORE_SHARED, node.slot)
+            target[1] = len(code.code)
+
+        elif isinstance(node, FuncDef):
+            body = self.compile_function(node.func_name, node.func_body)
+            code.emit(MAKE_CLOSURE, code.const((DEFUNC, node.parameters, body, None)))
+            code.emit(DEFINE, code.const(node.func_name))
+
+        else:
+            raise TypeError(f"Unknown node type: {type(node)}")
+
+    def emit_lookup(self, name, depth, index, code):
+        if depth is None:
+            code.emit(LOAD_GLOBAL, code.const(name))
+        elif depth == 0:
+            code.emit(LOAD_FAST, index)
+        elif depth == 1:
+            code.emit(LOAD_OUTER, index)
+        else:
+            code.emit(LOAD_DEEP, code.const((depth, index)))
+
+    def emit_bin_op(self, node, code, tail, top):
+        self.emit_node(node.left, code, False, top)
+        if node.op in ('||', '&&'):
+            # The right operand's value is the result when it is evaluated at all
+            skip = code.emit(OR_JUMP if node.op == '||' else AND_JUMP)
+            self.emit_node(node.right, code, tail, top)
+            code.patch(skip)
+            return
+        if node.op not in OPERATORS:
+            raise TypeError(f"Invalid operator: {node.op}")
+        self.emit_node(node.right, code, False, top)
+        code.emit(BINARY, BINARY_OPERATORS.index(node.op))
+
+
+class VMInterpreter(Interpreter):
+    # Runs each statement as bytecode on a stack machine: one value stack, and a list of call frames
+    # instead of Python recursion
+    def __init__(self, ast, memo=None):
+        super().__init__(ast, memo)
+        self.compiler = BytecodeCompiler()
+
+    def evaluate(self, node, context):
+        return self.run(self.compiler.compile_statement(node), context)
+
+    def run(self, code, env):
+        memo = self.memo
+        functions = BINARY_FUNCTIONS
+        stack = []
+        frames = []
+        instructions, consts = code.code, code.consts
+        pc = 0
+        error_prefix = None
+        try:
+            while True:
+                op = instructions[pc]
+                arg = instructions[pc + 1]
+                pc += 2
+
+                if op == LOAD_FAST:
+                    stack.append(env.slots[arg])
+
+                elif op == CONST:
+                    stack.append(consts[arg])
+
+                elif op == BINARY:
+                    right = stack.pop()
+                    stack[-1] = functions[arg](stack[-1], right)
+
+                elif op == JUMP_IF_FALSE:
+                    if not stack.pop():
+                        pc = arg
+
+                elif op == CALL or op == TAIL_CALL:
+                    if arg:
+                        args = stack[-arg:]
+                        del stack[-arg:]
+                    else:
+                        args = []
+                    func = stack.pop()
+                    if type(func) is not Closure:
+                        raise TypeError(f"Expected a function or lambda expression, but got: {func}")
+
+                    if func.kind == DEFUNC:
+                        if func.arity != len(args):
+                            raise TypeError(f"Function expected {func.arity} arguments but got {len(args)}")
+                        key = None
+                        if memo is not None and isinstance(func.env, Environment):
+                            key = memo.key(func, args)
+                            if key is not None:
+                                cached = memo.get(key)
+                                if cached is not MISSING:
+                                    stack.append(cached)
+                                    continue
+                        if op == CALL:
+                            frames.append((RETURN_TO, instructions, consts, pc, env))
+                        if key is not None:
+                            frames.append((MEMO, key))
+                        env = func.env.extend_scope(func.names, args)
+                        body = func.body
+
+                    else:  # Lambda expression: curried, one argument per application, or a whole chain at once
+                        if not args:
+                            stack.append(func)
+                            continue
+                        if op == CALL:
+                            frames.append((RETURN_TO, instructions, consts, pc, env))
+                        chain = func.chain
+                        count = len(chain[0]) if chain is not None and len(args) >= len(chain[0]) else 1
+                        if len(args) > count:
+                            frames.append((CURRY, args, count))
+                        if count > 1:
+                            env = func.env.extend_scope(chain[0], args[:count])
+                            body = chain[1]
+                        else:
+                            env = func.env.extend_scope(func.names, args[:1])
+                            body = func.body
+
+                    instructions, consts = body.code, body.consts
+                    pc = 0
+
+                elif op == RETURN:
+                    value = stack.pop()
+                    while frames:
+                        frame = frames.pop()
+                        kind = frame[0]
+                        if kind == RETURN_TO:
+                            instructions, consts, pc, env = frame[1], frame[2], frame[3], frame[4]
+                            stack.append(value)
+                            break
+                        elif kind == MEMO:
+                            memo.store(frame[1], value)
+                        else:  # CURRY: apply the next argument to the function just returned
+                            args, position = frame[1], frame[2]
+                            if position + 1 < len(args):
+                                frames.append((CURRY, args, position + 1))
+                            body, env = self.call(value, args[position])
+                            instructions, consts = body.code, body.consts
+                            pc = 0
+                            break
+                    else:
+                        return value
+
+                elif op == LOAD_OUTER:
+                    stack.append(env.parent.slots[arg])
+
+                elif op == LOAD_GLOBAL:
+                    stack.append(env.get(consts[arg]))
+
+                elif op == LOAD_DEEP:
+                    depth, index = consts[arg]
+                    stack.append(env.lookup(depth, index))
+
+                elif op == OR_JUMP:
+                    if stack[-1]:
+                        stack[-1] = True
+                        pc = arg
+                    else:
+                        stack.pop()
+
+                elif op == AND_JUMP:
+                    if not stack[-1]:
+                        stack[-1] = False
+                        pc = arg
+                    else:
+                        stack.pop()
+
+                elif op == JUMP:
+                    pc = arg
+
+                elif op == NOT:
+                    stack[-1] = not stack[-1]
+
+                elif op == MAKE_CLOSURE:
+                    kind, parameters, body, chain = consts[arg]
+                    stack.append(Closure(kind, parameters, body, env, chain))
+
+                elif op == DEFINE:
+                    env.define(consts[arg], stack.pop())
+                    if memo is not None:
+                        memo.clear()  # cached results may depend on the old definition
+                    stack.append(None)
+
+                elif op == PREFIX:
+                    if error_prefix is None:
+                        error_prefix = PREFIXES[arg]
+
+                elif op == LOAD_SHARED:
+                    slot, end = consts[arg]
+                    slots = env.slots
+                    if slot < len(slots) and slots[slot] is not Unset:
+                        stack.append(slots[slot])
+                        pc = end
+
+                elif op == STORE_SHARED:
+                    env.share(arg, stack[-1])
+
+                else:
+                    raise TypeError(f"Unknown opcode: {op}")
+
+        except Exception as e:
+            if error_prefix is None:
+                raise
+            raise EvaluationError(f"{error_prefix}: {str(e)}")
+
+    def call(self, func, arg):
+        # A single-argument application, for the rest of a curried call
+        if type(func) is not Closure:
+            raise TypeError(f"Expected a function or lambda expression, but got: {func}")
+        if func.arity != 1:
+            raise TypeError(f"Function expected {func.arity} arguments but got 1")
+        return func.body, func.env.extend_scope(func.names, [arg])